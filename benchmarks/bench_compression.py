@@ -0,0 +1,120 @@
+"""Bandwidth and latency trade-off of gzip compressed transport
+
+First compresses typical payloads (forecast of a ref time, measurement
+upload, pickled model, NWP response) at several gzip levels, and estimates
+the transfer time at a few link speeds: compress + send compressed +
+decompress, against sending the payload as is.
+
+Then uploads forecasts and fetches weather through the local mock API with
+and without compression, and reports wall time and bytes on the wire.
+
+    python benchmarks/bench_compression.py --levels 1 6 9 --mbits 10 100 1000
+"""
+import argparse
+import gzip
+import shutil
+import tempfile
+import time
+
+import dill
+import numpy as np
+import pandas as pd
+
+import rebase as rb
+import rebase.util.api_request as api_request
+import rebase.util.forecast_upload as forecast_upload
+import rebase.util.rate_limit as rate_limit
+from rebase.api.site import encode_measurements
+from rebase.util.mock_api import MockAPI
+from rebase.util.timestamps import to_ns
+
+
+def forecast_frame(n_ref_times, horizon=192):
+    ref = pd.date_range('2020-01-01', periods=n_ref_times, freq='1h', tz='UTC')
+    index = pd.MultiIndex.from_arrays([
+        np.repeat(ref, horizon),
+        np.repeat(ref, horizon) + pd.to_timedelta(np.tile(np.arange(horizon) * 15, n_ref_times), unit='min'),
+    ], names=['ref_datetime', 'valid_datetime'])
+    return pd.DataFrame({'forecast': np.random.default_rng(0).uniform(0, 1000, len(index)).round(2)}, index=index)
+
+
+def payloads(api):
+    batch = next(forecast_upload.iter_batches(forecast_frame(1)))
+    yield 'forecast', batch[0][1].encode('utf-8')
+
+    valid_time = pd.date_range('2020-01-01', periods=30 * 96, freq='15min', tz='UTC')
+    values = np.random.default_rng(0).uniform(0, 1000, len(valid_time)).round(1)
+    yield 'measurements 30D', encode_measurements(to_ns(valid_time), values)
+
+    weather = api._nwp_frame(pd.date_range('2020-01-01', periods=120, freq='6h', tz='UTC')).encode('utf-8')
+    yield 'nwp response', weather
+    yield 'pickled model', dill.dumps({'coef': np.random.default_rng(0).normal(size=(64, 64)),
+                                       'train_set': rb.json_to_df(weather)})
+
+
+def timed(func, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def bench_payloads(api, args):
+    header = '{:<18} {:>8} {:>5} {:>7} {:>8} {:>8}'.format('payload', 'KB', 'level', 'ratio', 'gzip ms', 'gunzip ms')
+    header += ''.join(' {:>13}'.format('{} Mbit/s ms'.format(m)) for m in args.mbits)
+    print(header)
+    for name, data in payloads(api):
+        plain = ''.join(' {:>13.1f}'.format(len(data) * 8 / (m * 1e6) * 1e3) for m in args.mbits)
+        print('{:<18} {:>8.1f} {:>5} {:>7} {:>8} {:>8}{}'.format(name, len(data) / 1e3, '-', '1.0', '-', '-', plain))
+        for level in args.levels:
+            t_compress, compressed = timed(lambda: gzip.compress(data, compresslevel=level))
+            t_decompress, _ = timed(lambda: gzip.decompress(compressed))
+            transfer = ''.join(' {:>13.1f}'.format(
+                (t_compress + t_decompress + len(compressed) * 8 / (m * 1e6)) * 1e3) for m in args.mbits)
+            print('{:<18} {:>8.1f} {:>5} {:>7.1f} {:>8.2f} {:>8.2f}{}'.format(
+                '', len(compressed) / 1e3, level, len(data) / len(compressed),
+                t_compress * 1e3, t_decompress * 1e3, transfer))
+
+
+def bench_mock(args):
+    forecasts = forecast_frame(args.ref_times)
+    params = {'model': 'bench', 'start_date': '2020-01-01T00:00:00Z', 'end_date': '2020-07-01T00:00:00Z'}
+    print('\n{:<28} {:>10} {:>12}'.format('through mock API', 's', 'MB on wire'))
+    for compress in (False, True):
+        with MockAPI(latency=args.latency, compress_responses=1 if compress else 0) as api:
+            elapsed, _ = timed(lambda: forecast_upload.upload([('bench', forecasts)], compress=compress), repeat=1)
+            print('{:<28} {:>10.3f} {:>12.2f}'.format(
+                'forecast upload, gzip={}'.format(compress), elapsed, api.bytes_on_wire / 1e6))
+
+            def fetch():
+                shutil.rmtree(rb.cache_dir, ignore_errors=True)
+                return rb.Weather.historical(params)
+
+            elapsed, _ = timed(fetch, repeat=1)
+            print('{:<28} {:>10.3f} {:>12.2f}'.format(
+                'weather fetch, gzip={}'.format(compress), elapsed, api.bytes_sent / 1e6))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--levels', type=int, nargs='+', default=[1, 6, 9])
+    parser.add_argument('--mbits', type=float, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--ref-times', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=0.0)
+    args = parser.parse_args()
+
+    rate_limit.enabled = False
+    rb.cache_dir = tempfile.mkdtemp()
+    try:
+        bench_payloads(MockAPI(), args)
+        bench_mock(args)
+    finally:
+        api_request.close_session()
+        shutil.rmtree(rb.cache_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
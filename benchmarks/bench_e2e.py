@@ -0,0 +1,263 @@
+"""End-to-end SDK benchmarks against the local mock API
+
+Runs ``rebase`` against :class:`rebase.util.mock_api.MockAPI` and measures
+request throughput, upload throughput, weather fetch and decode time,
+``ModelRunner.predict`` latency, ``ModelRunner.backtest`` and
+``FleetRunner`` throughput, peak memory and the private memory of worker
+processes sharing memory mapped weather, and the time to prune the cache. Exits with an error when a
+result is worse than its threshold, so regressions are caught.
+
+The mock server runs in the same process, so results include the time it
+takes to build and parse payloads and are lower bounds of the SDK speed.
+The client side rate limiter runs with its default budgets, as shipped,
+unless ``--no-rate-limit`` is given.
+
+    python benchmarks/bench_e2e.py
+    python benchmarks/bench_e2e.py --latency 0.005 --no-check
+"""
+import argparse
+import gc
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import dill
+import numpy as np
+import pandas as pd
+
+import rebase as rb
+import rebase.util.artifact_cache as artifact_cache
+import rebase.util.forecast_upload as forecast_upload
+import rebase.util.rate_limit as rate_limit
+from rebase.util.mock_api import MockAPI
+
+# name: (unit, 'min' or 'max', threshold), thresholds are for the defaults
+# with --latency 0, about half the speed of a laptop
+THRESHOLDS = {
+    'site_get': ('req/s', 'min', 250),
+    'site_get_cached': ('req/s', 'min', 20000),
+    'forecast_many': ('sites/s', 'min', 80),
+    'upload_stream': ('MB/s', 'min', 2),
+    'forecast_upload': ('ref/s', 'min', 150),
+    'weather_historical': ('s', 'max', 6),
+    'weather_historical_peak': ('MB', 'max', 150),
+    'weather_windowed': ('s', 'max', 6),
+    'weather_cached': ('s', 'max', 0.25),
+    'weather_compact_size': ('x size', 'max', 0.7),
+    'weather_mmap_private': ('x size', 'max', 0.2),
+    'cache_prune': ('s', 'max', 1),
+    'model_predict': ('s', 'max', 0.25),
+    'model_backtest': ('ref/s', 'min', 10000),
+    'fleet_run': ('models/s', 'min', 20),
+    'artifact_load_peak': ('x size', 'max', 1.3),
+    'artifact_zero_copy_peak': ('x size', 'max', 0.1),
+}
+
+
+class BenchModel(rb.Model):
+
+    def load_data(self, site_config, start_date, end_date):
+        params = {'model': 'bench', 'start_date': start_date, 'end_date': end_date}
+        return rb.Weather.historical(params), None
+
+    def load_latest_data(self, site_config):
+        return rb.Weather.operational({'model': 'bench', 'latitude': site_config['latitude']}), None
+
+    def preprocess(self, weather_df, observation_data=None):
+        return weather_df
+
+    def predict(self, model, dataset):
+        return dataset.to_numpy() @ model['coef']
+
+
+def timed(func, repeat=1):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def peak_memory(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def private_memory():
+    # Anonymous memory, i.e. not backed by a file such as a mapped store
+    with open('/proc/self/smaps_rollup') as f:
+        return sum(int(line.split()[1]) * 1024 for line in f if line.startswith('Anonymous:'))
+
+
+def load_mapped(cache_dir, params, repeat=5):
+    rb.cache_dir = cache_dir
+    # The first load allocates the modules and buffers every load uses, the
+    # weather is measured by the private memory each further load adds. The
+    # frames are kept, so their memory is not reused by the next load
+    frames = [rb.Weather.historical(params, mmap=True)]
+    added = []
+    for _ in range(repeat):
+        gc.collect()
+        before = private_memory()
+        df = rb.Weather.historical(params, mmap=True)
+        # Read every value, so all pages are mapped
+        sum(float(values.sum()) for _, values in df.items())
+        frames.append(df)
+        added.append(private_memory() - before)
+    return float(np.median(added))
+
+
+def bench_requests(api, args):
+    site_ids = list(api.sites)
+    elapsed, _ = timed(lambda: [rb.Site.get(site_ids[i % len(site_ids)], max_age=0) for i in range(args.calls)])
+    yield 'site_get', args.calls / elapsed
+    rb.Site.list()
+    calls = api.calls[('GET', 'site')]
+    elapsed, _ = timed(lambda: [rb.Site.get(site_ids[i % len(site_ids)]) for i in range(args.calls)])
+    assert api.calls[('GET', 'site')] == calls
+    yield 'site_get_cached', args.calls / elapsed
+    elapsed, df = timed(lambda: rb.Site.forecast_many(site_ids, n_jobs=args.n_jobs))
+    assert df.index.get_level_values('site_id').nunique() == len(site_ids)
+    yield 'forecast_many', len(site_ids) / elapsed
+
+
+def bench_uploads(api, args):
+    df = pd.DataFrame({
+        'valid_time': pd.date_range('2020-01-01', periods=args.upload_rows, freq='15min', tz='UTC'),
+        'observation': np.random.default_rng(0).uniform(0, 1000, args.upload_rows).round(1),
+    })
+    received = api.bytes_received
+    elapsed, _ = timed(lambda: rb.Site.upload_stream(next(iter(api.sites)), df, chunk_freq='30D', n_jobs=args.n_jobs, resume=False))
+    yield 'upload_stream', (api.bytes_received - received) / 1e6 / elapsed
+
+    n_ref_times = args.upload_rows // 192
+    ref = pd.date_range('2020-01-01', periods=n_ref_times, freq='1h', tz='UTC')
+    index = pd.MultiIndex.from_arrays([
+        np.repeat(ref, 192),
+        np.repeat(ref, 192) + pd.to_timedelta(np.tile(np.arange(192) * 15, n_ref_times), unit='min'),
+    ], names=['ref_datetime', 'valid_datetime'])
+    forecasts = pd.DataFrame({'forecast': np.random.default_rng(0).uniform(0, 1000, len(index)).round(2)}, index=index)
+    calls = api.calls[('POST', 'model/custom/forecast/upload')]
+    elapsed, results = timed(lambda: forecast_upload.upload([('bench', forecasts)], n_jobs=args.n_jobs))
+    assert all(r['ok'] for r in results)
+    assert api.calls[('POST', 'model/custom/forecast/upload')] - calls == n_ref_times
+    yield 'forecast_upload', n_ref_times / elapsed
+
+
+def bench_weather(api, args):
+    params = {'model': 'bench', 'start_date': '2020-01-01T00:00:00Z', 'end_date': args.weather_end}
+
+    def fetch():
+        shutil.rmtree(rb.cache_dir, ignore_errors=True)
+        return rb.Weather.historical(params)
+
+    elapsed, df = timed(fetch, repeat=args.repeat)
+    yield 'weather_historical', elapsed
+    yield 'weather_historical_peak', peak_memory(fetch) / 1e6
+
+    def fetch_windowed():
+        shutil.rmtree(rb.cache_dir, ignore_errors=True)
+        return rb.Weather.historical(params, window='30D', n_jobs=args.n_jobs)
+
+    elapsed, windowed = timed(fetch_windowed, repeat=args.repeat)
+    pd.testing.assert_frame_equal(df, windowed)
+    yield 'weather_windowed', elapsed
+    elapsed, cached = timed(lambda: rb.Weather.historical(params), repeat=args.repeat)
+    pd.testing.assert_frame_equal(df, cached)
+    yield 'weather_cached', elapsed
+    compact = rb.Weather.historical(params, dtype='float32')
+    yield 'weather_compact_size', rb.memory_report(compact)['total'] / rb.memory_report(df)['total']
+
+    # Private memory added by a load of 4 worker processes mapping the same
+    # weather, median of 5 loads, relative to its size. Workers are spawned,
+    # as forked workers would copy pages of this process they touch
+    if os.path.exists('/proc/self/smaps_rollup'):
+        pd.testing.assert_frame_equal(df, rb.Weather.historical(params, mmap=True))
+        with multiprocessing.get_context('spawn').Pool(4) as pool:
+            private = pool.starmap(load_mapped, [(rb.cache_dir, params)] * 4)
+        yield 'weather_mmap_private', max(private) / rb.memory_report(df)['total']
+
+    # Evict least recently used entries down to half the size of the cache
+    quota = rb.cache.stats()['bytes'] // 2
+    elapsed, _ = timed(lambda: rb.cache.prune(max_bytes=quota))
+    assert rb.cache.stats()['bytes'] <= quota
+    yield 'cache_prune', elapsed
+
+
+def bench_model(api, args):
+    model_id = api.add_model(next(iter(api.sites)),
+                             code=dill.dumps(BenchModel, recurse=True),
+                             trained=dill.dumps({'coef': np.ones(api.n_variables)}))
+    runner = rb.ModelRunner(model_id)
+    elapsed, df = timed(runner.predict, repeat=args.repeat)
+    assert len(df) == api.horizon
+    yield 'model_predict', elapsed
+    elapsed, df = timed(lambda: runner.backtest('2020-01-01T00:00:00Z', args.weather_end, batch_size=100), repeat=args.repeat)
+    yield 'model_backtest', df.index.get_level_values('ref_datetime').nunique() / elapsed
+
+    # 5 models per site for 20 sites, predicted and uploaded in one cycle
+    code = dill.dumps(BenchModel, recurse=True)
+    trained = dill.dumps({'coef': np.ones(api.n_variables)})
+    model_ids = [api.add_model(site_id, code=code, trained=trained) for site_id in list(api.sites)[:20] for _ in range(5)]
+    elapsed, result = timed(lambda: rb.FleetRunner(model_ids, n_jobs=args.n_jobs).run(), repeat=args.repeat)
+    assert not result['errors'] and not result['load_errors']
+    yield 'fleet_run', len(model_ids) / elapsed
+
+    # Peak memory of loading a 40 MB trained model, relative to its size
+    trained = {'coef': np.random.default_rng(0).normal(size=(1000, 5000))}
+    for name, data in [('artifact_load_peak', dill.dumps(trained)),
+                       ('artifact_zero_copy_peak', artifact_cache.dumps_zero_copy(trained))]:
+        model_id = api.add_model(next(iter(api.sites)), trained=data)
+        artifact_cache.clear_memory()
+        path = 'platform/v1/model/custom/download/trained/{}'.format(model_id)
+        peak = peak_memory(lambda: artifact_cache.load(model_id, path))
+        yield name, peak / len(data)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sites', type=int, default=200)
+    parser.add_argument('--calls', type=int, default=1000)
+    parser.add_argument('--upload-rows', type=int, default=200000)
+    parser.add_argument('--weather-end', default='2021-01-01T00:00:00Z')
+    parser.add_argument('--n-jobs', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-rate-limit', action='store_true', help='turn the client side rate limiter off')
+    parser.add_argument('--no-check', action='store_true')
+    args = parser.parse_args()
+
+    rate_limit.enabled = not args.no_rate_limit
+    rb.cache_dir = tempfile.mkdtemp()
+    failed = []
+    print('{:<26} {:>12} {:<8} {:>12}'.format('benchmark', 'result', 'unit', 'threshold'))
+    try:
+        with MockAPI(n_sites=args.sites, latency=args.latency) as api:
+            for bench in (bench_requests, bench_uploads, bench_weather, bench_model):
+                for name, value in bench(api, args):
+                    unit, kind, threshold = THRESHOLDS[name]
+                    ok = value >= threshold if kind == 'min' else value <= threshold
+                    if not ok:
+                        failed.append(name)
+                    print('{:<26} {:>12.3f} {:<8} {:>3} {:>8} {}'.format(
+                        name, value, unit, kind, threshold, '' if ok else 'FAIL'))
+    finally:
+        shutil.rmtree(rb.cache_dir, ignore_errors=True)
+
+    if failed and not args.no_check:
+        print('Regressions: {}'.format(', '.join(failed)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""Import time of the rebase package
+
+Times ``import rebase`` and the first access of a few API entry points in
+fresh interpreters, and checks which heavy dependencies they load. Exits
+with an error when a time exceeds its threshold or a light entry point
+loads pandas, so startup regressions are caught.
+
+    python benchmarks/bench_import.py --repeat 5
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+HEAVY_MODULES = ['pandas', 'numpy', 'dill', 'joblib', 'requests']
+
+CASES = [
+    # (name, statement, max ms, modules that must not be loaded)
+    ('import rebase', 'import rebase', 50, HEAVY_MODULES),
+    ('rebase.Layer', 'import rebase; rebase.Layer', 300, ['pandas', 'numpy', 'dill', 'joblib']),
+    ('rebase.Site', 'import rebase; rebase.Site', 2000, []),
+    ('rebase.ModelRunner', 'import rebase; rebase.ModelRunner', 2500, []),
+]
+
+SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'ms': elapsed * 1e3, 'modules': [m for m in {modules!r} if m in sys.modules]}}))
+'''
+
+
+def run(statement):
+    script = SCRIPT.format(statement=statement, modules=HEAVY_MODULES)
+    out = subprocess.run([sys.executable, '-c', script], check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    failed = False
+    print('{:<22} {:>10} {:>10}  {}'.format('case', 'ms', 'max ms', 'heavy modules loaded'))
+    for name, statement, max_ms, forbidden in CASES:
+        results = [run(statement) for _ in range(args.repeat)]
+        ms = min(r['ms'] for r in results)
+        modules = results[0]['modules']
+        ok = ms <= max_ms and not set(modules) & set(forbidden)
+        failed |= not ok
+        print('{:<22} {:>10.1f} {:>10} {} {}'.format(name, ms, max_ms, '' if ok else ' FAIL', modules))
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
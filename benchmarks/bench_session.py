@@ -0,0 +1,44 @@
+"""Per-call latency of pooled keep-alive sessions vs one-off requests
+
+Runs :class:`rebase.util.mock_api.MockAPI` on localhost and times
+``api_request.get`` against plain ``requests.get``.
+
+    python benchmarks/bench_session.py --calls 500
+"""
+import argparse
+import time
+
+import requests
+
+import rebase as rb
+import rebase.util.api_request as api_request
+import rebase.util.rate_limit as rate_limit
+from rebase.util.mock_api import MockAPI
+
+
+def timed(func, n_calls):
+    start = time.perf_counter()
+    for _ in range(n_calls):
+        r = func()
+        assert r.status_code == 200
+    return (time.perf_counter() - start) / n_calls
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--calls', type=int, default=500)
+    args = parser.parse_args()
+
+    rate_limit.enabled = False
+    path = 'platform/v1/layer/list'
+    with MockAPI():
+        one_off = timed(lambda: requests.get(rb.base_api_url+path), args.calls)
+        pooled = timed(lambda: api_request.get(path), args.calls)
+
+    print('requests.get      {:8.3f} ms/call'.format(one_off * 1e3))
+    print('api_request.get   {:8.3f} ms/call'.format(pooled * 1e3))
+    print('saved per call    {:8.3f} ms ({:.1f}x)'.format((one_off - pooled) * 1e3, one_off / pooled))
+
+
+if __name__ == '__main__':
+    main()
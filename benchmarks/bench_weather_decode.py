@@ -0,0 +1,76 @@
+"""Decode time and peak memory of NWP responses
+
+Compares ``rebase.api.weather.json_to_df`` with the previous
+``pd.read_json`` based decoding on synthetic payloads of several sizes.
+
+    python benchmarks/bench_weather_decode.py --sizes 10000 100000 1000000
+"""
+import argparse
+import io
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from rebase.api.weather import json_to_df
+
+
+def read_json_to_df(json_data):
+    df = pd.read_json(io.StringIO(json_data))
+    df.index = pd.MultiIndex.from_arrays(
+             [pd.to_datetime(df['ref_datetime'].values),
+             pd.to_datetime(df['valid_datetime'].values)],
+             names=['ref_datetime', 'valid_datetime'])
+    df = df.drop(columns=['ref_datetime', 'valid_datetime'])
+    return df
+
+
+def make_payload(n_rows, n_variables=4, horizon=48):
+    n_runs = max(n_rows // horizon, 1)
+    ref = pd.date_range('2020-01-01', periods=n_runs, freq='6h', tz='UTC')
+    ref_times = np.repeat(ref, horizon)[:n_rows]
+    valid_times = ref_times + pd.to_timedelta(np.tile(np.arange(horizon), n_runs)[:n_rows], unit='h')
+    fmt = '%Y-%m-%dT%H:%M:%SZ'
+    columns = {
+        'ref_datetime': ref_times.strftime(fmt),
+        'valid_datetime': valid_times.strftime(fmt),
+    }
+    rng = np.random.default_rng(0)
+    for i in range(n_variables):
+        columns['var_{}'.format(i)] = rng.normal(size=len(ref_times)).round(3)
+    return pd.DataFrame(columns).to_json(orient='records')
+
+
+def measure(func, payload, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(payload)
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    func(payload)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(times), peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 500000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print('{:>10} {:>10} {:>12} {:>12} {:>12} {:>12}'.format(
+        'rows', 'MB', 'read_json s', 'json_to_df s', 'read_json MB', 'json_to_df MB'))
+    for n_rows in args.sizes:
+        payload = make_payload(n_rows)
+        old_time, old_peak = measure(read_json_to_df, payload, args.repeat)
+        new_time, new_peak = measure(json_to_df, payload, args.repeat)
+        pd.testing.assert_frame_equal(read_json_to_df(payload), json_to_df(payload))
+        print('{:>10} {:>10.1f} {:>12.3f} {:>12.3f} {:>12.1f} {:>12.1f}'.format(
+            n_rows, len(payload) / 1e6, old_time, new_time, old_peak / 1e6, new_peak / 1e6))
+
+
+if __name__ == '__main__':
+    main()
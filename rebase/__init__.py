@@ -1,13 +1,73 @@
-from os import makedirs
+import importlib
+import os
 
 api_key = None
 base_api_url = 'https://api.rebase.energy/'
 #base_api_url = 'https://dev-api.rebase.energy/'
 cache_dir = './cache'
 
-try:
-	makedirs(cache_dir, exist_ok=True)
-except Exception as e:
-	print(f"Exception while initializing cache: {e}")
 
-from rebase.api import *
+def ensure_cache_dir(*parts):
+	"""Create cache_dir, or a directory inside it, if it doesn't exist
+
+	The cache directory is created when it is first used rather than when
+	rebase is imported.
+
+	Returns:
+		str: path of the directory
+	"""
+	path = os.path.join(cache_dir, *parts)
+	try:
+		os.makedirs(path, exist_ok=True)
+	except Exception as e:
+		print(f"Exception while initializing cache: {e}")
+	return path
+
+
+# The API is loaded on first access, so that importing rebase doesn't pull
+# in pandas, dill etc. until they are needed
+_lazy_attrs = {
+	'api': 'rebase.api',
+	'aio': 'rebase.aio',
+	'cache': 'rebase.cache',
+	'Predicter': 'rebase.api.predicter',
+	'Model': 'rebase.api.predicter',
+	'Site': 'rebase.api.site',
+	'SiteTemplate': 'rebase.api.site',
+	'Weather': 'rebase.api.weather',
+	'json_to_df': 'rebase.api.weather',
+	'records_to_df': 'rebase.api.weather',
+	'resample': 'rebase.api.weather',
+	'get_cached_weather': 'rebase.api.weather',
+	'save_cached_weather': 'rebase.api.weather',
+	'create': 'rebase.api.backend',
+	'update': 'rebase.api.backend',
+	'train': 'rebase.api.backend',
+	'hyperparam_search': 'rebase.api.backend',
+	'report_result': 'rebase.api.backend',
+	'hyperparam_results': 'rebase.api.backend',
+	'ModelRunner': 'rebase.api.runner',
+	'FleetRunner': 'rebase.api.runner',
+	'Layer': 'rebase.api.layer',
+	'compact': 'rebase.util.compact',
+	'memory_report': 'rebase.util.compact',
+	'stats': 'rebase.util.metrics',
+	'add_hook': 'rebase.util.metrics',
+	'remove_hook': 'rebase.util.metrics',
+}
+
+__all__ = ['api_key', 'base_api_url', 'cache_dir', 'ensure_cache_dir'] + list(_lazy_attrs)
+
+
+def __getattr__(name):
+	module_name = _lazy_attrs.get(name)
+	if module_name is None:
+		raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+	module = importlib.import_module(module_name)
+	value = module if module_name == f'{__name__}.{name}' else getattr(module, name)
+	globals()[name] = value
+	return value
+
+
+def __dir__():
+	return sorted(set(globals()) | set(_lazy_attrs))
@@ -0,0 +1,31 @@
+import importlib
+
+# Submodules are imported on first access, see rebase/__init__.py
+_lazy_attrs = {
+    'set_concurrency': 'rebase.aio.api_request',
+    'close': 'rebase.aio.api_request',
+    'Site': 'rebase.aio.site',
+    'Weather': 'rebase.aio.weather',
+    'Layer': 'rebase.aio.layer',
+    'create': 'rebase.aio.backend',
+    'update': 'rebase.aio.backend',
+    'train': 'rebase.aio.backend',
+    'hyperparam_search': 'rebase.aio.backend',
+    'report_result': 'rebase.aio.backend',
+    'hyperparam_results': 'rebase.aio.backend',
+}
+
+__all__ = list(_lazy_attrs)
+
+
+def __getattr__(name):
+    module_name = _lazy_attrs.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module_name), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_attrs))
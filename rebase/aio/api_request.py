@@ -0,0 +1,175 @@
+import asyncio
+import json
+import random
+import time
+import weakref
+import rebase as rb
+from rebase.error import AuthenticationError
+from rebase.util.api_request import auth_headers, compress_body
+import rebase.util.rate_limit as rate_limit
+import rebase.util.metrics as metrics
+
+# Max number of requests in flight per event loop, change it with
+# set_concurrency()
+max_concurrency = 100
+
+_sessions = weakref.WeakKeyDictionary()
+_semaphores = weakref.WeakKeyDictionary()
+
+
+def _aiohttp():
+    try:
+        import aiohttp
+    except ImportError:
+        raise ImportError(
+            'rebase.aio requires aiohttp, install it with: pip install rebase-toolkit[aio]'
+        )
+    return aiohttp
+
+
+class Response():
+    """The buffered response of an async request
+
+    Has the same attributes as ``requests.Response`` that are used by the
+    sync API so that responses can be handled the same way.
+    """
+
+    def __init__(self, status_code, content, headers):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def json(self):
+        return json.loads(self.content)
+
+
+def set_concurrency(n):
+    """Set the max number of requests in flight per event loop
+
+    Args:
+        n (int): max number of concurrent requests
+
+    Example::
+
+        >>> rb.aio.set_concurrency(200)
+    """
+    global max_concurrency
+    max_concurrency = n
+    _semaphores.clear()
+
+
+def get_session():
+    """Get the HTTP session of the running event loop
+
+    Returns:
+        aiohttp.ClientSession: session shared by all requests on the loop
+    """
+    aiohttp = _aiohttp()
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(limit=max_concurrency)
+        session = aiohttp.ClientSession(connector=connector)
+        _sessions[loop] = session
+    return session
+
+
+def _semaphore():
+    loop = asyncio.get_running_loop()
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(max_concurrency)
+        _semaphores[loop] = semaphore
+    return semaphore
+
+
+async def close():
+    """Close the session of the running event loop
+
+    Should be awaited before the loop is closed.
+    """
+    session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
+
+
+def _clean_params(params):
+    # requests drops None values and str() formats the rest, aiohttp only
+    # accepts str, int and float
+    if params is None:
+        return None
+    return {
+        k: v if isinstance(v, (str, int, float)) and not isinstance(v, bool) else str(v)
+        for k, v in params.items() if v is not None
+    }
+
+
+def robust(max_tries=5, retry_statuses=[429]):
+    # Same as rebase.util.api_request.robust, sharing its token buckets
+    def decorator(func):
+        async def handle_call(path, *args, **kwargs):
+            bucket = rate_limit.limiter(path) if rate_limit.enabled else None
+            n_try = 0
+            while True:
+                if bucket is not None:
+                    delay = bucket.reserve()
+                    while delay > 0:
+                        metrics.inc('rebase_rate_limit_wait_seconds_total', delay, endpoint=rate_limit.endpoint_class(path))
+                        await asyncio.sleep(delay)
+                        # Reserved before a 429 paused the bucket, queue
+                        # again behind the pause
+                        delay = bucket.reserve() if bucket.paused() else 0
+                sent = time.monotonic()
+                response = await func(path, *args, **kwargs)
+                if response.status_code in retry_statuses:
+                    if bucket is not None:
+                        bucket.throttled(rate_limit.retry_after(response), sent)
+                    if n_try < max_tries:
+                        metrics.inc('rebase_retries_total', endpoint=rate_limit.endpoint_class(path))
+                        if bucket is None:
+                            await asyncio.sleep(rate_limit.retry_after(response) or min(2**n_try * (1+random.random()), 300))
+                        n_try += 1
+                    else:
+                        return response
+                else:
+                    if bucket is not None:
+                        bucket.succeeded()
+                    return response
+        return handle_call
+    return decorator
+
+
+async def _request(method, path, headers, extra_headers=None, params=None, compress=False, **kwargs):
+    url = rb.base_api_url+path
+    if extra_headers:
+        headers = dict(headers, **extra_headers)
+    if compress is not False:
+        kwargs['data'], encoding_headers = compress_body(kwargs.get('data'), compress)
+        headers = dict(headers, **encoding_headers)
+    headers = {k: v for k, v in headers.items() if v is not None}
+    async with _semaphore():
+        start = time.perf_counter()
+        async with get_session().request(method, url, params=_clean_params(params), headers=headers, **kwargs) as r:
+            response = Response(r.status, await r.read(), r.headers)
+        metrics.record_request(method, path, response.status_code, time.perf_counter() - start,
+                               data=kwargs.get('data'), response_bytes=len(response.content))
+    if response.status_code == 401:
+        raise AuthenticationError('Unathorized')
+
+    return response
+
+@robust(max_tries=10, retry_statuses=[429])
+async def get(path, headers=None, **kwargs):
+    return await _request('GET', path, auth_headers(), headers, **kwargs)
+
+@robust(max_tries=10, retry_statuses=[429])
+async def post(path, headers=None, **kwargs):
+    return await _request('POST', path, auth_headers('application/json'), headers, **kwargs)
+
+@robust(max_tries=10, retry_statuses=[429])
+async def delete(path, headers=None, **kwargs):
+    return await _request('DELETE', path, auth_headers(), headers, **kwargs)
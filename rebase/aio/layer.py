@@ -0,0 +1,48 @@
+from rebase.error import InvalidInputError, NotFoundError
+import rebase.aio.api_request as api_request
+import json
+
+class Layer():
+    """Async version of :class:`rebase.Layer`
+    """
+
+    base_path = 'platform/v1'
+
+    @classmethod
+    async def create(cls, packages):
+        path = '{}/layer/create'.format(cls.base_path)
+        data = json.dumps({'packages': packages})
+        response = await api_request.post(path, data=data)
+        if response.status_code == 400:
+            raise InvalidInputError(response.text)
+        return response.json()
+
+    @classmethod
+    async def delete(cls, id):
+        path = '{}/layer/{}'.format(cls.base_path, id)
+        response = await api_request.delete(path)
+        if response.status_code == 404:
+            raise NotFoundError(response.text)
+        print(response.text)
+
+    @classmethod
+    async def get(cls, id):
+        path = '{}/layer/{}'.format(cls.base_path, id)
+        response = await api_request.get(path)
+        if response.status_code == 404:
+            raise NotFoundError(response.text)
+        return response.json()
+
+    @classmethod
+    async def list(cls):
+        path = '{}/layer/list'.format(cls.base_path)
+        response = await api_request.get(path)
+        return response.json()
+
+    @classmethod
+    async def status(cls, id):
+        path = '{}/layer/status/{}'.format(cls.base_path, id)
+        response = await api_request.get(path)
+        if response.status_code == 404:
+            raise NotFoundError(response.text)
+        return response.json()
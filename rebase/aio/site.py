@@ -0,0 +1,112 @@
+import copy
+import json
+import rebase.aio.api_request as api_request
+import rebase.util.site_cache as site_cache
+from rebase.api.site import observation_to_df, forecast_to_dict, train_status, measurement_data, _get_flight
+
+
+class Site():
+    """Async version of :class:`rebase.Site`
+
+    Example::
+
+        >>> data = await rb.aio.Site.forecast(site_id)
+    """
+
+    base_path = 'platform/v1'
+
+    @classmethod
+    async def create(cls, site_config):
+        path = '{}/site/create'.format(cls.base_path)
+        response = await api_request.post(path, data=json.dumps(site_config))
+        site_id = response.json()
+        if isinstance(site_id, str):
+            site_cache.invalidate(site_id)
+        return site_id
+
+    @classmethod
+    async def get(cls, site_id, max_age=None):
+        config = site_cache.get(site_id, max_age=max_age)
+        if config is not None:
+            return config
+        return await _get_flight.do_async(site_id, cls._fetch, site_id, copy=copy.deepcopy)
+
+    @classmethod
+    async def _fetch(cls, site_id):
+        r = await api_request.get('{}/site/{}'.format(cls.base_path, site_id))
+        config = r.json()
+        if r.status_code == 200:
+            site_cache.put(site_id, config)
+        return config
+
+    @classmethod
+    async def delete(cls, site_id):
+        path = '{}/site/{}'.format(cls.base_path, site_id)
+        response = await api_request.delete(path)
+        site_cache.invalidate(site_id)
+        if response.status_code == 200:
+            print('Success. Site: {} was deleted.'.format(site_id))
+        else:
+            raise Exception('Delete site failed. Site: {} was NOT deleted. API status code: {}'.format(site_id, response.status_code))
+
+    @classmethod
+    async def observation(cls, site_id, start_date, end_date=None, dtype=None):
+        path = '{}/site/observation/{}'.format(cls.base_path, site_id)
+        params = {
+            'start_date': start_date,
+            'end_date': end_date
+        }
+        response = await api_request.get(path, params=params)
+        if response.status_code == 200:
+            return observation_to_df(response.json(), dtype=dtype)
+        else:
+            print(response.status_code)
+
+        return None
+
+    @classmethod
+    async def forecast(cls, site_id, type='prioritized', dtype=None):
+        path = '{}/site/forecast/latest/{}'.format(cls.base_path, site_id)
+        response = await api_request.get(path, params={'type': type})
+        if response.status_code == 200:
+            return forecast_to_dict(response.json(), dtype=dtype)
+
+    @classmethod
+    async def list(cls):
+        path = '{}/sites'.format(cls.base_path)
+        response = await api_request.get(path)
+        sites = response.json()
+        if response.status_code == 200 and isinstance(sites, list):
+            site_cache.warm(sites)
+        return sites
+
+    @classmethod
+    async def predicters(cls, site_id):
+        path = '{}/site/models/{}'.format(cls.base_path, site_id)
+        response = await api_request.get(path)
+        return response.json()
+
+    @classmethod
+    async def train(cls, site_id):
+        path = '{}/site/train/{}'.format(cls.base_path, site_id)
+        response = await api_request.post(path)
+        if response.status_code == 200:
+            print("Success! Queued training for site: {}".format(site_id))
+        else:
+            raise Exception('Failed for site: {}. API status code: {}'.format(site_id, response.status_code))
+
+    @classmethod
+    async def status(cls, site_id):
+        path = '{}/site/train/state/{}'.format(cls.base_path, site_id)
+        r = await api_request.get(path)
+        return train_status(r)
+
+    @classmethod
+    async def upload(cls, site_id, df):
+        path = '{}/site/measurement/upload_2/{}'.format(cls.base_path, site_id)
+        df = df.dropna()
+        response = await api_request.post(path, data=json.dumps(measurement_data(df)))
+        if response.status_code == 200:
+            print("Success! Data from {} to {} was uploaded.".format(df.iloc[0]['valid_time'], df.iloc[-1]['valid_time']))
+        else:
+            print(response.status_code)
@@ -0,0 +1,148 @@
+import asyncio
+import json
+import pandas as pd
+import rebase.aio.api_request as api_request
+import rebase.util.metrics as metrics
+from rebase.api.weather import Weather as SyncWeather
+from rebase.api.weather import json_to_df, resample, response_to_df, get_cached_weather, save_cached_weather, cache_file_path
+from rebase.api.weather import cache_store_path, _write_store, _shallow_copy
+from rebase.api.weather import _historical_flight, _operational_flight
+from rebase.util.weather_cache import WeatherCache, split_intervals, format_timestamp
+from rebase.util.compact import compact
+import rebase.util.weather_store as weather_store
+
+
+class Weather():
+    """Async version of :class:`rebase.Weather`
+
+    Decoding of the response and reading and writing the cache run in the
+    default executor so that large payloads and file locks don't block the
+    event loop.
+
+    Example::
+
+        >>> df = await rb.aio.Weather.historical(params)
+    """
+
+    @classmethod
+    async def historical(cls, params, resolution=None, agg='mean', window=None, max_tries=3, dtype=None,
+                         mmap=False):
+        """Get historical NWP data, see :meth:`rebase.Weather.historical`
+
+        With ``window`` the windows are fetched concurrently, bounded by
+        :func:`rebase.aio.api_request.set_concurrency`.
+        """
+        # Tasks asking for the same params at the same time share one fetch
+        key = json.dumps({'params': params, 'dtype': dtype, 'mmap': mmap}, sort_keys=True)
+        df = await _historical_flight.do_async(key, cls._historical, params, window, max_tries, dtype, mmap,
+                                               copy=_shallow_copy if mmap else pd.DataFrame.copy)
+
+        if resolution:
+            df = await asyncio.get_running_loop().run_in_executor(None, resample, df, resolution, agg)
+            if dtype:
+                df = compact(df, dtype)
+
+        return df
+
+    @classmethod
+    async def _historical(cls, params, window, max_tries, dtype=None, mmap=False):
+        cache = WeatherCache.for_params(params)
+        if cache is not None and await asyncio.get_running_loop().run_in_executor(None, cache.columnar):
+            df = await cls._historical_range(cache, window, max_tries, dtype, mmap)
+            if df is not None:
+                return df
+        return await cls._historical_file(params, dtype, mmap)
+
+    @classmethod
+    async def _historical_file(cls, params, dtype=None, mmap=False):
+        loop = asyncio.get_running_loop()
+        if mmap:
+            store_path = cache_store_path(json.dumps(params), dtype)
+            df = await loop.run_in_executor(None, weather_store.read, store_path)
+            metrics.inc('rebase_weather_cache_total', cache='store', result='miss' if df is None else 'hit')
+            if df is None:
+                df = await cls._fetch_historical(params)
+                df = await loop.run_in_executor(None, _write_store, store_path, compact(df, dtype) if dtype else df)
+            return df
+
+        cache_file = cache_file_path(json.dumps(params))
+        df = await loop.run_in_executor(None, get_cached_weather, cache_file)
+        metrics.inc('rebase_weather_cache_total', cache='pickle', result='miss' if df is None else 'hit')
+        if df is None:
+            df = await cls._fetch_historical(params)
+            await loop.run_in_executor(None, save_cached_weather, cache_file, df)
+        if dtype:
+            df = compact(df, dtype)
+        return df
+
+    @classmethod
+    async def _historical_range(cls, cache, window, max_tries, dtype=None, mmap=False):
+        loop = asyncio.get_running_loop()
+        for attempt in range(2):
+            missing = await loop.run_in_executor(None, cache.missing)
+            metrics.inc('rebase_weather_cache_total', cache='range', result='miss' if missing else 'hit')
+            if window is None:
+                dfs = await asyncio.gather(*[cls._fetch_historical(cache.range_params(start, end)) for start, end in missing])
+                for (start, end), df in zip(missing, dfs):
+                    if not await loop.run_in_executor(None, cache.store, df, start, end):
+                        return None
+            else:
+                await cls._fetch_windows(cache, split_intervals(missing, window), max_tries)
+                if not await loop.run_in_executor(None, cache.columnar):
+                    return None
+            try:
+                return await loop.run_in_executor(None, cache.load, None, None, dtype, mmap)
+            except Exception:
+                # Corrupt partitions are dropped by load(), fetch them again
+                if attempt > 0 or not await loop.run_in_executor(None, cache.missing):
+                    raise
+
+    @classmethod
+    async def _fetch_windows(cls, cache, windows, max_tries):
+        loop = asyncio.get_running_loop()
+
+        async def fetch(start, end):
+            df = await cls._fetch_historical(cache.range_params(start, end))
+            await loop.run_in_executor(None, cache.store, df, start, end)
+
+        for n_try in range(1, max_tries + 1):
+            errors = await asyncio.gather(*[fetch(start, end) for start, end in windows], return_exceptions=True)
+            failed = {window: error for window, error in zip(windows, errors) if error is not None}
+            metrics.inc('rebase_weather_windows_total', len(windows) - len(failed), result='ok')
+            metrics.inc('rebase_weather_windows_total', len(failed), result='failed')
+            if not failed:
+                return
+            windows = sorted(failed)
+            if n_try < max_tries:
+                print('Retrying {} failed weather windows'.format(len(windows)))
+
+        raise Exception('Failed retrieving weather data for {} windows, call again to resume: {}'.format(
+            len(failed), {'{} - {}'.format(format_timestamp(s), format_timestamp(e)): str(error)
+                          for (s, e), error in sorted(failed.items())}))
+
+    @classmethod
+    async def _fetch_historical(cls, params):
+        response = await api_request.get(SyncWeather.historical_path, params={'query_params': json.dumps(params)})
+        return await asyncio.get_running_loop().run_in_executor(None, response_to_df, response)
+
+    @classmethod
+    async def operational(cls, params, resolution=None, agg='mean', dtype=None):
+        path = '/weather/v1/get_latest_nwp'
+        json_params = json.dumps(params)
+        loop = asyncio.get_running_loop()
+        df = await _operational_flight.do_async(json.dumps(params, sort_keys=True), cls._fetch_operational,
+                                                path, json_params, copy=pd.DataFrame.copy)
+
+        if resolution:
+            df = await loop.run_in_executor(None, resample, df, resolution, agg)
+        if dtype:
+            df = compact(df, dtype)
+
+        return df
+
+    @classmethod
+    async def _fetch_operational(cls, path, json_params):
+        response = await api_request.get(path, params={'query_params': json_params})
+        if response.status_code != 200:
+            raise Exception('Failed retrieving weather data, status: {}'.format(response.status_code))
+        return await asyncio.get_running_loop().run_in_executor(None, json_to_df, response.content)
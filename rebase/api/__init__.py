@@ -1,6 +1,39 @@
-from .predicter import Predicter, Model
-from .site import Site, SiteTemplate
-from .weather import *
-from .backend import *
-from .runner import ModelRunner
-from .layer import Layer
+import importlib
+
+# Submodules are imported on first access, see rebase/__init__.py
+_lazy_attrs = {
+    'Predicter': 'rebase.api.predicter',
+    'Model': 'rebase.api.predicter',
+    'Site': 'rebase.api.site',
+    'SiteTemplate': 'rebase.api.site',
+    'Weather': 'rebase.api.weather',
+    'json_to_df': 'rebase.api.weather',
+    'records_to_df': 'rebase.api.weather',
+    'resample': 'rebase.api.weather',
+    'get_cached_weather': 'rebase.api.weather',
+    'save_cached_weather': 'rebase.api.weather',
+    'create': 'rebase.api.backend',
+    'update': 'rebase.api.backend',
+    'train': 'rebase.api.backend',
+    'hyperparam_search': 'rebase.api.backend',
+    'report_result': 'rebase.api.backend',
+    'hyperparam_results': 'rebase.api.backend',
+    'ModelRunner': 'rebase.api.runner',
+    'FleetRunner': 'rebase.api.runner',
+    'Layer': 'rebase.api.layer',
+}
+
+__all__ = list(_lazy_attrs)
+
+
+def __getattr__(name):
+    module_name = _lazy_attrs.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module_name), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_attrs))
@@ -5,12 +5,14 @@ import dill
 import rebase as rb
 
 
-def create(site_id, model):
+def create(site_id, model, compress=None):
     """Create a new model for the specified site
 
     Args:
         site_id (str): the id of the site
         model (class): the model class to create
+        compress (bool): gzip compress the pickled model, default
+            ``api_request.compress_requests``
 
     Returns:
         str: -
@@ -28,18 +30,20 @@ def create(site_id, model):
 
     params = {'model_name': model.__name__}
     path = 'platform/v1/model/custom/create/{}'.format(site_id)
-    r = api_request.post(path, params=params, data=data)
+    r = api_request.post(path, params=params, data=data, compress=compress)
     if r.status_code != 200:
         raise Exception(f"Error creating model for site {site_id}: {r.content.decode('utf-8')}")
     return r.json()
 
 
-def update(model_id, model):
+def update(model_id, model, compress=None):
     """Update an existing model for a specified site
 
     Args:
         site_id (str): the id of the site
         model (class): the model class to create
+        compress (bool): gzip compress the pickled model, default
+            ``api_request.compress_requests``
 
     Returns:
         str: -
@@ -57,7 +61,7 @@ def update(model_id, model):
     data = dill.dumps(model, recurse=True)
     params = {'model_name': model.__name__}
     path = 'platform/v1/model/custom/update/{}'.format(model_id)
-    r = api_request.post(path, params=params, data=data)
+    r = api_request.post(path, params=params, data=data, compress=compress)
     if r.status_code == 200:
         print('Ok, updated model {}'.format(model_id))
     else:
@@ -2,6 +2,8 @@ import rebase as rb
 import pickle
 from datetime import datetime
 import rebase.util.api_request as api_request
+import rebase.util.artifact_cache as artifact_cache
+import rebase.util.hyperparam as hyperparam
 
 
 class Predicter():
@@ -24,10 +26,40 @@ class Predicter():
         return pred.train(dataset, params)
 
     @classmethod
-    def hyperparam_search(self, pred, params_list):
-        models = []
-        for p in params_list:
-            model, score = pred.train(dataset, p)
+    def hyperparam_search(cls, pred, params_list, start_date, end_date, n_jobs=4, patience=None,
+                          minimize=True, model_id=None, report_every=10):
+        """Run a hyperparam search locally
+
+        The data is loaded and preprocessed once, then every trial trains
+        ``pred`` on it, see :func:`rebase.util.hyperparam.search`.
+        ``pred.train()`` must return ``(model, score)``.
+
+        Args:
+            pred (rb.Model): the model
+            params_list (list or dict): params of every trial, or a dict of
+                param values to try all combinations of
+            start_date (datetime): start of the training period
+            end_date (datetime): end of the training period
+            n_jobs (int): number of worker processes
+            patience (int): stop after this many trials without improvement
+            minimize (bool): lower scores are better
+            model_id (str): report the results for this model with
+                :func:`rebase.api.backend.report_result`
+            report_every (int): number of results per report batch
+
+        Returns:
+            list: the result of every trial that ran, best first
+
+        Example::
+
+            >>> results = rb.Predicter.hyperparam_search(pred, {'max_depth': [3, 5, 8]}, start_date, end_date)
+            >>> results[0]['params']
+        """
+        weather_df, observation_df = Predicter.load_data(pred, start_date, end_date)
+        dataset = pred.preprocess(weather_df, observation_df)
+        return hyperparam.search(pred, dataset, hyperparam.param_grid(params_list), n_jobs=n_jobs,
+                                 patience=patience, minimize=minimize, model_id=model_id,
+                                 report_every=report_every)
 
 
     @classmethod
@@ -127,3 +159,19 @@ class Model():
     # if @param serialized_model can't be loaded from pickle
     def deserialize(self, serialized_model):
         return pickle.loads(serialized_model)
+
+    def load_trained(self, path):
+        """Load the trained model from the downloaded file
+
+        Override to load large models without reading the whole file into
+        memory, e.g. with a memory map or the loader of the model library.
+        The default loads pickles, and memory maps the numpy arrays of models
+        uploaded with ``ModelRunner.upload_trained_model(model, zero_copy=True)``.
+
+        Args:
+            path (str): path of the downloaded file
+
+        Returns:
+            object: the trained model passed to :meth:`predict`
+        """
+        return artifact_cache.load_file(path)
@@ -1,23 +1,29 @@
 import tempfile
 import dill
 import requests
-import json
+import numpy as np
 import pandas as pd
 from datetime import datetime
 import importlib
 import rebase as rb
-import joblib
 
 import rebase.util.api_request as api_request
+import rebase.util.artifact_cache as artifact_cache
+import rebase.util.forecast_upload as forecast_upload
+import rebase.util.hyperparam as hyperparam
+import rebase.util.metrics as metrics
+from rebase.util.parallel import imap_bounded
+from rebase.util.timestamps import to_ns
 # This class loads custom models created by the user
 
 class ModelRunner():
 
 
-    def __init__(self, model_id):
+    def __init__(self, model_id, artifact_max_age=None, model_config=None, site_config=None):
         self.model_id = model_id
-        self.model_config = self.load_model_config()
-        self.site_config = rb.Site.get(self.model_config['site_id'])
+        self.artifact_max_age = artifact_max_age
+        self.model_config = model_config or self.load_model_config()
+        self.site_config = site_config or rb.Site.get(self.model_config['site_id'])
         self.model_class = self.load_pickle('code')()
 
         # need to add __builtins__ cuz of issue with Dill pickling it
@@ -35,59 +41,185 @@ class ModelRunner():
     # !!! DANGER, loads arbitrary python code here !!!!
     # !!!    ONLY RUN IN AN ISOLATED ENVIRONMENT   !!!!
     # !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
-    def load_pickle(self, file_type):
-        r = api_request.get('platform/v1/model/custom/download/{}/{}'.format(file_type, self.model_id))
-        return dill.loads(r.content)
+    def load_pickle(self, file_type, loader=None):
+        # Streamed to a file in rb.cache_dir, cached by content hash and
+        # revalidated with the server, see rebase.util.artifact_cache
+        path = 'platform/v1/model/custom/download/{}/{}'.format(file_type, self.model_id)
+        key = '{}/{}'.format(self.model_id, file_type)
+        with metrics.timer('rebase_artifact_load_seconds', file_type=file_type):
+            return artifact_cache.load(key, path, max_age=self.artifact_max_age, loader=loader)
+
+    def load_trained(self):
+        # Models can load the trained model from the downloaded file with
+        # Model.load_trained(), e.g. to memory map it
+        return self.load_pickle('trained', loader=getattr(self.model_class, 'load_trained', None))
 
 
 
 
     def predict(self, ref_time=None):
+        with metrics.timer('rebase_predict_seconds'):
+            return self._predict(ref_time)
+
+    def _predict(self, ref_time=None):
         ref_time = datetime.strptime(ref_time, '%Y/%m/%d/%H') if ref_time else ref_time
         weather_df, obs_df = self.model_class.load_latest_data(self.site_config)
         # load the previously trained model
-        model_trained = self.load_pickle('trained')
+        model_trained = self.load_trained()
         pred_set = self.model_class.preprocess(weather_df, observation_data=obs_df)
         pred_df = self.model_class.predict(model_trained, pred_set)
         weather_df['forecast'] = pred_df
-        pred_df = weather_df[['forecast']]
+        return self._normalize(weather_df[['forecast']])
+
+    def _normalize(self, pred_df):
         if 'capacity' in self.site_config and len(self.site_config['capacity'])>0:
             pred_df = pred_df.div(self.site_config['capacity'][-1]['value'])
         return pred_df
 
-    def upload_single_forecast(self, ref_time, df_ref_time):
-        to_iso = lambda d : d.strftime('%Y%m%dT%H:%M:%SZ')
-        data = {
-            'ref_time': to_iso(ref_time),
-            'valid_time': [to_iso(d) for d in df_ref_time.index],
-            'forecast': df_ref_time['forecast'].values.tolist()
-        }
+    def upload_single_forecast(self, ref_time, df_ref_time, compress=None):
+        data = forecast_upload.encode_forecast(
+            forecast_upload.format_times(to_ns(pd.DatetimeIndex([ref_time])))[0],
+            forecast_upload.format_times(to_ns(pd.DatetimeIndex(df_ref_time.index))),
+            df_ref_time['forecast'].to_numpy(dtype='float64'))
 
-        path = 'platform/v1/model/custom/forecast/upload/{}'.format(self.model_id)
-        r = api_request.post(path, data=json.dumps(data))
+        path = forecast_upload.single_path.format(self.model_id)
+        r = api_request.post(path, data=data, compress=compress)
         if r.status_code != 200:
             raise Exception(f'Failed uploading forecast: model_id: {self.model_id}', r.status_code)
 
         return True
 
-    def upload_forecast(self, df):
-        ref_times = df.index.get_level_values('ref_datetime').unique()
-        with joblib.parallel_backend("threading"):
-            results = joblib.Parallel(n_jobs=4)(
-                    joblib.delayed(self.upload_single_forecast)(ref_time, df.loc[(ref_time), :])
-                           for ref_time in ref_times)
+    def upload_forecast(self, df, n_jobs=4, max_batch_bytes=1024**2, max_ref_times=500, raise_errors=True, compress=None):
+        """Upload forecasts for many ref times
+
+        Ref times are packed into batches of at most ``max_batch_bytes``
+        encoded bytes and ``max_ref_times`` ref times, sent by ``n_jobs``
+        threads, see :func:`rebase.util.forecast_upload.upload`.
+
+        Args:
+            df (pd.DataFrame): ``forecast`` column indexed by
+                (ref_datetime, valid_datetime)
+            n_jobs (int): number of batches sent in parallel
+            max_batch_bytes (int): max encoded size of a batch
+            max_ref_times (int): max number of ref times in a batch
+            raise_errors (bool): raise if any batch failed
+            compress (bool): gzip compress the batches, default
+                ``api_request.compress_requests``
+
+        Returns:
+            list: the result of each batch
+        """
+        results = forecast_upload.upload([(self.model_id, df)], n_jobs=n_jobs,
+                                         max_batch_bytes=max_batch_bytes, max_ref_times=max_ref_times,
+                                         compress=compress)
+        failed = [r for r in results if not r['ok']]
+        if failed and raise_errors:
+            raise Exception("There were some errors while uploading the forecasts, model_id: %s, %d of %d batches failed: %s" % (
+                self.model_id, len(failed), len(results), [(r['ref_times'], str(r['error'])) for r in failed]))
+        return results
+
+
+    def backtest(self, start_date, end_date, batch_size=None, n_jobs=1):
+        """Forecast every ref time of a historical period
+
+        The data of the whole period is loaded with ``Model.load_data`` and
+        preprocessed once, and the trained model is loaded once. The
+        preprocessed rows are then sorted by ref time and ``Model.predict``
+        is called on slices of ``batch_size`` ref times, so a vectorized
+        model forecasts many ref times per call. With ``n_jobs`` the batches
+        are predicted by that many threads, which helps models that release
+        the GIL like numpy, scikit-learn or lightgbm.
+
+        ``Model.preprocess`` must return a ``pd.DataFrame`` that keeps the
+        ``ref_datetime`` level of the weather index, or has one row per
+        weather row like for :meth:`predict`.
+
+        Args:
+            start_date (datetime): start of the period
+            end_date (datetime): end of the period
+            batch_size (int): number of ref times per ``Model.predict`` call,
+                default all of them in one call
+            n_jobs (int): number of batches predicted in parallel
 
-        if not all(results):
-            raise Exception("There were some errors while uploading the forecasts, model_id: %s: %s" % (self.model_id, list(zip(ref_times, results))))
+        Returns:
+            pd.DataFrame: ``forecast`` column indexed by
+            (ref_datetime, valid_datetime), ready for :meth:`upload_forecast`
 
+        Example::
 
-    def backtest(self):
-        # load
-        pass
+            >>> runner = rb.ModelRunner(model_id)
+            >>> df = runner.backtest(datetime(2020, 1, 1), datetime(2021, 1, 1), batch_size=500)
+            >>> runner.upload_forecast(df)
+        """
+        with metrics.timer('rebase_backtest_seconds'):
+            weather_df, obs_df = self.model_class.load_data(self.site_config, start_date, end_date)
+            model_trained = self.load_trained()
+            pred_set = self.model_class.preprocess(weather_df, observation_data=obs_df)
+            if not isinstance(pred_set, pd.DataFrame):
+                raise Exception('backtest() needs preprocess() to return a pd.DataFrame it can slice by ref time, got {}'.format(
+                    type(pred_set).__name__))
+            index = pred_set.index if 'ref_datetime' in (pred_set.index.names or []) else weather_df.index
+            if len(index) != len(pred_set):
+                raise Exception('preprocess() must keep the ref_datetime index level, or one row per weather row')
 
-    def hyperparam_search(self, params_search_space):
-        
-        pass
+            # Sort rows by ref time so every batch is a slice
+            codes, _ = pd.factorize(index.get_level_values('ref_datetime'), sort=True)
+            if len(codes) and not (np.diff(codes) >= 0).all():
+                order = np.argsort(codes, kind='stable')
+                codes = codes[order]
+                pred_set = pred_set.iloc[order]
+                index = index[order]
+
+            n_ref_times = codes[-1] + 1 if len(codes) else 0
+            batch_size = batch_size or max(n_ref_times, 1)
+            bounds = np.searchsorted(codes, np.arange(0, n_ref_times + batch_size, batch_size))
+            batches = [(start, end) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+
+            def predict(batch):
+                start, end = batch
+                forecast = np.asarray(self.model_class.predict(model_trained, pred_set.iloc[start:end]), dtype='float64')
+                return forecast.reshape(end - start)
+
+            forecast = np.empty(len(pred_set))
+            if n_jobs > 1:
+                for (start, end), result, error in imap_bounded(predict, batches, n_jobs=n_jobs):
+                    if error is not None:
+                        raise error
+                    forecast[start:end] = result
+            else:
+                for start, end in batches:
+                    forecast[start:end] = predict((start, end))
+
+            pred_df = pd.DataFrame({'forecast': forecast}, index=index.set_names(['ref_datetime', 'valid_datetime']))
+            return self._normalize(pred_df)
+
+    def hyperparam_search(self, params_search_space, start_date, end_date, n_jobs=4, patience=None,
+                          minimize=True, report=False, report_every=10):
+        """Run a hyperparam search of the model locally
+
+        See :func:`rebase.util.hyperparam.search`, ``Model.train()`` must
+        return ``(model, score)``.
+
+        Args:
+            params_search_space (dict or list): dict of param values to try
+                all combinations of, or a list of params
+            start_date (datetime): start of the training period
+            end_date (datetime): end of the training period
+            n_jobs (int): number of worker processes
+            patience (int): stop after this many trials without improvement
+            minimize (bool): lower scores are better
+            report (bool): report the results with
+                :func:`rebase.api.backend.report_result`
+            report_every (int): number of results per report batch
+
+        Returns:
+            list: the result of every trial that ran, best first
+        """
+        weather_df, observation_df = self.model_class.load_data(self.site_config, start_date, end_date)
+        train_set = self.model_class.preprocess(weather_df, observation_data=observation_df)
+        return hyperparam.search(self.model_class, train_set, hyperparam.param_grid(params_search_space),
+                                 n_jobs=n_jobs, patience=patience, minimize=minimize,
+                                 model_id=self.model_id if report else None, report_every=report_every)
 
 
     def train(self, start_date, end_date, params={}):
@@ -96,8 +228,140 @@ class ModelRunner():
 
         return self.model_class.train(train_set, params=params)
 
-    def upload_trained_model(self, model_trained):
+    def upload_trained_model(self, model_trained, compress=None, zero_copy=False):
+        """Upload a trained model
+
+        Args:
+            model_trained (object): the trained model
+            compress (bool): gzip compress the upload, default
+                ``api_request.compress_requests``
+            zero_copy (bool): store the numpy arrays of the model so they are
+                memory mapped when it is loaded, see
+                :func:`rebase.util.artifact_cache.dumps_zero_copy`
+        """
         path = 'platform/v1/model/custom/upload/trained/{}'.format(self.model_id)
-        r = api_request.post(path, data=dill.dumps(model_trained))
+        data = artifact_cache.dumps_zero_copy(model_trained) if zero_copy else dill.dumps(model_trained)
+        r = api_request.post(path, data=data, compress=compress)
         if r.status_code != 200:
             raise Exception('Failed uploading trained model', r.status_code)
+
+
+class FleetRunner():
+    """Run the predictions of many models
+
+    Models are grouped by site. The site config of each site is fetched
+    once, and the groups are run by ``n_jobs`` threads, the models of a
+    site one after the other within :meth:`rebase.Weather.shared`, so models
+    that query the same NWP data share one ``Weather.operational`` request.
+    The forecasts of all models are uploaded by one
+    :func:`rebase.util.forecast_upload.upload` pipeline.
+
+    Args:
+        model_ids (list): ids of the models
+        n_jobs (int): number of sites run in parallel
+        artifact_max_age (float): see :class:`ModelRunner`
+
+    Example::
+
+        >>> fleet = rb.FleetRunner(model_ids, n_jobs=16)
+        >>> result = fleet.run()
+        >>> result['errors']
+        {}
+    """
+
+    def __init__(self, model_ids, n_jobs=8, artifact_max_age=None):
+        self.model_ids = list(dict.fromkeys(model_ids))
+        self.n_jobs = n_jobs
+        # Models that failed to load by model id, they are not run
+        self.load_errors = {}
+        # Errors of the last predict() or run() by model id
+        self.errors = {}
+
+        def load_config(model_id):
+            r = api_request.get('platform/v1/model/{}'.format(model_id))
+            if r.status_code != 200:
+                raise Exception('Failed loading model config, status: {}'.format(r.status_code))
+            return r.json()
+
+        model_configs, errors = self._map(load_config, self.model_ids)
+        self.load_errors.update(errors)
+        site_configs, errors = self._map(rb.Site.get, list(dict.fromkeys(c['site_id'] for c in model_configs.values())))
+        for model_id, model_config in model_configs.items():
+            if model_config['site_id'] in errors:
+                self.load_errors[model_id] = errors[model_config['site_id']]
+
+        def load_runner(model_id):
+            model_config = model_configs[model_id]
+            return ModelRunner(model_id, artifact_max_age=artifact_max_age,
+                               model_config=model_config, site_config=site_configs[model_config['site_id']])
+
+        self.runners, errors = self._map(load_runner, [m for m, c in model_configs.items() if c['site_id'] in site_configs])
+        self.load_errors.update(errors)
+        self.sites = {}
+        for model_id, runner in self.runners.items():
+            self.sites.setdefault(runner.model_config['site_id'], []).append(runner)
+
+    def _map(self, func, keys):
+        results, errors = {}, {}
+        for key, result, error in imap_bounded(func, keys, n_jobs=self.n_jobs):
+            if error is None:
+                results[key] = result
+            else:
+                errors[key] = error
+        return results, errors
+
+    def _predict(self):
+        def predict_site(runners):
+            forecasts, errors = {}, {}
+            for runner in runners:
+                try:
+                    forecasts[runner.model_id] = runner.predict()
+                except Exception as e:
+                    errors[runner.model_id] = e
+            return forecasts, errors
+
+        forecasts, errors = {}, {}
+        with rb.Weather.shared():
+            for _, result, error in imap_bounded(predict_site, self.sites.values(), n_jobs=self.n_jobs):
+                if error is not None:
+                    raise error
+                forecasts.update(result[0])
+                errors.update(result[1])
+        return forecasts, errors
+
+    def predict(self):
+        """Predict with every model that loaded
+
+        Returns:
+            dict: the forecast of every model that succeeded by model id,
+            failures of this call are in ``self.errors``
+        """
+        forecasts, self.errors = self._predict()
+        return forecasts
+
+    def run(self, upload=True, upload_jobs=4, compress=None):
+        """Predict with every model that loaded and upload the forecasts
+
+        Args:
+            upload (bool): upload the forecasts
+            upload_jobs (int): number of batches uploaded in parallel
+            compress (bool): gzip compress the uploads, default
+                ``api_request.compress_requests``
+
+        Returns:
+            dict: ``forecasts`` by model id, ``uploads`` the result of every
+            upload batch, ``errors`` of this run by model id and
+            ``load_errors`` of the models that failed to load by model id
+        """
+        forecasts, errors = self._predict()
+        uploads = []
+        if upload and forecasts:
+            uploads = forecast_upload.upload(list(forecasts.items()), n_jobs=upload_jobs, compress=compress)
+            for r in uploads:
+                if not r['ok']:
+                    errors.setdefault(r['model_id'], r['error'])
+        self.errors = errors
+        if errors or self.load_errors:
+            print('Failed for {} of {} models: {}'.format(
+                len(errors) + len(self.load_errors), len(self.model_ids), list(self.load_errors) + list(errors)))
+        return {'forecasts': forecasts, 'uploads': uploads, 'errors': dict(errors), 'load_errors': dict(self.load_errors)}
@@ -1,8 +1,145 @@
 import rebase.util.api_request as api_request
+import rebase.util.site_cache as site_cache
+from rebase.util.observation_store import ObservationStore
+from rebase.util.parallel import imap_bounded, SingleFlight
+from rebase.util.timestamps import to_ns
+from rebase.util.compact import compact
+from rebase.util.weather_cache import to_timestamp, format_timestamp
+import rebase as rb
+import copy
+import hashlib
 import json
+import os
+import numpy as np
 import pandas as pd
+from pandas.tseries.frequencies import to_offset
 import requests
 
+
+# Concurrent gets of the same site share one request
+_get_flight = SingleFlight('site_get')
+
+
+def _values(values, dtype):
+    return values if dtype is None else np.asarray(values, dtype=dtype)
+
+
+def observation_to_df(data, dtype=None):
+    df = pd.DataFrame(data={'observation': _values(data['power_kw'], dtype)}, index=pd.to_datetime(data['valid_time']))
+    df.index.name = 'valid_time'
+    return df
+
+
+def forecast_to_dict(data, dtype=None):
+    df = pd.DataFrame(data={'forecast': _values(data['forecast'], dtype)}, index=pd.to_datetime(data['valid_time']))
+    df.index.name = 'valid_time'
+    return {
+        'type': data['type'],
+        'ref_time': data['ref_time'],
+        'df': df
+    }
+
+
+def train_status(r):
+    status = {'status': None, 'history': []}
+    if r.status_code == 200:
+        data = r.json()
+        if len(data) > 0:
+            status['status'] = data[-1]['state']
+            status['history'] = data
+    return status
+
+
+def _format_valid_times(valid_ns):
+    # Both upload paths format times as UTC, naive times are taken as UTC
+    valid_time = np.datetime_as_string(valid_ns.astype('datetime64[ns]').astype('datetime64[s]'), unit='s')
+    return np.char.add(valid_time, 'Z')
+
+
+def _valid_ns(valid_time):
+    return to_ns(pd.DatetimeIndex(pd.to_datetime(valid_time, utc=True)))
+
+
+def measurement_data(df):
+    return {
+        'valid_time': _format_valid_times(_valid_ns(df['valid_time'])).tolist(),
+        'measurement': df['observation'].values.tolist(),
+        'type': 'ProductionPower'
+    }
+
+
+def _site_keyed_frame(site_ids, data, columns, constants={}, dtype=None):
+    # Concatenate the raw lists of all sites and build the frame once
+    site_ids = [site_id for site_id in site_ids if site_id in data]
+    lengths = [len(data[site_id]['valid_time']) for site_id in site_ids]
+    valid_time = [t for site_id in site_ids for t in data[site_id]['valid_time']]
+    index = pd.MultiIndex.from_arrays(
+        [np.repeat(np.asarray(site_ids, dtype=object), lengths), pd.to_datetime(valid_time)],
+        names=['site_id', 'valid_time'])
+    frame = {
+        name: np.concatenate([np.asarray(data[site_id][key], dtype=dtype or 'float64') for site_id in site_ids])
+              if site_ids else np.empty(0, dtype=dtype or 'float64')
+        for name, key in columns.items()
+    }
+    for name, key in constants.items():
+        frame[name] = np.repeat(np.asarray([data[site_id][key] for site_id in site_ids], dtype=object), lengths)
+    df = pd.DataFrame(frame, index=index)
+    return df if dtype is None else compact(df, dtype)
+
+
+def encode_measurements(valid_ns, values):
+    """Encode measurements as the json body of an upload
+
+    Builds the same body as :func:`measurement_data` straight from arrays,
+    without converting every value to a Python object. Times are formatted
+    as UTC by both.
+
+    Args:
+        valid_ns (np.ndarray): valid times as int64 ns since epoch, UTC
+        values (np.ndarray): the measured values
+
+    Returns:
+        bytes: the json body
+    """
+    valid_time = _format_valid_times(valid_ns)
+    return ''.join([
+        '{"valid_time": [', ', '.join(np.char.add(np.char.add('"', valid_time), '"')),
+        '], "measurement": [', ', '.join(values.astype(str)),
+        '], "type": "ProductionPower"}',
+    ]).encode('utf-8')
+
+
+def _upload_checkpoint_file(site_id, valid_ns, values, chunk_freq):
+    # The key covers the values, so corrected data with the same timestamps
+    # is uploaded again instead of resuming the previous upload
+    key_hash = hashlib.md5(str(chunk_freq).encode('utf-8'))
+    key_hash.update(np.ascontiguousarray(valid_ns, dtype='int64').tobytes())
+    key_hash.update(np.ascontiguousarray(values, dtype='float64').tobytes())
+    key_hash = key_hash.hexdigest()
+    return os.path.join(rb.cache_dir, 'uploads', '{}-{}.json'.format(site_id, key_hash))
+
+
+def _read_upload_checkpoint(checkpoint_file):
+    try:
+        with open(checkpoint_file) as f:
+            return set(json.load(f)['acked'])
+    except (OSError, ValueError, KeyError):
+        return set()
+
+
+def _write_upload_checkpoint(checkpoint_file, acked):
+    os.makedirs(os.path.dirname(checkpoint_file), exist_ok=True)
+    with rb.cache.atomic_write(checkpoint_file, 'w') as f:
+        json.dump({'acked': sorted(int(i) for i in acked)}, f)
+
+
+def _remove_upload_checkpoint(checkpoint_file):
+    try:
+        os.remove(checkpoint_file)
+    except OSError:
+        pass
+
+
 class SiteTemplate():
 
 
@@ -40,15 +177,25 @@ class Site():
         path = '{}/site/create'.format(cls.base_path)
         json_site = json.dumps(site_config)
         response = api_request.post(path, data=json_site)
-        return response.json()
+        site_id = response.json()
+        if isinstance(site_id, str):
+            site_cache.invalidate(site_id)
+        return site_id
 
 
     @classmethod
-    def get(cls, site_id):
+    def get(cls, site_id, max_age=None):
         """Get a site by id
 
+        Site configs are cached in memory for ``rebase.util.site_cache.ttl``
+        seconds, and on disk too with ``rebase.util.site_cache.persist``.
+        :meth:`list` fills the cache, :meth:`create` and :meth:`delete`
+        invalidate it.
+
         Args:
             site_id (str): the id of the site
+            max_age (float): max age in seconds of a cached config, 0 always
+                fetches the config, default ``site_cache.ttl``
 
         Returns:
             dict: the config of the site
@@ -66,8 +213,18 @@ class Site():
         Raises:
             rebase.NotFoundError: if specified site does not exist
         """
+        config = site_cache.get(site_id, max_age=max_age)
+        if config is not None:
+            return config
+        return _get_flight.do(site_id, cls._fetch, site_id, copy=copy.deepcopy)
+
+    @classmethod
+    def _fetch(cls, site_id):
         r = api_request.get('{}/site/{}'.format(cls.base_path, site_id))
-        return r.json()
+        config = r.json()
+        if r.status_code == 200:
+            site_cache.put(site_id, config)
+        return config
 
     @classmethod
     def delete(cls, site_id):
@@ -86,13 +243,38 @@ class Site():
         """
         path = '{}/site/{}'.format(cls.base_path, site_id)
         response = api_request.delete(path)
+        site_cache.invalidate(site_id)
         if response.status_code == 200:
             print('Success. Site: {} was deleted.'.format(site_id))
         else:
             raise Exception('Delete site failed. Site: {} was NOT deleted. API status code: {}'.format(site_id, response.status_code))
 
     @classmethod
-    def observation(cls, site_id, start_date, end_date=None):
+    def observation(cls, site_id, start_date, end_date=None, local=False, dtype=None):
+        """Get observations of a site
+
+        Args:
+            site_id (str): id of the site
+            start_date (datetime): start of the period
+            end_date (datetime): end of the period
+            local (bool): read from the local store filled by
+                :meth:`sync_observations` instead of the API
+            dtype (str): dtype of the observations, e.g. ``'float32'``,
+                default float64
+
+        Returns:
+            pandas.DataFrame: ``observation`` column indexed by ``valid_time``
+
+        Raises:
+            Exception: if ``local`` and the site was never synced
+        """
+        if local:
+            store = ObservationStore(site_id)
+            if store.meta()['synced_at'] is None:
+                raise Exception('No observations synced for site: {}, call Site.sync_observations first'.format(site_id))
+            df = store.load(start_date, end_date)
+            return df if dtype is None else compact(df, dtype)
+
         path = '{}/site/observation/{}'.format(cls.base_path, site_id)
         params = {
             'start_date': start_date,
@@ -100,10 +282,7 @@ class Site():
         }
         response = api_request.get(path, params=params)
         if response.status_code == 200:
-            data = response.json()
-            df = pd.DataFrame(data={'observation': data['power_kw']}, index=pd.to_datetime(data['valid_time']))
-            df.index.name = 'valid_time'
-            return df
+            return observation_to_df(response.json(), dtype=dtype)
         else:
             print(response.status_code)
 
@@ -111,11 +290,63 @@ class Site():
 
 
     @classmethod
-    def forecast(cls, site_id, type='prioritized'):
+    def sync_observations(cls, site_id, start_date=None, lookback='1D'):
+        """Sync the local observation store of a site with the API
+
+        Only observations newer than the latest stored valid time, minus
+        ``lookback`` to pick up revised values, are downloaded. The synced
+        data is read with ``Site.observation(site_id, start, end, local=True)``.
+
+        Args:
+            site_id (str): id of the site
+            start_date (datetime): start of the history, required for the
+                first sync, later syncs start at the high-water mark
+            lookback (str): period before the high-water mark that is
+                downloaded again, e.g. ``'2D'``
+
+        Returns:
+            int: number of observations downloaded
+
+        Example::
+
+            >>> rb.Site.sync_observations(site_id, start_date='2019-01-01')
+            Synced 70080 observations for site 4ab82692-3944-4069-9cbb-f9c59513c1c3 up to 2021-01-01 00:00:00+00:00
+            >>> rb.Site.sync_observations(site_id)
+            Synced 192 observations for site 4ab82692-3944-4069-9cbb-f9c59513c1c3 up to 2021-01-02 00:00:00+00:00
+        """
+        store = ObservationStore(site_id)
+        high_water = store.high_water()
+        if high_water is not None:
+            start = to_timestamp(high_water) - pd.Timedelta(lookback)
+            if start_date is not None:
+                start = max(start, to_timestamp(start_date))
+        elif start_date is not None:
+            start = to_timestamp(start_date)
+        else:
+            raise Exception('No observations stored for site: {}, start_date is required for the first sync'.format(site_id))
+
+        path = '{}/site/observation/{}'.format(cls.base_path, site_id)
+        params = {'start_date': format_timestamp(start)}
+        response = api_request.get(path, params=params)
+        if response.status_code != 200:
+            raise Exception('Failed syncing observations for site: {}. API status code: {}'.format(site_id, response.status_code))
+
+        data = response.json()
+        valid_ns = _valid_ns(data['valid_time'])
+        values = np.asarray(data['power_kw'], dtype='float64')
+        end_ns = int(valid_ns.max()) if len(valid_ns) else start.value
+        store.replace(valid_ns, values, start.value, end_ns)
+        print('Synced {} observations for site {} up to {}'.format(len(valid_ns), site_id, store.high_water()))
+        return len(valid_ns)
+
+    @classmethod
+    def forecast(cls, site_id, type='prioritized', dtype=None):
         """Get the latest forecast for a site
 
         Args:
             site_id (str): id of the site
+            dtype (str): dtype of the forecast, e.g. ``'float32'``, default
+                float64
             type (str): type of forecast to return
 
                 - ``prioritized`` returns best forecast at the time
@@ -156,21 +387,97 @@ class Site():
         }
         response = api_request.get(path, params=params)
         if response.status_code == 200:
-            data = response.json()
-            df = pd.DataFrame(data={'forecast': data['forecast']}, index=pd.to_datetime(data['valid_time']))
-            df.index.name = 'valid_time'
-            return {
-                'type': data['type'],
-                'ref_time': data['ref_time'],
-                'df': df
-            }
+            return forecast_to_dict(response.json(), dtype=dtype)
+
+
+
+    @classmethod
+    def forecast_many(cls, site_ids, type='prioritized', n_jobs=8, return_errors=False, dtype=None):
+        """Get the latest forecast for many sites
+
+        The forecasts are requested concurrently, a site that fails doesn't
+        stop the others.
+
+        Args:
+            site_ids (list): ids of the sites
+            type (str): type of forecast to return, see :meth:`forecast`
+            n_jobs (int): max number of concurrent requests
+            return_errors (bool): also return the errors of failed sites
+            dtype (str): compact mode, e.g. ``'float32'``, the ``ref_time``
+                column is then datetime64 too, see
+                :func:`rebase.util.compact.compact`
 
+        Returns:
+            pandas.DataFrame: ``forecast`` and ``ref_time`` columns indexed by
+            (site_id, valid_time), and if ``return_errors`` a dict with the
+            error of each failed site
 
+            Example::
+
+                >>> df, errors = rb.Site.forecast_many(site_ids, return_errors=True)
+                >>> df.loc[site_ids[0]]
+        """
+        path = '{}/site/forecast/latest/{{}}'.format(cls.base_path)
+        params = {'type': type}
+        # Each site is fetched once, in the order first given
+        site_ids = list(dict.fromkeys(site_ids))
+        data, errors = cls._get_many(path, site_ids, params, n_jobs)
+        df = _site_keyed_frame(site_ids, data, {'forecast': 'forecast'}, constants={'ref_time': 'ref_time'}, dtype=dtype)
+        return (df, errors) if return_errors else df
+
+    @classmethod
+    def observation_many(cls, site_ids, start_date, end_date=None, n_jobs=8, return_errors=False, dtype=None):
+        """Get observations for many sites
+
+        Args:
+            site_ids (list): ids of the sites
+            start_date (datetime): start of the period
+            end_date (datetime): end of the period
+            n_jobs (int): max number of concurrent requests
+            return_errors (bool): also return the errors of failed sites
+            dtype (str): dtype of the observations, e.g. ``'float32'``
+
+        Returns:
+            pandas.DataFrame: ``observation`` column indexed by
+            (site_id, valid_time), and if ``return_errors`` a dict with the
+            error of each failed site
+        """
+        path = '{}/site/observation/{{}}'.format(cls.base_path)
+        params = {
+            'start_date': start_date,
+            'end_date': end_date
+        }
+        site_ids = list(dict.fromkeys(site_ids))
+        data, errors = cls._get_many(path, site_ids, params, n_jobs)
+        df = _site_keyed_frame(site_ids, data, {'observation': 'power_kw'}, dtype=dtype)
+        return (df, errors) if return_errors else df
+
+    @classmethod
+    def _get_many(cls, path, site_ids, params, n_jobs):
+        def fetch(site_id):
+            response = api_request.get(path.format(site_id), params=params)
+            if response.status_code != 200:
+                raise Exception('API status code: {}'.format(response.status_code))
+            return response.json()
+
+        data = {}
+        errors = {}
+        for site_id, result, error in imap_bounded(fetch, site_ids, n_jobs=n_jobs):
+            if error is None:
+                data[site_id] = result
+            else:
+                errors[site_id] = error
+        if errors:
+            print('Failed for {} of {} sites: {}'.format(len(errors), len(site_ids), list(errors)))
+        return data, errors
 
     @classmethod
     def list(cls):
         """List all of your sites
 
+        The configs are put in the site config cache, so listing the sites
+        once warms the cache for :meth:`get`.
+
         Returns:
             List: list with one dict per site
 
@@ -186,7 +493,10 @@ class Site():
         """
         path = '{}/sites'.format(cls.base_path)
         response = api_request.get(path)
-        return response.json()
+        sites = response.json()
+        if response.status_code == 200 and isinstance(sites, list):
+            site_cache.warm(sites)
+        return sites
 
     @classmethod
     def predicters(cls, site_id):
@@ -261,17 +571,10 @@ class Site():
         """
         path = '{}/site/train/state/{}'.format(cls.base_path, site_id)
         r = api_request.get(path)
-
-        status = {'status': None, 'history': []}
-        if r.status_code == 200:
-            data = r.json()
-            if len(data) > 0:
-                status['status'] = data[-1]['state']
-                status['history'] = data
-        return status
+        return train_status(r)
 
     @classmethod
-    def upload(cls, site_id, df):
+    def upload(cls, site_id, df, compress=None):
         """Upload observed data for your site. This data is used when training a model.
 
         Args:
@@ -289,6 +592,10 @@ class Site():
                     n-1      2020-10-17 23:30:00+00:00       169.2
                     n        2020-10-17 23:45:00+00:00       176.6
 
+                Times are uploaded as UTC, naive times are taken to be UTC
+            compress (bool): gzip compress the body, default
+                ``api_request.compress_requests``
+
         Example::
 
             >>> import pandas as pd
@@ -296,16 +603,91 @@ class Site():
             >>> df = pd.read_csv('example_data.csv')
             >>> rb.Site.upload(site_id, df)
             Success!
+
+        For long histories use :meth:`upload_stream`, which sends the data in
+        chunks.
         """
         path = '{}/site/measurement/upload_2/{}'.format(cls.base_path, site_id)
         df = df.dropna()
-        data = {
-            'valid_time': pd.to_datetime(df['valid_time']).dt.strftime('%Y-%m-%dT%H:%M:%SZ').values.tolist(),
-            'measurement': df['observation'].values.tolist(),
-            'type': 'ProductionPower'
-        }
-        response = api_request.post(path, data=json.dumps(data))
+        response = api_request.post(path, data=json.dumps(measurement_data(df)), compress=compress)
         if response.status_code == 200:
             print("Success! Data from {} to {} was uploaded.".format(df.iloc[0]['valid_time'], df.iloc[-1]['valid_time']))
         else:
             print(response.status_code)
+
+    @classmethod
+    def upload_stream(cls, site_id, df, chunk_freq='7D', n_jobs=4, compress=None, resume=True, progress=None):
+        """Upload observed data in time chunks, for long histories
+
+        The data is split into chunks of ``chunk_freq`` of valid time. Each
+        chunk is encoded directly from the underlying arrays and sent by one
+        of ``n_jobs`` threads. Acknowledged chunks are
+        recorded in a checkpoint in ``rb.cache_dir``, so after a failure the
+        same call only sends the chunks that were not acknowledged.
+
+        Args:
+            site_id (str): id of site to upload data for
+            df (pandas.DataFrame): DataFrame with ``valid_time`` and
+                ``observation`` columns, same format as :meth:`upload`
+            chunk_freq (str): time range of each chunk, e.g. ``'7D'``
+            n_jobs (int): number of chunks sent in parallel
+            compress (bool): gzip compress the chunks, default
+                ``api_request.compress_requests``
+            resume (bool): skip chunks acknowledged by a previous call
+            progress (function): called as ``progress(n_done, n_chunks, n_bytes)``
+                after each acknowledged chunk
+
+        Raises:
+            Exception: if some chunks failed, calling again resumes the upload
+
+        Example::
+
+            >>> df = pd.read_csv('example_data.csv')
+            >>> rb.Site.upload_stream(site_id, df, chunk_freq='30D')
+            Success! Data from 2019-01-01 00:00:00 to 2020-12-31 23:45:00 was uploaded in 24 chunks.
+        """
+        path = '{}/site/measurement/upload_2/{}'.format(cls.base_path, site_id)
+        df = df.dropna(subset=['valid_time', 'observation'])
+        valid_ns = _valid_ns(df['valid_time'])
+        order = np.argsort(valid_ns, kind='stable')
+        valid_ns = valid_ns[order]
+        values = df['observation'].to_numpy(dtype='float64')[order]
+        if len(valid_ns) == 0:
+            return
+
+        chunk_ids = valid_ns // to_offset(chunk_freq).nanos
+        starts = np.r_[0, np.flatnonzero(np.diff(chunk_ids)) + 1]
+        ends = np.r_[starts[1:], len(valid_ns)]
+
+        checkpoint_file = _upload_checkpoint_file(site_id, valid_ns, values, chunk_freq)
+        done = _read_upload_checkpoint(checkpoint_file) if resume else set()
+        todo = [i for i in range(len(starts)) if i not in done]
+
+        def send(i):
+            body = encode_measurements(valid_ns[starts[i]:ends[i]], values[starts[i]:ends[i]])
+            body, headers = api_request.compress_body(body, compress)
+            response = api_request.post(path, data=body, headers=headers)
+            if response.status_code != 200:
+                raise Exception('API status code: {}'.format(response.status_code))
+            return len(body)
+
+        failed = {}
+        n_bytes = 0
+        for i, sent, error in imap_bounded(send, todo, n_jobs=n_jobs):
+            if error is not None:
+                failed[i] = error
+                continue
+            done.add(i)
+            n_bytes += sent
+            _write_upload_checkpoint(checkpoint_file, done)
+            if progress is not None:
+                progress(len(done), len(starts), n_bytes)
+
+        if failed:
+            raise Exception('Upload failed for site: {}. {} of {} chunks were NOT uploaded, call again to resume: {}'.format(
+                site_id, len(failed), len(starts),
+                {str(pd.Timestamp(valid_ns[starts[i]])): str(e) for i, e in sorted(failed.items())}))
+
+        _remove_upload_checkpoint(checkpoint_file)
+        print("Success! Data from {} to {} was uploaded in {} chunks.".format(
+            pd.Timestamp(valid_ns[0]), pd.Timestamp(valid_ns[-1]), len(starts)))
@@ -1,80 +1,459 @@
 import rebase.util.api_request as api_request
+import rebase.util.metrics as metrics
+import numpy as np
 import pandas as pd
+from pandas.tseries.frequencies import to_offset
 import json
 import pickle
 import rebase as rb
 import hashlib
+import threading
+from contextlib import contextmanager
+from operator import itemgetter
+from rebase.util.parallel import imap_bounded, SingleFlight
+from rebase.util.weather_cache import WeatherCache, split_intervals, format_timestamp
+from rebase.util.timestamps import to_ns, from_ns
+from rebase.util.compact import compact
+import rebase.util.weather_store as weather_store
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
+# Operational responses shared while Weather.shared() is active
+_shared = None
+_shared_depth = 0
+_shared_lock = threading.Lock()
+
+
+_DAY_NS = 24 * 3600 * 10**9
+
+# Concurrent identical queries share one fetch
+_historical_flight = SingleFlight('weather_historical')
+_operational_flight = SingleFlight('weather_operational')
+
 
 def get_cached_weather(cache_file):
-    try:
-        with open(cache_file, 'rb') as f:
-            return pickle.load(f)
-    except:
-        return None
+    # Corrupt or half written files are removed and count as a miss
+    return rb.cache.read_checked(cache_file, pickle.load, kind='weather')
 
 def save_cached_weather(cache_file, df):
+    rb.ensure_cache_dir()
+    rb.cache.write_checked(cache_file, lambda f: pickle.dump(df, f))
+    rb.cache.maybe_prune()
+
+
+def _shallow_copy(df):
+    return df.copy(deep=False)
+
+
+def _datetime_level(values):
+    # Forecast runs repeat the same timestamps many times, parse each
+    # distinct string once and build the level from its codes
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object), sort=True)
+    return codes, pd.to_datetime(uniques)
+
+
+def _column_array(values, dtype=None):
+    if dtype is not None and len(values) > 0 and type(values[0]) in (float, int):
+        # Straight to the compact dtype, without a float64 copy first
+        try:
+            return np.asarray(values, dtype=dtype)
+        except (TypeError, ValueError):
+            pass
+    arr = np.asarray(values)
+    if arr.dtype == object:
+        try:
+            arr = arr.astype('float64')
+        except (TypeError, ValueError):
+            pass
+    if dtype is not None and arr.dtype.kind == 'f':
+        arr = arr.astype(dtype)
+    return arr
+
+
+def records_to_df(data, dtype=None):
+    """Build a (ref_datetime, valid_datetime) indexed frame from decoded NWP json
+
+    Args:
+        data (list or dict): list of records, or dict of columns given as
+            lists or as {row: value} dicts
+        dtype (str): dtype of the numeric columns, e.g. ``'float32'`` to
+            halve their memory, default float64
+
+    Returns:
+        pd.DataFrame: the weather data
+    """
+    if isinstance(data, dict):
+        columns = {k: list(v.values()) if isinstance(v, dict) else v for k, v in data.items()}
+    elif len(data) > 0:
+        keys = list(data[0].keys())
+        columns = None
+        if set(map(len, data)) == {len(keys)}:
+            # Same number of keys in every record, transpose with one pass
+            # over rows unless some record has other keys
+            try:
+                columns = dict(zip(keys, zip(*map(itemgetter(*keys), data))))
+            except KeyError:
+                pass
+        if columns is None:
+            keys = list(dict.fromkeys(k for r in data for k in r))
+            columns = {k: [r.get(k) for r in data] for k in keys}
+    else:
+        columns = {}
+
+    if not columns:
+        columns = {'ref_datetime': [], 'valid_datetime': []}
+    ref_codes, ref_levels = _datetime_level(columns.pop('ref_datetime'))
+    valid_codes, valid_levels = _datetime_level(columns.pop('valid_datetime'))
+    index = pd.MultiIndex(levels=[ref_levels, valid_levels],
+                          codes=[ref_codes, valid_codes],
+                          names=['ref_datetime', 'valid_datetime'],
+                          verify_integrity=False)
+    return pd.DataFrame({k: _column_array(v, dtype) for k, v in columns.items()}, index=index)
+
+
+def json_to_df(json_data, dtype=None):
+    """Decode an NWP json response, uses orjson if it is installed
+
+    Args:
+        json_data (bytes or str): the response body, pass ``response.content``
+            to skip decoding the body to text first
+        dtype (str): dtype of the numeric columns, default float64
+    """
+    return records_to_df(json_loads(json_data), dtype=dtype)
+
+
+def _step_ns(resolution):
     try:
-        with open(cache_file, 'wb') as f:
-            pickle.dump(df, f)
-    except:
-        pass
+        return to_offset(resolution).nanos
+    except ValueError:
+        # Calendar based frequency like 'MS', no fixed step
+        return None
+
+
+# Aggregations the fast path of resample() supports: bins without data are
+# interpolated for the first ones, the others are 0 like in pandas
+_INTERPOLATED_AGGS = ('mean', 'median', 'min', 'max', 'first', 'last')
+_ZERO_AGGS = ('sum', 'count')
+
+
+def _fixed_bins(step, tz):
+    # Pandas starts the bins at midnight of the first day of every run, they
+    # fall on multiples of the step since the epoch only if the step divides
+    # a day and days start at midnight UTC
+    if step is None or step <= 0 or _DAY_NS % step != 0:
+        return False
+    return tz is None or str(tz) == 'UTC'
+
+
+def _interpolate_groups(values, groups):
+    # Linear interpolation of NaNs along axis 0 between the closest known
+    # values of the same group, NaNs after the last known value take that
+    # value, like DataFrame.interpolate(method='linear')
+    n = len(values)
+    rows = np.arange(n)[:, None]
+    cols = np.arange(values.shape[1])[None, :]
+    known = ~np.isnan(values)
+    before = np.maximum.accumulate(np.where(known, rows, -1), axis=0)
+    after = np.minimum.accumulate(np.where(known, rows, n)[::-1], axis=0)[::-1]
+    before_row = np.clip(before, 0, n - 1)
+    after_row = np.clip(after, 0, n - 1)
+    has_before = (before >= 0) & (groups[before_row] == groups[:, None])
+    has_after = (after < n) & (groups[after_row] == groups[:, None])
+
+    before_value = values[before_row, cols]
+    after_value = values[after_row, cols]
+    weight = (rows - before) / np.maximum(after - before, 1)
+    filled = np.where(has_after, before_value + (after_value - before_value) * weight, before_value)
+    return np.where(known, values, np.where(has_before, filled, np.nan))
+
+
+def resample(df, resolution, agg='mean'):
+    """Resample every forecast run of weather data to a new resolution
+
+    All runs are resampled at once: rows are binned on valid_datetime per
+    ref_datetime with a single groupby, and bins without data are linearly
+    interpolated within their own run, never across runs. Bins without data
+    are 0 for ``'sum'`` and ``'count'``.
+
+    Args:
+        df (pd.DataFrame): data indexed by (ref_datetime, valid_datetime)
+        resolution (str): the new resolution, e.g. ``'15min'`` or ``'1h'``
+        agg (str or function): aggregation of the values within a bin,
+            e.g. ``'mean'``, ``'max'``, ``'sum'``, ``'last'``
+
+    Returns:
+        pd.DataFrame: resampled numeric columns indexed by
+        (ref_datetime, valid_datetime)
+
+    Example::
+
+        >>> df = rb.Weather.historical(params)
+        >>> hourly_max = rb.resample(df, '1h', agg='max')
+    """
+    data = df.select_dtypes('number')
+    ref = df.index.get_level_values(0)
+    valid = df.index.get_level_values(1)
+    step = _step_ns(resolution)
+    fast = isinstance(agg, str) and (agg in _INTERPOLATED_AGGS or agg in _ZERO_AGGS)
+    if not fast or not _fixed_bins(step, valid.tz):
+        return data.set_axis(valid, axis=0) \
+                    .groupby(ref) \
+                    .resample(resolution).agg(agg) \
+                    .groupby(level=0).transform(lambda g: g.interpolate(method='linear'))
+
+    ref_codes, ref_levels = pd.factorize(ref, sort=True)
+    valid_ns = to_ns(valid)
+    bins = valid_ns - valid_ns % step
+    binned = data.groupby([ref_codes, bins], sort=True).agg(agg)
+
+    # Regular grid from the first to the last bin of every run
+    codes = binned.index.get_level_values(0).to_numpy()
+    binned_ns = binned.index.get_level_values(1).to_numpy()
+    groups, first, counts = np.unique(codes, return_index=True, return_counts=True)
+    start = binned_ns[first]
+    n_bins = (binned_ns[first + counts - 1] - start) // step + 1
+    grid_start = np.cumsum(n_bins) - n_bins
+    grid_codes = np.repeat(groups, n_bins)
+    grid_ns = np.repeat(start, n_bins) + (np.arange(n_bins.sum()) - np.repeat(grid_start, n_bins)) * step
+
+    values = np.full((len(grid_ns), data.shape[1]), 0.0 if agg in _ZERO_AGGS else np.nan)
+    values[np.repeat(grid_start, counts) + (binned_ns - np.repeat(start, counts)) // step] = binned.to_numpy(dtype='float64')
+    if agg == 'count':
+        values = values.astype('int64')
+    elif agg not in _ZERO_AGGS:
+        values = _interpolate_groups(values, grid_codes)
+
+    index = pd.MultiIndex.from_arrays([ref_levels.take(grid_codes), from_ns(grid_ns, valid.tz)],
+                                      names=['ref_datetime', 'valid_datetime'])
+    return pd.DataFrame(values, index=index, columns=data.columns)
+
+def cache_file_path(json_params):
+    params_hash = hashlib.md5(json_params.encode('utf-8')).hexdigest()
+    return '{}/{}.pickle'.format(rb.cache_dir, params_hash)
 
 
-def json_to_df(json_data):
-    df = pd.read_json(json_data)
-    df.index = pd.MultiIndex.from_arrays(
-             [pd.to_datetime(df['ref_datetime'].values),
-             pd.to_datetime(df['valid_datetime'].values)],
-             names=['ref_datetime', 'valid_datetime'])
-    # Drop now duplicated index columns
-    df = df.drop(columns=['ref_datetime', 'valid_datetime'])
-    return df
+def cache_store_path(json_params, dtype=None):
+    params_hash = hashlib.md5(json_params.encode('utf-8')).hexdigest()
+    return '{}/{}.{}.store'.format(rb.cache_dir, params_hash, dtype or 'float64')
 
 
-def resample(df, resolution):
-    return df.reset_index() \
-                .set_index(df.index.get_level_values(1)) \
-                .groupby(df.index.get_level_values(0)) \
-                .resample(resolution).mean().interpolate(method='linear')
+def _write_store(path, df):
+    rb.ensure_cache_dir()
+    try:
+        weather_store.write(path, df)
+    except Exception as e:
+        print('Failed writing weather store {}: {}'.format(path, e))
+        return df
+    rb.cache.maybe_prune()
+    mapped = weather_store.read(path)
+    return df if mapped is None else mapped
+
+
+def response_to_df(response):
+    if response.status_code != 200:
+        raise Exception('Failed retrieving weather data, status: {}, data: {}'.format(response.status_code, response.content.decode('utf-8')))
+    try:
+        return json_to_df(response.content)
+    except Exception as e:
+        print("Error converting to json: {}".format(response.text))
+        raise e
+
 
 class Weather():
 
+    historical_path = '/weather/v1/get_nwp'
+
     @classmethod
-    def historical(cls, params, resolution=None):
-        path = '/weather/v1/get_nwp'
-        json_params = json.dumps(params)
-        params_hash = hashlib.md5(json_params.encode('utf-8')).hexdigest()
-        cache_file = '{}/{}.pickle'.format(rb.cache_dir, params_hash)
+    def historical(cls, params, resolution=None, agg='mean', window=None, n_jobs=4, max_tries=3, dtype=None,
+                   mmap=False):
+        """Get historical NWP data
+
+        Queries with a ref time range (``start_date`` and ``end_date``) are
+        cached locally by :class:`rebase.util.weather_cache.WeatherCache`.
+        Only the parts of the range that are not already cached are
+        downloaded, so sub-ranges and overlapping queries reuse earlier data.
+
+        With ``window`` the missing range is split into windows that are
+        fetched by ``n_jobs`` threads. Each window is stored in the cache as
+        soon as it arrives and failed windows are retried, so a long backfill
+        that fails part way resumes from the cached windows when called again.
+
+        Args:
+            params (dict): the weather query params
+            resolution (str): resample to this resolution, e.g. ``'15min'``
+            agg (str or function): aggregation used when resampling
+            window (str): fetch the range in windows of this length, e.g.
+                ``'30D'``, default one request for each missing interval
+            n_jobs (int): number of windows fetched in parallel
+            max_tries (int): times a window is tried before giving up
+            dtype (str): compact mode, e.g. ``'float32'`` loads the columns
+                as float32 and halves their memory, see
+                :func:`rebase.util.compact.compact`
+            mmap (bool): memory map the data read-only from a
+                :mod:`rebase.util.weather_store` in ``rb.cache_dir`` instead
+                of loading it into memory, so worker processes on a host
+                share one copy of it. Modifying the frame copies the
+                modified columns.
+
+        Returns:
+            pd.DataFrame: data indexed by (ref_datetime, valid_datetime)
 
+        Example::
+
+            >>> params = {'model': 'DWD_ICON-EU', 'start_date': '2019-01-01', 'end_date': '2021-01-01', ...}
+            >>> df = rb.Weather.historical(params, window='30D', n_jobs=8)
+        """
+        # Threads asking for the same params at the same time share one fetch.
+        # Mapped frames are read-only, so they share their data too
+        key = json.dumps({'params': params, 'dtype': dtype, 'mmap': mmap}, sort_keys=True)
+        df = _historical_flight.do(key, cls._historical, params, window, n_jobs, max_tries, dtype, mmap,
+                                   copy=_shallow_copy if mmap else pd.DataFrame.copy)
+
+        if resolution:
+            df = resample(df, resolution, agg=agg)
+            if dtype:
+                df = compact(df, dtype)
+
+        return df
+
+    @classmethod
+    def _historical(cls, params, window, n_jobs, max_tries, dtype=None, mmap=False):
+        cache = WeatherCache.for_params(params)
+        if cache is not None and cache.columnar():
+            df = cls._historical_range(cache, window, n_jobs, max_tries, dtype, mmap)
+            if df is not None:
+                return df
+        return cls._historical_file(params, dtype, mmap)
+
+    @classmethod
+    def _historical_file(cls, params, dtype=None, mmap=False):
+        # The whole query cached in one file
+        if mmap:
+            store_path = cache_store_path(json.dumps(params), dtype)
+            df = weather_store.read(store_path)
+            metrics.inc('rebase_weather_cache_total', cache='store', result='miss' if df is None else 'hit')
+            if df is None:
+                df = cls._fetch_historical(params)
+                df = _write_store(store_path, compact(df, dtype) if dtype else df)
+            return df
+
+        cache_file = cache_file_path(json.dumps(params))
         df = get_cached_weather(cache_file)
+        metrics.inc('rebase_weather_cache_total', cache='pickle', result='miss' if df is None else 'hit')
         if df is None:
-            response = api_request.get(path, params={'query_params': json_params})
-            if response.status_code != 200:
-                raise Exception('Failed retrieving weather data, status: {}, data: {}'.format(response.status_code, response.content.decode('utf-8')))
+            df = cls._fetch_historical(params)
+            save_cached_weather(cache_file, df)
+        if dtype:
+            df = compact(df, dtype)
+        return df
+
+    @classmethod
+    def _historical_range(cls, cache, window, n_jobs, max_tries, dtype=None, mmap=False):
+        # None if the query returns non numeric columns, which can only be
+        # cached as a whole
+        for attempt in range(2):
+            missing = cache.missing()
+            metrics.inc('rebase_weather_cache_total', cache='range', result='miss' if missing else 'hit')
+            if window is None:
+                for start, end in missing:
+                    if not cache.store(cls._fetch_historical(cache.range_params(start, end)), start, end):
+                        return None
+            else:
+                cls._fetch_windows(cache, split_intervals(missing, window), n_jobs, max_tries)
+                if not cache.columnar():
+                    return None
             try:
-                df = json_to_df(response.text)
-            except Exception as e:
-                print("Error converting to json: {}".format(response.text))
-                raise e
+                return cache.load(dtype=dtype, mmap=mmap)
+            except Exception:
+                # Corrupt partitions are dropped by load(), fetch them again
+                if attempt > 0 or not cache.missing():
+                    raise
 
-        save_cached_weather(cache_file, df)
+    @classmethod
+    def _fetch_historical(cls, params):
+        response = api_request.get(cls.historical_path, params={'query_params': json.dumps(params)})
+        return response_to_df(response)
 
-        if resolution:
-            df = resample(df, resolution)
+    @classmethod
+    def _fetch_windows(cls, cache, windows, n_jobs, max_tries):
+        def fetch(window):
+            start, end = window
+            cache.store(cls._fetch_historical(cache.range_params(start, end)), start, end)
 
-        return df
+        for n_try in range(1, max_tries + 1):
+            failed = {}
+            for window, _, error in imap_bounded(fetch, windows, n_jobs=n_jobs):
+                if error is not None:
+                    failed[window] = error
+            metrics.inc('rebase_weather_windows_total', len(windows) - len(failed), result='ok')
+            metrics.inc('rebase_weather_windows_total', len(failed), result='failed')
+            if not failed:
+                return
+            windows = sorted(failed)
+            if n_try < max_tries:
+                print('Retrying {} failed weather windows'.format(len(windows)))
+
+        raise Exception('Failed retrieving weather data for {} windows, call again to resume: {}'.format(
+            len(failed), {'{} - {}'.format(format_timestamp(s), format_timestamp(e)): str(error)
+                          for (s, e), error in sorted(failed.items())}))
 
     @classmethod
-    def operational(cls, params, resolution=None):
-        path = '/weather/v1/get_latest_nwp'
-        json_params = json.dumps(params)        
+    @contextmanager
+    def shared(cls):
+        """Share operational weather between the callers within the block
 
-        response = api_request.get(path, params={'query_params': json_params})
-        if response.status_code != 200:
-            raise Exception('Failed retrieving weather data, status: {}'.format(response.status_code))
-        df = json_to_df(response.text)
+        While the block runs, :meth:`operational` fetches each query once
+        and returns a copy of the same data for repeated queries, e.g. for
+        many models of the same site in a prediction cycle. The shared data
+        is dropped when the outermost block exits, so the next cycle fetches
+        the latest data.
+
+        Example::
+
+            >>> with rb.Weather.shared():
+            ...     forecasts = [runner.predict() for runner in runners]
+        """
+        global _shared, _shared_depth
+        with _shared_lock:
+            if _shared_depth == 0:
+                _shared = {}
+            _shared_depth += 1
+        try:
+            yield
+        finally:
+            with _shared_lock:
+                _shared_depth -= 1
+                if _shared_depth == 0:
+                    _shared = None
+
+    @classmethod
+    def operational(cls, params, resolution=None, agg='mean', dtype=None):
+        path = '/weather/v1/get_latest_nwp'
+        json_params = json.dumps(params)
+        key = json.dumps(params, sort_keys=True)
+        shared = _shared
+        if shared is not None:
+            df = shared.get(key)
+            metrics.inc('rebase_weather_cache_total', cache='shared', result='miss' if df is None else 'hit')
+            if df is None:
+                df = shared.setdefault(key, _operational_flight.do(key, cls._fetch_operational, path, json_params))
+            df = df.copy()
+        else:
+            df = _operational_flight.do(key, cls._fetch_operational, path, json_params, copy=pd.DataFrame.copy)
 
         if resolution:
-            df = resample(df, resolution)
+            df = resample(df, resolution, agg=agg)
+        if dtype:
+            df = compact(df, dtype)
 
         return df
+
+    @classmethod
+    def _fetch_operational(cls, path, json_params):
+        response = api_request.get(path, params={'query_params': json_params})
+        if response.status_code != 200:
+            raise Exception('Failed retrieving weather data, status: {}'.format(response.status_code))
+        return json_to_df(response.content)
@@ -0,0 +1,453 @@
+"""Management of the local cache in ``rb.cache_dir``
+
+The cache is made of entries that are used and removed as a whole::
+
+    <cache_dir>/<params hash>.pickle              weather          rebase.api.weather
+    <cache_dir>/<params hash>.<dtype>.store/      weather          rebase.util.weather_store
+    <cache_dir>/nwp/<model>/<params hash>/        nwp              rebase.util.weather_cache
+    <cache_dir>/artifacts/<content hash>.pkl      artifacts        rebase.util.artifact_cache
+    <cache_dir>/observations/<site_id>/           observations     rebase.util.observation_store
+    <cache_dir>/sites/<site_id>.json              sites            rebase.util.site_cache
+
+Files are written atomically and entries are locked across processes while
+they are written, so workers can share a cache directory. The lock files
+are kept in ``<cache_dir>/locks/`` and removed with their entry. When the
+cache grows over :data:`max_bytes` the least recently used entries are
+removed. Synced observation stores are primary data and are never evicted,
+nor are upload checkpoints and temporary files of running jobs.
+
+Example::
+
+    >>> rb.cache.max_bytes = 50 * 1024**3
+    >>> rb.cache.stats()['bytes']
+    >>> rb.cache.prune()
+"""
+import contextlib
+import hashlib
+import os
+import pickle
+import shutil
+import struct
+import threading
+import time
+import zlib
+import rebase as rb
+import rebase.util.metrics as metrics
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, entries are then only locked by the thread
+    # locks of each module
+    fcntl = None
+
+# Max total size of the cache in bytes, None disables the quota
+max_bytes = 10 * 1024**3
+
+# Min seconds between the prunes a process runs after writing to the cache
+prune_interval = 60
+
+# Temporary files older than this many seconds were left by writers that
+# crashed, and are removed by prune()
+tmp_max_age = 3600
+
+# Header of the files written by write_checked(): magic, size and crc32
+CHECKED_MAGIC = b'RBCHECK1'
+_HEADER = '<QI'
+
+# Errors reading a file that mean it is corrupt
+CORRUPT_ERRORS = (ValueError, EOFError, OSError, struct.error, pickle.UnpicklingError)
+
+# (kind, directory in cache_dir, depth of the entries, suffixes of the entries)
+_KINDS = [
+    ('weather', (), 1, ('.pickle', '.store')),
+    ('nwp', ('nwp',), 2, None),
+    ('artifacts', ('artifacts',), 1, ('.pkl',)),
+    ('observations', ('observations',), 1, None),
+    ('sites', ('sites',), 1, ('.json',)),
+]
+
+# Kinds of entries that prune() never evicts
+_KEEP = ('observations',)
+
+_lock = threading.Lock()
+_last_prune = None
+
+
+def _lock_file(path):
+    key = hashlib.md5(os.path.realpath(path).encode('utf-8')).hexdigest()
+    return os.path.join(rb.ensure_cache_dir('locks'), '{}.lock'.format(key))
+
+
+def _open_locked(lock_file, flags):
+    # Lock files are removed with the entry, by a process that holds the
+    # lock. If ours was removed while we waited, lock the new file instead
+    while True:
+        f = open(lock_file, 'a')
+        try:
+            fcntl.flock(f, flags)
+        except BlockingIOError:
+            f.close()
+            return None
+        try:
+            if os.fstat(f.fileno()).st_ino == os.stat(lock_file).st_ino:
+                return f
+        except FileNotFoundError:
+            pass
+        f.close()
+
+
+@contextlib.contextmanager
+def lock(path, shared=False, blocking=True):
+    """Lock a cache entry across processes
+
+    Writers hold an exclusive lock, readers that must not see the entry
+    removed hold a shared lock. Entries are only evicted if they are not
+    locked.
+
+    Args:
+        path (str): path of the entry
+        shared (bool): take a shared lock instead of an exclusive one
+        blocking (bool): wait for the lock, else give up if it is held
+
+    Yields:
+        bool: whether the lock was acquired
+
+    Example::
+
+        >>> with rb.cache.lock(path):
+        ...     write(path)
+    """
+    if fcntl is None:
+        yield True
+        return
+    f = _open_locked(_lock_file(path), (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | (0 if blocking else fcntl.LOCK_NB))
+    if f is None:
+        yield False
+        return
+    try:
+        yield True
+    finally:
+        fcntl.flock(f, fcntl.LOCK_UN)
+        f.close()
+
+
+def _remove_lock_file(path):
+    # Only while the lock of path is held exclusively
+    if fcntl is not None:
+        try:
+            os.remove(_lock_file(path))
+        except OSError:
+            pass
+
+
+@contextlib.contextmanager
+def atomic_write(path, mode='wb'):
+    """Write a file atomically
+
+    The data is written to a temporary file next to ``path``, synced and
+    renamed to ``path`` once it is complete, so readers never see a partial
+    file, even after a crash, and concurrent writers don't interleave.
+
+    Args:
+        path (str): path of the file
+        mode (str): mode the file is opened with
+
+    Yields:
+        file: the temporary file
+    """
+    tmp_file = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+    try:
+        with open(tmp_file, mode) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, path)
+    except BaseException:
+        try:
+            os.remove(tmp_file)
+        except OSError:
+            pass
+        raise
+
+
+class _ChecksumWriter():
+
+    def __init__(self, f):
+        self.f = f
+        self.size = 0
+        self.crc = 0
+
+    def write(self, data):
+        self.size += memoryview(data).nbytes
+        self.crc = zlib.crc32(data, self.crc)
+        return self.f.write(data)
+
+
+def write_checked(path, dump):
+    """Write a file atomically with a checksum of its data
+
+    Args:
+        path (str): path of the file
+        dump (function): called with a file to write the data to, e.g.
+            ``lambda f: pickle.dump(df, f)``
+    """
+    with atomic_write(path) as f:
+        f.write(CHECKED_MAGIC + struct.pack(_HEADER, 0, 0))
+        writer = _ChecksumWriter(f)
+        dump(writer)
+        f.seek(len(CHECKED_MAGIC))
+        f.write(struct.pack(_HEADER, writer.size, writer.crc))
+
+
+def read_checked(path, load, kind='weather'):
+    """Read a file written by :func:`write_checked`
+
+    The size and checksum of the data are verified before ``load`` is called.
+    A corrupt file, i.e. a checksum mismatch or ``load`` failing with
+    :data:`CORRUPT_ERRORS`, is removed so it is written again. Other errors,
+    e.g. a class missing when unpickling, are raised and the file is kept.
+    Files without a checksum, from older versions, are only checked by
+    ``load``.
+
+    Args:
+        path (str): path of the file
+        load (function): called with the file positioned at the data, e.g.
+            ``pickle.load``
+        kind (str): kind of entry, for the metrics
+
+    Returns:
+        object: the result of ``load``, None if the file doesn't exist or is
+        corrupt
+    """
+    try:
+        with open(path, 'rb') as f:
+            if f.read(len(CHECKED_MAGIC)) == CHECKED_MAGIC:
+                size, crc = struct.unpack(_HEADER, f.read(struct.calcsize(_HEADER)))
+                start = f.tell()
+                actual_size, actual_crc = 0, 0
+                for chunk in iter(lambda: f.read(1024**2), b''):
+                    actual_size += len(chunk)
+                    actual_crc = zlib.crc32(chunk, actual_crc)
+                if (actual_size, actual_crc) != (size, crc):
+                    raise ValueError('checksum mismatch')
+                f.seek(start)
+            else:
+                f.seek(0)
+            result = load(f)
+    except FileNotFoundError:
+        return None
+    except CORRUPT_ERRORS as e:
+        remove_corrupt(path, e, kind)
+        return None
+    touch(path)
+    return result
+
+
+def touch(path):
+    """Mark a cache entry as used, so it is evicted last
+    """
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def remove(path):
+    """Remove a cache entry, a file or a directory
+    """
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def remove_corrupt(path, error, kind):
+    """Remove a corrupt cache entry, so it is fetched again
+
+    Args:
+        path (str): path of the entry
+        error (Exception): the error reading it
+        kind (str): kind of entry, for the metrics
+    """
+    print('Removing corrupt cache entry {}: {}'.format(path, error))
+    metrics.inc('rebase_cache_corrupt_total', kind=kind)
+    remove(path)
+
+
+def _size(path):
+    if not os.path.isdir(path):
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def _children(path, depth):
+    try:
+        names = sorted(os.listdir(path))
+    except OSError:
+        return []
+    paths = [os.path.join(path, name) for name in names if not name.endswith('.tmp')]
+    if depth == 1:
+        return paths
+    return [child for p in paths if os.path.isdir(p) for child in _children(p, depth - 1)]
+
+
+def entries():
+    """List the entries of the cache
+
+    Returns:
+        list: a dict with ``kind``, ``path``, ``bytes`` and ``used``, the
+        time it was last used, for every entry, least recently used first
+    """
+    result = []
+    for kind, path in _entry_paths():
+        try:
+            used = os.stat(path).st_mtime
+        except OSError:
+            continue
+        result.append({'kind': kind, 'path': path, 'bytes': _size(path), 'used': used})
+    return sorted(result, key=lambda e: e['used'])
+
+
+def _entry_paths():
+    for kind, parts, depth, suffixes in _KINDS:
+        for path in _children(os.path.join(rb.cache_dir, *parts), depth):
+            if suffixes is not None and not path.endswith(suffixes):
+                continue
+            if suffixes is None and not os.path.isdir(path):
+                continue
+            yield kind, path
+
+
+def stats():
+    """Usage of the cache
+
+    Returns:
+        dict: ``bytes`` used by all files in ``rb.cache_dir``, ``max_bytes``
+        and for each ``kind`` of entry its number of ``entries`` and ``bytes``,
+        the lock files of the entries are counted as kind ``locks``
+
+    Example::
+
+        >>> rb.cache.stats()
+        {'bytes': 1843200, 'max_bytes': 10737418240, 'kinds': {'nwp': {'entries': 2, 'bytes': 1802240}, ...}}
+    """
+    kinds = {kind: {'entries': 0, 'bytes': 0} for kind, _, _, _ in _KINDS}
+    for entry in entries():
+        kinds[entry['kind']]['entries'] += 1
+        kinds[entry['kind']]['bytes'] += entry['bytes']
+    lock_files = _children(os.path.join(rb.cache_dir, 'locks'), 1)
+    kinds['locks'] = {'entries': len(lock_files), 'bytes': sum(_size(path) for path in lock_files)}
+    return {'bytes': _size(rb.cache_dir), 'max_bytes': max_bytes, 'kinds': kinds}
+
+
+def _remove_stale_tmp(now):
+    # Files and directories of writers that crashed before renaming them
+    freed = 0
+    for root, dirs, files in os.walk(rb.cache_dir):
+        for name in [d for d in dirs if d.endswith('.tmp')] + [f for f in files if f.endswith('.tmp')]:
+            path = os.path.join(root, name)
+            try:
+                if now - os.stat(path).st_mtime < tmp_max_age:
+                    continue
+            except OSError:
+                continue
+            freed += _size(path)
+            remove(path)
+        dirs[:] = [d for d in dirs if not d.endswith('.tmp')]
+    return freed
+
+
+def prune(max_bytes=None, blocking=True):
+    """Remove least recently used entries until the cache fits its quota
+
+    Entries that are locked by another thread or process, and observation
+    stores, are skipped.
+    Temporary files left by crashed writers and lock files of entries that
+    no longer exist are removed as well.
+
+    Args:
+        max_bytes (int): quota in bytes, default :data:`max_bytes`
+        blocking (bool): wait for a prune running in another process,
+            else return at once
+
+    Returns:
+        dict: number of ``removed`` entries and ``freed`` bytes
+    """
+    quota = globals()['max_bytes'] if max_bytes is None else max_bytes
+    result = {'removed': 0, 'freed': 0}
+    if not os.path.isdir(rb.cache_dir):
+        return result
+    with lock(os.path.join(rb.cache_dir, 'prune'), blocking=blocking) as acquired:
+        if not acquired:
+            return result
+        result['freed'] += _remove_stale_tmp(time.time())
+        _remove_unused_lock_files()
+        if quota is None:
+            return result
+        total = _size(rb.cache_dir)
+        for entry in entries():
+            if total <= quota:
+                break
+            if entry['kind'] in _KEEP:
+                continue
+            with lock(entry['path'], blocking=False) as acquired:
+                if not acquired:
+                    continue
+                remove(entry['path'])
+                _remove_lock_file(entry['path'])
+            total -= entry['bytes']
+            result['removed'] += 1
+            result['freed'] += entry['bytes']
+            metrics.inc('rebase_cache_evictions_total', kind=entry['kind'])
+    return result
+
+
+def _remove_unused_lock_files():
+    # Lock files of entries that were removed another way, e.g. corrupt
+    # ones. A lock file of an entry that still exists is created again
+    if fcntl is None:
+        return
+    used = {os.path.basename(_lock_file(path)) for _, path in _entry_paths()}
+    used.add(os.path.basename(_lock_file(os.path.join(rb.cache_dir, 'prune'))))
+    for lock_file in _children(os.path.join(rb.cache_dir, 'locks'), 1):
+        if os.path.basename(lock_file) in used:
+            continue
+        f = _open_locked(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        if f is None:
+            continue
+        try:
+            os.remove(lock_file)
+        except OSError:
+            pass
+        finally:
+            f.close()
+
+
+def maybe_prune():
+    """Prune the cache after a write, at most every :data:`prune_interval`
+    seconds per process
+    """
+    global _last_prune
+    now = time.monotonic()
+    with _lock:
+        if _last_prune is not None and now - _last_prune < prune_interval:
+            return
+        _last_prune = now
+    try:
+        prune(blocking=False)
+    except OSError as e:
+        print('Failed pruning cache: {}'.format(e))
@@ -1,55 +1,226 @@
+import gzip
 import requests
+from requests.adapters import HTTPAdapter
 import rebase as rb
 import time
 import random
+import threading
+import atexit
+import os
 from rebase.error import AuthenticationError
+import rebase.util.rate_limit as rate_limit
+import rebase.util.metrics as metrics
+
+# Connection pool settings used when the shared session is created,
+# change them with configure_session()
+session_config = {
+    'pool_connections': 10,
+    'pool_maxsize': 32,
+    'pool_block': False,
+    'keep_alive': True,
+}
+
+# Request bodies of calls made with compress=True are gzip compressed when
+# they are at least compress_min_bytes long. Uploads that are not given
+# compress use compress_requests. Request compression is off by default, it
+# needs an API that decodes gzip request bodies and only pays off on slow
+# links. Level 1 gives most of the size reduction at a fraction of the cpu
+# time of higher levels, see benchmarks/bench_compression.py
+compress_requests = False
+compress_min_bytes = 1024
+compress_level = 1
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def _new_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=session_config['pool_connections'],
+        pool_maxsize=session_config['pool_maxsize'],
+        pool_block=session_config['pool_block'],
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    if not session_config['keep_alive']:
+        session.headers['Connection'] = 'close'
+    return session
+
+
+def get_session():
+    """Get the process-wide HTTP session
+
+    The session keeps connections alive between calls so that repeated
+    requests to the API reuse the same TCP/TLS connection. It is shared by
+    all threads, the underlying urllib3 pool is thread-safe.
+
+    Returns:
+        requests.Session: the shared session
+    """
+    global _session
+    session = _session
+    if session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _new_session()
+            session = _session
+    return session
+
+
+def configure_session(pool_connections=None, pool_maxsize=None, pool_block=None, keep_alive=None):
+    """Configure the connection pool of the shared session
+
+    Open connections are closed, the next request creates a new session
+    with the updated settings.
+
+    Args:
+        pool_connections (int): number of hosts to keep connection pools for
+        pool_maxsize (int): max number of connections kept alive per host,
+            should be at least the number of threads making requests
+        pool_block (bool): block when no connection is free instead of
+            opening a connection that is discarded after use
+        keep_alive (bool): reuse connections between requests
+
+    Example::
+
+        >>> import rebase.util.api_request as api_request
+        >>> api_request.configure_session(pool_maxsize=64)
+    """
+    updates = {
+        'pool_connections': pool_connections,
+        'pool_maxsize': pool_maxsize,
+        'pool_block': pool_block,
+        'keep_alive': keep_alive,
+    }
+    with _session_lock:
+        session_config.update({k: v for k, v in updates.items() if v is not None})
+    close_session()
+
+
+def close_session():
+    """Close the shared session and all of its pooled connections
+    """
+    global _session
+    with _session_lock:
+        session, _session = _session, None
+    if session is not None:
+        session.close()
+
+
+def _reset_after_fork():
+    # Sockets are shared with the parent process, start over without
+    # closing them
+    global _session, _session_lock
+    _session = None
+    _session_lock = threading.Lock()
+
+
+atexit.register(close_session)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
 
 def robust(max_tries=5, retry_statuses=[429]):
+    """Rate limit calls of an API request function and retry throttled calls
+
+    Calls wait for their turn in the shared token bucket of the endpoint
+    class, see :mod:`rebase.util.rate_limit`. A throttled call pauses the
+    bucket for all threads, honoring ``Retry-After``, and is then retried.
+    """
     def decorator(func):
-        def handle_call(*args, **kwargs):
+        def handle_call(path, *args, **kwargs):
+            bucket = rate_limit.limiter(path) if rate_limit.enabled else None
             n_try = 0
             while True:
-                response = func(*args, **kwargs)
+                if bucket is not None:
+                    delay = bucket.reserve()
+                    while delay > 0:
+                        metrics.inc('rebase_rate_limit_wait_seconds_total', delay, endpoint=rate_limit.endpoint_class(path))
+                        time.sleep(delay)
+                        # Reserved before a 429 paused the bucket, queue
+                        # again behind the pause
+                        delay = bucket.reserve() if bucket.paused() else 0
+                sent = time.monotonic()
+                response = func(path, *args, **kwargs)
                 if response.status_code in retry_statuses:
+                    if bucket is not None:
+                        bucket.throttled(rate_limit.retry_after(response), sent)
                     if n_try < max_tries:
-                        time.sleep(min(2**n_try * (1+random.random()), 300))
+                        metrics.inc('rebase_retries_total', endpoint=rate_limit.endpoint_class(path))
+                        if bucket is None:
+                            time.sleep(rate_limit.retry_after(response) or min(2**n_try * (1+random.random()), 300))
                         n_try += 1
                     else:
                         return response
                 else:
+                    if bucket is not None:
+                        bucket.succeeded()
                     return response
         return handle_call
     return decorator
 
-@robust(max_tries=10, retry_statuses=[429])
-def get(path, **kwargs):
+
+def auth_headers(content_type=None):
     headers = {'Authorization': rb.api_key, 'GL-API-KEY': rb.api_key}
-    url = rb.base_api_url+path
-    response = requests.get(url, **kwargs, headers=headers)
-    if response.status_code == 401:
-        raise AuthenticationError('Unathorized')
+    if content_type:
+        headers['Content-Type'] = content_type
+    return headers
 
-    return response
 
-@robust(max_tries=10, retry_statuses=[429])
-def post(path, **kwargs):
-    headers = {
-        'Authorization': rb.api_key,
-        'GL-API-KEY': rb.api_key,
-        'Content-Type': 'application/json'
-    }
-    url = rb.base_api_url+path
-    response = requests.post(url, **kwargs, headers=headers)
-    if response.status_code == 401:
-        raise AuthenticationError('Unathorized')
+def compress_body(data, compress=None):
+    """Gzip compress a request body
 
-    return response
+    Args:
+        data (bytes or str): the body
+        compress (bool): compress if the body is large enough, see
+            ``compress_min_bytes``, default ``compress_requests``
 
-def delete(path, **kwargs):
-    headers = {'Authorization': rb.api_key, 'GL-API-KEY': rb.api_key,}
+    Returns:
+        tuple: (body, headers), headers has ``Content-Encoding`` if the body
+        was compressed
+    """
+    if compress is None:
+        compress = compress_requests
+    if not compress or data is None or isinstance(data, dict):
+        return data, {}
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    if len(data) < compress_min_bytes:
+        return data, {}
+    return gzip.compress(data, compresslevel=compress_level), {'Content-Encoding': 'gzip'}
+
+
+def _request(method, path, headers, extra_headers=None, compress=False, **kwargs):
     url = rb.base_api_url+path
-    response = requests.delete(url, **kwargs, headers=headers)
+    if extra_headers:
+        headers = dict(headers, **extra_headers)
+    if compress is not False:
+        kwargs['data'], encoding_headers = compress_body(kwargs.get('data'), compress)
+        headers = dict(headers, **encoding_headers)
+    start = time.perf_counter()
+    response = get_session().request(method, url, **kwargs, headers=headers)
+    if metrics.enabled:
+        length = response.headers.get('Content-Length')
+        metrics.record_request(method, path, response.status_code, time.perf_counter() - start,
+                               data=kwargs.get('data'),
+                               response_bytes=int(length) if length else None if kwargs.get('stream') else len(response.content))
     if response.status_code == 401:
         raise AuthenticationError('Unathorized')
 
     return response
+
+# Pass compress=True to gzip compress the request body, or None to use
+# compress_requests. Responses are
+# decompressed as they are read when the API sends them compressed
+@robust(max_tries=10, retry_statuses=[429])
+def get(path, headers=None, **kwargs):
+    return _request('GET', path, auth_headers(), headers, **kwargs)
+
+@robust(max_tries=10, retry_statuses=[429])
+def post(path, headers=None, **kwargs):
+    return _request('POST', path, auth_headers('application/json'), headers, **kwargs)
+
+@robust(max_tries=10, retry_statuses=[429])
+def delete(path, headers=None, **kwargs):
+    return _request('DELETE', path, auth_headers(), headers, **kwargs)
@@ -0,0 +1,293 @@
+import hashlib
+import io
+import json
+import mmap
+import os
+import pickle
+import struct
+import threading
+import time
+from collections import OrderedDict
+import dill
+import numpy as np
+import rebase as rb
+import rebase.util.api_request as api_request
+import rebase.util.metrics as metrics
+
+# Max total size of the artifact files kept in rb.cache_dir, least recently
+# used artifacts are removed first
+max_bytes = 2 * 1024**3
+
+# Max number of deserialized artifacts kept in memory
+max_objects = 8
+
+# Size of the chunks artifacts are downloaded in
+chunk_size = 1024**2
+
+# Header of the zero-copy format written by dumps_zero_copy()
+ZERO_COPY_MAGIC = b'RBZCOPY1'
+_ALIGN = 64
+
+_lock = threading.Lock()
+_objects = OrderedDict()
+
+
+def _artifact_dir():
+    return os.path.join(rb.cache_dir, 'artifacts')
+
+
+def _index_file():
+    return os.path.join(_artifact_dir(), 'index.json')
+
+
+def _artifact_file(content_hash):
+    return os.path.join(_artifact_dir(), '{}.pkl'.format(content_hash))
+
+
+def _read_index():
+    try:
+        with open(_index_file()) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_index(index):
+    os.makedirs(_artifact_dir(), exist_ok=True)
+    with rb.cache.atomic_write(_index_file(), 'w') as f:
+        json.dump(index, f)
+
+
+def _evict(index, keep):
+    used = {}
+    sizes = {}
+    for entry in index.values():
+        used[entry['hash']] = max(used.get(entry['hash'], 0), entry['used'])
+        sizes[entry['hash']] = entry['size']
+    total = sum(sizes.values())
+    for content_hash in sorted(used, key=used.get):
+        if total <= max_bytes:
+            break
+        if content_hash == keep:
+            continue
+        total -= sizes[content_hash]
+        for key in [k for k, e in index.items() if e['hash'] == content_hash]:
+            del index[key]
+        try:
+            os.remove(_artifact_file(content_hash))
+        except OSError:
+            pass
+
+
+class _BufferPickler(dill.Pickler):
+    # dill pickles numpy arrays in-band, use the protocol 5 reduce of numpy
+    # so array data is passed to buffer_callback
+    dispatch = {t: f for t, f in dill.Pickler.dispatch.items() if t is not np.ndarray}
+
+    def save(self, obj, save_persistent_id=True):
+        if type(obj) is np.ndarray:
+            return pickle._Pickler.save(self, obj, save_persistent_id)
+        return super().save(obj, save_persistent_id)
+
+
+def dumps_zero_copy(obj):
+    """Serialize an object so its numpy arrays can be loaded zero-copy
+
+    The object is pickled with dill and protocol 5, the data of contiguous
+    numpy arrays is stored out-of-band after the pickle, aligned, so
+    :func:`load_file` can memory map it instead of copying it.
+
+    Returns:
+        bytes: the serialized object
+    """
+    buffers = []
+
+    def buffer_callback(buffer):
+        try:
+            buffers.append(buffer.raw())
+        except BufferError:
+            # Not contiguous, keep in-band
+            return True
+        return False
+
+    f = io.BytesIO()
+    _BufferPickler(f, protocol=5, buffer_callback=buffer_callback).dump(obj)
+    data = f.getvalue()
+
+    header_size = len(ZERO_COPY_MAGIC) + 16 + 16 * len(buffers)
+    offset = header_size + len(data)
+    layout = []
+    for buffer in buffers:
+        offset += -offset % _ALIGN
+        layout.append((offset, buffer.nbytes))
+        offset += buffer.nbytes
+
+    out = io.BytesIO()
+    out.write(ZERO_COPY_MAGIC)
+    out.write(struct.pack('<QQ', len(data), len(buffers)))
+    for buffer_offset, size in layout:
+        out.write(struct.pack('<QQ', buffer_offset, size))
+    out.write(data)
+    for (buffer_offset, _), buffer in zip(layout, buffers):
+        out.write(b'\0' * (buffer_offset - out.tell()))
+        out.write(buffer)
+    return out.getvalue()
+
+
+def load_file(file_path):
+    """Load a serialized artifact from a file
+
+    Pickles are read from the file without reading it into memory first.
+    Files written by :func:`dumps_zero_copy` are memory mapped and their
+    numpy arrays are read-only views of the file, so their data is only
+    paged in as it is used and is shared between processes.
+
+    Args:
+        file_path (str): path of the file
+
+    Returns:
+        object: the deserialized object
+    """
+    with open(file_path, 'rb') as f:
+        if f.read(len(ZERO_COPY_MAGIC)) != ZERO_COPY_MAGIC:
+            f.seek(0)
+            return dill.load(f)
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    view = memoryview(mapped)
+    offset = len(ZERO_COPY_MAGIC)
+    data_size, n_buffers = struct.unpack_from('<QQ', view, offset)
+    offset += 16
+    buffers = []
+    for _ in range(n_buffers):
+        buffer_offset, size = struct.unpack_from('<QQ', view, offset)
+        buffers.append(view[buffer_offset:buffer_offset + size])
+        offset += 16
+    return dill.loads(view[offset:offset + data_size], buffers=buffers)
+
+
+def _deserialize(content_hash, loader=None):
+    with _lock:
+        if content_hash in _objects:
+            _objects.move_to_end(content_hash)
+            return _objects[content_hash]
+    obj = (loader or load_file)(_artifact_file(content_hash))
+    with _lock:
+        _objects[content_hash] = obj
+        while len(_objects) > max_objects:
+            _objects.popitem(last=False)
+    return obj
+
+
+def _check_file(entry):
+    # Files are named by content hash, a file of another size is truncated
+    # or corrupt and is downloaded again
+    file_path = _artifact_file(entry['hash'])
+    try:
+        size = os.path.getsize(file_path)
+    except OSError:
+        return False
+    if size != entry['size']:
+        rb.cache.remove_corrupt(file_path, 'size {} instead of {}'.format(size, entry['size']), 'artifacts')
+        return False
+    return True
+
+
+def _download(response):
+    # Stream the body to a temporary file, hashing it on the way
+    os.makedirs(_artifact_dir(), exist_ok=True)
+    tmp_file = os.path.join(_artifact_dir(), '{}.{}.tmp'.format(os.getpid(), threading.get_ident()))
+    sha = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp_file, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                sha.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+        content_hash = sha.hexdigest()
+        if os.path.exists(_artifact_file(content_hash)):
+            os.remove(tmp_file)
+        else:
+            os.replace(tmp_file, _artifact_file(content_hash))
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+    return content_hash, size
+
+
+def load(key, path, max_age=None, loader=None):
+    """Load a pickled artifact, using the local cache when it is up to date
+
+    Downloaded artifacts are streamed in chunks to ``rb.cache_dir`` and
+    stored by content hash, then deserialized from the file, so the response
+    body is never held in memory.
+    A cached artifact is revalidated with a conditional request using the
+    ``ETag``/``Last-Modified`` headers of the previous download, so an
+    unchanged artifact costs a ``304`` response instead of a download. The
+    deserialized object is kept in memory and reused while the content hash
+    is the same.
+
+    Args:
+        key (str): key of the artifact, e.g. ``'<model_id>/trained'``
+        path (str): API path to download the artifact from
+        max_age (float): seconds after download during which the cached
+            artifact is used without revalidation, default always revalidate
+        loader (function): called with the path of the downloaded file to
+            deserialize it, default :func:`load_file`
+
+    Returns:
+        object: the deserialized artifact
+    """
+    with _lock:
+        entry = _read_index().get(key)
+    if entry is not None and not _check_file(entry):
+        entry = None
+
+    if entry is not None and max_age is not None and time.time() - entry['validated'] < max_age:
+        r = None
+        metrics.inc('rebase_artifact_cache_total', result='fresh')
+    else:
+        headers = {}
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        r = api_request.get(path, headers=headers, stream=True)
+        with r:
+            if r.status_code not in (200, 304) or (r.status_code == 304 and entry is None):
+                raise Exception('Failed downloading {}, status: {}'.format(key, r.status_code))
+            metrics.inc('rebase_artifact_cache_total', result='revalidated' if r.status_code == 304 else 'download')
+            if r.status_code == 200:
+                content_hash, size = _download(r)
+                entry = {
+                    'hash': content_hash,
+                    'size': size,
+                    'etag': r.headers.get('ETag'),
+                    'last_modified': r.headers.get('Last-Modified'),
+                }
+
+    now = time.time()
+    entry['used'] = now
+    if r is not None:
+        entry['validated'] = now
+    # Other processes update the index too, read and write it while locked
+    with _lock, rb.cache.lock(_index_file()):
+        index = _read_index()
+        index[key] = entry
+        _evict(index, entry['hash'])
+        _write_index(index)
+    rb.cache.touch(_artifact_file(entry['hash']))
+    if r is not None and r.status_code == 200:
+        rb.cache.maybe_prune()
+
+    return _deserialize(entry['hash'], loader)
+
+
+def clear_memory():
+    """Drop the deserialized artifacts kept in memory
+    """
+    with _lock:
+        _objects.clear()
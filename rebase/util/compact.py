@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+
+
+def _compact_index(index):
+    # Datetime levels are stored as int64 ns, object levels of timestamps
+    # are converted so they don't keep one Python object per value
+    if isinstance(index, pd.MultiIndex):
+        levels = [_datetime_values(level) for level in index.levels]
+        return index.set_levels(levels, verify_integrity=False)
+    return _datetime_values(index)
+
+
+def _datetime_values(index):
+    if index.dtype == object and len(index) > 0:
+        try:
+            return pd.DatetimeIndex(pd.to_datetime(index), name=index.name)
+        except (TypeError, ValueError):
+            pass
+    return index
+
+
+def _datetime_column(values):
+    # Parse each distinct string once, e.g. the ref time repeated on every
+    # row of a forecast
+    if len(values) == 0 or not isinstance(values.iloc[0], str):
+        return None
+    codes, uniques = pd.factorize(values)
+    try:
+        return pd.Series(pd.to_datetime(uniques).take(codes), index=values.index, name=values.name)
+    except (TypeError, ValueError):
+        return None
+
+
+def compact(df, dtype='float32'):
+    """Downcast a frame to use less memory
+
+    Float columns are converted to ``dtype`` and integer columns to the
+    smallest integer type that holds their values. Timestamps in object
+    columns and in the index are stored as datetime64 (int64 ns since
+    epoch) instead of one Python object per value.
+    MultiIndex levels are kept, so each distinct ref and valid time is
+    stored once.
+
+    Args:
+        df (pd.DataFrame): the frame
+        dtype (str): dtype of the float columns, e.g. ``'float32'``
+
+    Returns:
+        pd.DataFrame: the compact frame
+
+    Example::
+
+        >>> df = compact(rb.Weather.historical(params))
+        >>> memory_report(df)['total']
+    """
+    dtypes = {}
+    datetimes = {}
+    for name, values in df.items():
+        kind = values.dtype.kind
+        if kind == 'f' and values.dtype != np.dtype(dtype):
+            dtypes[name] = dtype
+        elif kind in 'iu':
+            dtypes[name] = pd.to_numeric(values, downcast='integer' if kind == 'i' else 'unsigned').dtype
+        elif kind == 'O':
+            converted = _datetime_column(values)
+            if converted is not None:
+                datetimes[name] = converted
+    if dtypes:
+        df = df.astype(dtypes)
+    if datetimes:
+        df = df.copy(deep=False)
+        for name, values in datetimes.items():
+            df[name] = values
+    index = _compact_index(df.index)
+    if index is not df.index:
+        df = df.set_axis(index, axis=0)
+    return df
+
+
+def memory_report(df):
+    """Memory used by a frame, in bytes
+
+    Args:
+        df (pd.DataFrame): the frame
+
+    Returns:
+        dict: ``rows``, ``index`` and ``total`` bytes, ``columns`` the bytes
+        and dtype of each column
+    """
+    index = int(df.index.memory_usage(deep=True))
+    columns = {str(name): {'dtype': str(values.dtype), 'bytes': int(values.memory_usage(deep=True, index=False))}
+               for name, values in df.items()}
+    return {
+        'rows': len(df),
+        'index': index,
+        'columns': columns,
+        'total': index + sum(c['bytes'] for c in columns.values()),
+    }
@@ -0,0 +1,124 @@
+import json
+import numpy as np
+import pandas as pd
+import rebase.util.api_request as api_request
+from rebase.util.parallel import imap_bounded
+from rebase.util.timestamps import to_ns
+
+single_path = 'platform/v1/model/custom/forecast/upload/{}'
+
+
+def format_times(times_ns):
+    """Format int64 ns timestamps as ``%Y%m%dT%H:%M:%SZ`` strings
+    """
+    iso = np.datetime_as_string(np.asarray(times_ns).astype('datetime64[ns]').astype('datetime64[s]'), unit='s')
+    return np.char.add(np.char.replace(iso, '-', ''), 'Z')
+
+
+def _json_list(values):
+    if values.dtype.kind == 'U':
+        return '[' + ', '.join(np.char.add(np.char.add('"', values), '"')) + ']'
+    text = values.astype(str)
+    return '[' + ', '.join(np.where(np.isnan(values), 'NaN', text)) + ']'
+
+
+def encode_forecast(ref_time, valid_time, forecast):
+    """Encode the forecast of one ref time as json
+
+    Args:
+        ref_time (str): the formatted ref time
+        valid_time (np.ndarray): the formatted valid times
+        forecast (np.ndarray): the forecast values
+
+    Returns:
+        str: the json object
+    """
+    return '{{"ref_time": {}, "valid_time": {}, "forecast": {}}}'.format(
+        json.dumps(str(ref_time)), _json_list(valid_time), _json_list(forecast))
+
+
+def iter_batches(df, max_batch_bytes=1024**2, max_ref_times=500):
+    """Split a forecast frame into batches of encoded ref times
+
+    Args:
+        df (pd.DataFrame): ``forecast`` column indexed by
+            (ref_datetime, valid_datetime)
+        max_batch_bytes (int): max size of the encoded forecasts of a batch
+        max_ref_times (int): max number of ref times in a batch
+
+    Yields:
+        list: (ref_time, encoded forecast) tuples of a batch
+    """
+    ref_ns = to_ns(pd.DatetimeIndex(df.index.get_level_values('ref_datetime')))
+    valid_ns = to_ns(pd.DatetimeIndex(df.index.get_level_values('valid_datetime')))
+    forecast = df['forecast'].to_numpy(dtype='float64')
+    order = np.lexsort((valid_ns, ref_ns))
+    ref_ns, valid_ns, forecast = ref_ns[order], valid_ns[order], forecast[order]
+    valid_time = format_times(valid_ns)
+
+    starts = np.r_[0, np.flatnonzero(np.diff(ref_ns)) + 1]
+    ends = np.r_[starts[1:], len(ref_ns)]
+    ref_times = format_times(ref_ns[starts])
+    batch = []
+    batch_bytes = 0
+    for ref_time, start, end in zip(ref_times, starts, ends):
+        encoded = encode_forecast(ref_time, valid_time[start:end], forecast[start:end])
+        if batch and (batch_bytes + len(encoded) > max_batch_bytes or len(batch) >= max_ref_times):
+            yield batch
+            batch = []
+            batch_bytes = 0
+        batch.append((str(ref_time), encoded))
+        batch_bytes += len(encoded)
+    if batch:
+        yield batch
+
+
+def upload_batch(model_id, batch, compress=None):
+    """Upload a batch of encoded forecasts of a model
+
+    The API takes one ref time per request, the forecasts of the batch are
+    posted one after the other on the session of the calling thread.
+
+    Returns:
+        int: number of requests made
+    """
+    for _, encoded in batch:
+        r = api_request.post(single_path.format(model_id), data=encoded, compress=compress)
+        if r.status_code != 200:
+            raise Exception('Failed uploading forecast: model_id: {}, status: {}'.format(model_id, r.status_code))
+    return len(batch)
+
+
+def upload(forecasts, n_jobs=4, max_batch_bytes=1024**2, max_ref_times=500, compress=None):
+    """Upload forecasts of one or more models in size-bounded batches
+
+    The ref times of each model are packed into batches which are sent by
+    ``n_jobs`` threads. Batches are encoded lazily, as workers become free.
+
+    Args:
+        forecasts (iterable): (model_id, df) tuples, see :func:`iter_batches`
+            for the format of df
+        n_jobs (int): number of batches sent in parallel
+        max_batch_bytes (int): max encoded size of a batch
+        max_ref_times (int): max number of ref times in a batch
+        compress (bool): gzip compress the batches, default
+            ``api_request.compress_requests``
+
+    Returns:
+        list: one dict per batch with ``model_id``, ``ref_times`` (first and
+        last), ``n_ref_times``, ``ok`` and ``error``
+    """
+    batches = ((model_id, batch)
+               for model_id, df in forecasts
+               for batch in iter_batches(df, max_batch_bytes, max_ref_times))
+
+    results = []
+    for (model_id, batch), _, error in imap_bounded(lambda b: upload_batch(*b, compress=compress), batches, n_jobs=n_jobs):
+        results.append({
+            'model_id': model_id,
+            'ref_times': (batch[0][0], batch[-1][0]),
+            'n_ref_times': len(batch),
+            'ok': error is None,
+            'error': error,
+        })
+    return results
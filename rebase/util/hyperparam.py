@@ -0,0 +1,199 @@
+import itertools
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import dill
+import rebase as rb
+import rebase.api.backend as backend
+import rebase.util.artifact_cache as artifact_cache
+import rebase.util.metrics as metrics
+from rebase.util.parallel import imap_bounded
+
+# Model and training set of a worker process, loaded once by _init_worker
+_worker = {}
+
+
+def param_grid(search_space):
+    """Expand a search space into a list of params
+
+    Args:
+        search_space (dict or list): dict of param name to list of values,
+            expanded to all their combinations, or a list of params dicts
+
+    Returns:
+        list: the params of every trial
+
+    Example::
+
+        >>> param_grid({'max_depth': [3, 5], 'lr': [0.1, 0.01]})
+        [{'max_depth': 3, 'lr': 0.1}, {'max_depth': 3, 'lr': 0.01}, ...]
+    """
+    if isinstance(search_space, dict):
+        names = list(search_space)
+        return [dict(zip(names, values)) for values in itertools.product(*search_space.values())]
+    return list(search_space)
+
+
+def _init_worker(model_data, train_file):
+    if model_data is not None:
+        _worker['model'] = dill.loads(model_data)
+    _worker['train_set'] = artifact_cache.load_file(train_file)
+
+
+def _run_trial(params):
+    return _train_score(_worker['model'], _worker['train_set'], params)
+
+
+def _train_score(model, train_set, params):
+    result = model.train(train_set, params=params)
+    if not isinstance(result, tuple) or len(result) != 2:
+        raise Exception('train() must return (model, score) for a hyperparam search')
+    return float(result[1])
+
+
+class _Reporter():
+    # Sends results to the backend in batches, the results of a batch are
+    # sent concurrently
+
+    def __init__(self, model_id, report_every, n_jobs=4):
+        self.model_id = model_id
+        self.report_every = report_every
+        self.n_jobs = n_jobs
+        self.pending = []
+
+    def add(self, result):
+        if self.model_id is None:
+            return
+        self.pending.append(result)
+        if len(self.pending) >= self.report_every:
+            self.flush()
+
+    def flush(self):
+        batch, self.pending = self.pending, []
+
+        def send(result):
+            backend.report_result(self.model_id, job_name=result['job_name'], params=dict(result['params']),
+                                  score=result['score'], exception=result['exception'])
+
+        for result, _, error in imap_bounded(send, batch, n_jobs=self.n_jobs):
+            metrics.inc('rebase_hyperparam_reports_total', result='failed' if error else 'ok')
+            if error is not None:
+                print('Failed reporting hyperparam result {}: {}'.format(result['job_name'], error))
+
+
+def search(model, train_set, params_list, n_jobs=4, patience=None, minimize=True,
+           model_id=None, report_every=10):
+    """Run a hyperparam search locally
+
+    Each trial calls ``model.train(train_set, params=params)``, which must
+    return ``(trained_model, score)``. Trials run in ``n_jobs`` worker
+    processes, started with the platform's default start method. Where that
+    is fork the workers inherit the model, otherwise it is pickled with dill
+    once per worker. The training set is
+    written once to a file in
+    ``rb.cache_dir`` with :func:`rebase.util.artifact_cache.dumps_zero_copy`
+    and every worker memory maps it, so its arrays are shared by the workers
+    instead of being pickled for every trial. They are read-only, ``train()``
+    must copy the data it modifies.
+
+    With ``patience`` the search stops early once that many trials in a row
+    didn't improve the best score. With ``model_id`` results are reported
+    with :func:`rebase.api.backend.report_result` in batches of
+    ``report_every`` while the search runs.
+
+    Args:
+        model (rb.Model): the model
+        train_set (object): the preprocessed training set
+        params_list (list): the params of every trial, see :func:`param_grid`
+        n_jobs (int): number of worker processes, 1 runs trials in this process
+        patience (int): stop after this many trials without improvement,
+            default run all trials
+        minimize (bool): lower scores are better
+        model_id (str): report results for this model
+        report_every (int): number of results per report batch
+
+    Returns:
+        list: a dict with ``job_name``, ``params``, ``score`` and
+        ``exception`` for every trial that ran, best first
+    """
+    params_list = list(params_list)
+    reporter = _Reporter(model_id, report_every)
+    results = []
+    state = {'best': None, 'since_best': 0}
+
+    def add(i, params, score, error):
+        result = {
+            'job_name': 'trial-{}'.format(i),
+            'params': params,
+            'score': score,
+            'exception': None if error is None else str(error),
+        }
+        results.append(result)
+        reporter.add(result)
+        metrics.inc('rebase_hyperparam_trials_total', result='failed' if error else 'ok')
+        if score is not None and (state['best'] is None or (score < state['best'] if minimize else score > state['best'])):
+            state['best'], state['since_best'] = score, 0
+        else:
+            state['since_best'] += 1
+        return patience is not None and state['since_best'] >= patience
+
+    try:
+        if n_jobs == 1:
+            for i, params in enumerate(params_list):
+                try:
+                    score, error = _train_score(model, train_set, params), None
+                except Exception as e:
+                    score, error = None, e
+                if add(i, params, score, error):
+                    break
+        else:
+            _search_processes(model, train_set, params_list, n_jobs, add)
+    finally:
+        reporter.flush()
+
+    return sorted(results, key=lambda r: (r['score'] is None, r['score'] if minimize or r['score'] is None else -r['score']))
+
+
+def _search_processes(model, train_set, params_list, n_jobs, add):
+    train_file = os.path.join(rb.ensure_cache_dir('hyperparam'), '{}.{}.train'.format(os.getpid(), id(train_set)))
+    with open(train_file, 'wb') as f:
+        f.write(artifact_cache.dumps_zero_copy(train_set))
+    try:
+        # Fork only where it is the platform default, elsewhere the model is
+        # sent to the workers with dill
+        context = multiprocessing.get_context()
+        if context.get_start_method() == 'fork':
+            model_data = None
+            _worker['model'] = model
+        else:
+            model_data = dill.dumps(model, recurse=True)
+        executor = ProcessPoolExecutor(max_workers=n_jobs, mp_context=context, initializer=_init_worker,
+                                       initargs=(model_data, train_file))
+        try:
+            trials = iter(enumerate(params_list))
+            pending = {}
+            stop = False
+            while True:
+                # Keep at most one queued trial per worker, so an early stop
+                # doesn't leave many trials to cancel
+                while not stop and len(pending) < 2 * n_jobs:
+                    trial = next(trials, None)
+                    if trial is None:
+                        break
+                    pending[executor.submit(_run_trial, trial[1])] = trial
+                if not pending:
+                    return
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    i, params = pending.pop(future)
+                    error = future.exception()
+                    stop = add(i, params, None if error else future.result(), error) or stop
+                if stop:
+                    for future in pending:
+                        future.cancel()
+                    return
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+    finally:
+        _worker.clear()
+        os.remove(train_file)
@@ -0,0 +1,224 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from rebase.util.rate_limit import endpoint_class
+
+# Set to False to skip recording, hooks are not called either
+enabled = True
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+SIZE_BUCKETS = (1e2, 1e3, 1e4, 1e5, 1e6, 1e7, 1e8, 1e9)
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_hooks = []
+
+
+class Histogram():
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the quantile
+        rank = q * self.count
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            if total >= rank:
+                return bound
+        return float('inf')
+
+
+def _key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _call_hooks(kind, name, value, labels):
+    for hook in list(_hooks):
+        try:
+            hook(kind, name, value, labels)
+        except Exception as e:
+            print(f"Exception in metrics hook {hook}: {e}")
+
+
+def inc(name, value=1, **labels):
+    """Increase a counter
+
+    Args:
+        name (str): name of the counter
+        value (float): amount to add
+        **labels: labels of the counter, e.g. ``endpoint='weather'``
+    """
+    if not enabled:
+        return
+    key = _key(labels)
+    with _lock:
+        series = _counters.setdefault(name, {})
+        series[key] = series.get(key, 0) + value
+    if _hooks:
+        _call_hooks('counter', name, value, labels)
+
+
+def observe(name, value, buckets=LATENCY_BUCKETS, **labels):
+    """Record a value in a histogram
+
+    Args:
+        name (str): name of the histogram
+        value (float): the observed value, e.g. seconds or bytes
+        buckets (tuple): bucket upper bounds, used when the histogram is created
+        **labels: labels of the histogram
+    """
+    if not enabled:
+        return
+    key = _key(labels)
+    with _lock:
+        series = _histograms.setdefault(name, {})
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = Histogram(buckets)
+        histogram.observe(value)
+    if _hooks:
+        _call_hooks('histogram', name, value, labels)
+
+
+@contextmanager
+def timer(name, **labels):
+    """Record the duration of a block in a latency histogram
+
+    Example::
+
+        >>> with metrics.timer('rebase_predict_seconds'):
+        ...     runner.predict()
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def _body_size(data):
+    if data is None:
+        return 0
+    if isinstance(data, str):
+        return len(data.encode('utf-8'))
+    try:
+        return len(data)
+    except TypeError:
+        return 0
+
+
+def record_request(method, path, status, seconds, data=None, response_bytes=None):
+    """Record an API request, called by rebase.util.api_request and rebase.aio
+    """
+    endpoint = endpoint_class(path)
+    inc('rebase_requests_total', method=method, endpoint=endpoint, status=status)
+    observe('rebase_request_seconds', seconds, method=method, endpoint=endpoint)
+    observe('rebase_request_bytes', _body_size(data), buckets=SIZE_BUCKETS, endpoint=endpoint)
+    if response_bytes is not None:
+        observe('rebase_response_bytes', response_bytes, buckets=SIZE_BUCKETS, endpoint=endpoint)
+
+
+def add_hook(hook):
+    """Add a function that is called for every recorded value
+
+    The hook is called as ``hook(kind, name, value, labels)``, where kind is
+    ``'counter'`` or ``'histogram'``, from the thread that records the value.
+
+    Example::
+
+        >>> def log_slow_requests(kind, name, value, labels):
+        ...     if name == 'rebase_request_seconds' and value > 5:
+        ...         print('slow request', labels, value)
+        >>> rb.add_hook(log_slow_requests)
+    """
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    _hooks.remove(hook)
+
+
+def reset():
+    """Clear all recorded values
+    """
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def stats():
+    """Get a snapshot of the recorded values
+
+    Returns:
+        dict: ``counters`` with the value per label set and ``histograms``
+        with count, sum, mean, p50, p95 and p99 per label set. Quantiles are
+        upper bounds of histogram buckets.
+
+    Example::
+
+        >>> rb.stats()['counters']['rebase_requests_total']
+        {(('endpoint', 'weather'), ('method', 'GET'), ('status', 200)): 12}
+    """
+    with _lock:
+        return {
+            'counters': {name: dict(series) for name, series in _counters.items()},
+            'histograms': {
+                name: {
+                    key: {
+                        'count': h.count,
+                        'sum': h.sum,
+                        'mean': h.sum / h.count if h.count else None,
+                        'p50': h.quantile(0.5),
+                        'p95': h.quantile(0.95),
+                        'p99': h.quantile(0.99),
+                    }
+                    for key, h in series.items()
+                }
+                for name, series in _histograms.items()
+            },
+        }
+
+
+def _labels_text(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in items) + '}'
+
+
+def export_text():
+    """Export the recorded values in the Prometheus text exposition format
+
+    Returns:
+        str: the metrics, e.g. to serve on a ``/metrics`` endpoint or write
+        to a node exporter textfile
+    """
+    lines = []
+    with _lock:
+        for name, series in sorted(_counters.items()):
+            lines.append('# TYPE {} counter'.format(name))
+            for key, value in series.items():
+                lines.append('{}{} {}'.format(name, _labels_text(key), value))
+        for name, series in sorted(_histograms.items()):
+            lines.append('# TYPE {} histogram'.format(name))
+            for key, h in series.items():
+                total = 0
+                for bound, count in zip(h.buckets + (float('inf'),), h.counts):
+                    total += count
+                    le = '+Inf' if bound == float('inf') else repr(float(bound))
+                    lines.append('{}_bucket{} {}'.format(name, _labels_text(key, [('le', le)]), total))
+                lines.append('{}_sum{} {}'.format(name, _labels_text(key), h.sum))
+                lines.append('{}_count{} {}'.format(name, _labels_text(key), h.count))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,386 @@
+import gzip
+import hashlib
+import json
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+import numpy as np
+import pandas as pd
+import rebase as rb
+from rebase.util.timestamps import to_ns
+from rebase.util.weather_cache import to_timestamp
+
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+
+def _dumps(data):
+    return json.dumps(data).encode('utf-8')
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+    def _handle(self, method):
+        api = self.server.api
+        url = urlsplit(self.path)
+        path = url.path.lstrip('/')
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        with api._lock:
+            api.bytes_on_wire += len(body)
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+
+        if api.latency:
+            time.sleep(api.latency)
+        status, payload, headers = api.handle(method, path, query, body, self.headers)
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        elif not isinstance(payload, bytes):
+            payload = _dumps(payload)
+
+        if api.compress_responses and len(payload) >= 1024 and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            payload = gzip.compress(payload, compresslevel=api.compress_responses)
+            headers = dict(headers, **{'Content-Encoding': 'gzip'})
+        with api._lock:
+            api.bytes_sent += len(payload)
+
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class MockAPI():
+    """Local stand-in for the platform and weather API
+
+    Serves synthetic payloads for the endpoints used by ``Site``,
+    ``Weather``, ``Layer``, ``ModelRunner`` and ``rebase.api.backend`` from
+    a threaded HTTP/1.1 server on localhost, so the SDK can be run and
+    measured offline. Used as a context manager it points
+    ``rb.base_api_url`` to the server and restores it on exit.
+
+    Payload sizes are set by the arguments: a historical weather query
+    returns one run per ``run_freq`` in its ref time range, with ``horizon``
+    hourly steps and ``n_variables`` columns, observations are returned at
+    ``observation_freq``. Values are deterministic, so overlapping queries
+    return the same data.
+
+    Args:
+        n_sites (int): number of sites returned by ``Site.list``
+        horizon (int): hours of each NWP run and forecast
+        n_variables (int): number of NWP variables
+        run_freq (str): frequency of NWP runs
+        observation_freq (str): frequency of observations and forecasts
+        latency (float): seconds added to each response
+        throttle_every (int): answer every nth request with a 429, 0 never
+        artifacts (dict): artifact bytes by (file_type, model_id), served to
+            ``ModelRunner.load_pickle`` with ``ETag`` revalidation
+        keep_uploads (bool): keep the bodies of uploaded measurements and
+            forecasts in ``uploads``
+        compress_responses (int): gzip level of responses to clients that
+            accept gzip, 0 to not compress
+
+    Attributes:
+        calls (Counter): number of requests by (method, route)
+        bytes_received (int): size of the decompressed request bodies
+        bytes_on_wire (int): size of the request bodies as sent
+        bytes_sent (int): size of the response bodies as sent
+        uploads (list): (id, body) of the received uploads
+
+    Example::
+
+        >>> from rebase.util.mock_api import MockAPI
+        >>> with MockAPI(n_sites=100, latency=0.01) as api:
+        ...     df = rb.Site.forecast_many([s['site_id'] for s in rb.Site.list()])
+        >>> api.calls[('GET', 'site/forecast/latest')]
+        100
+    """
+
+    def __init__(self, n_sites=10, horizon=48, n_variables=4, run_freq='6h', observation_freq='15min',
+                 latency=0.0, throttle_every=0, artifacts=None, keep_uploads=False,
+                 compress_responses=0):
+        self.horizon = horizon
+        self.n_variables = n_variables
+        self.run_freq = run_freq
+        self.observation_freq = observation_freq
+        self.latency = latency
+        self.throttle_every = throttle_every
+        self.artifacts = dict(artifacts or {})
+        self.keep_uploads = keep_uploads
+        self.compress_responses = compress_responses
+        self.sites = {}
+        for i in range(n_sites):
+            self.add_site()
+        self.layers = {}
+        self.models = {}
+        self.calls = Counter()
+        self.bytes_received = 0
+        self.bytes_on_wire = 0
+        self.bytes_sent = 0
+        self.uploads = []
+        self._n_requests = 0
+        self._lock = threading.Lock()
+        self._routes = [
+            ('GET', r'weather/v1/get_nwp', self._weather_historical),
+            ('GET', r'weather/v1/get_latest_nwp', self._weather_operational),
+            ('GET', r'platform/v1/sites', self._site_list),
+            ('POST', r'platform/v1/site/create', self._site_create),
+            ('GET', r'platform/v1/site/observation/([^/]+)', self._site_observation),
+            ('GET', r'platform/v1/site/forecast/latest/([^/]+)', self._site_forecast),
+            ('POST', r'platform/v1/site/measurement/upload_2/([^/]+)', self._upload),
+            ('GET', r'platform/v1/site/models/([^/]+)', self._site_models),
+            ('GET', r'platform/v1/site/train/state/([^/]+)', self._train_state),
+            ('POST', r'platform/v1/site/train/([^/]+)', self._ok),
+            ('GET', r'platform/v1/site/([^/]+)', self._site_get),
+            ('DELETE', r'platform/v1/site/([^/]+)', self._site_delete),
+            ('GET', r'platform/v1/layer/list', self._layer_list),
+            ('POST', r'platform/v1/layer/create', self._layer_create),
+            ('GET', r'platform/v1/layer/status/([^/]+)', self._layer_get),
+            ('GET', r'platform/v1/layer/([^/]+)', self._layer_get),
+            ('DELETE', r'platform/v1/layer/([^/]+)', self._layer_delete),
+            ('POST', r'platform/v1/model/custom/create/([^/]+)', self._model_create),
+            ('POST', r'platform/v1/model/custom/update/([^/]+)', self._model_update),
+            ('GET', r'platform/v1/model/custom/download/([^/]+)/([^/]+)', self._artifact),
+            ('POST', r'platform/v1/model/custom/upload/trained/([^/]+)', self._upload_trained),
+            ('POST', r'platform/v1/model/custom/forecast/upload/([^/]+)', self._upload),
+            ('POST', r'platform/v1/model/train/([^/]+)', self._ok),
+            ('POST', r'platform/v1/model/hyperparam_search/([^/]+)', self._hyperparam_search),
+            ('POST', r'platform/v1/model/hyperparam_result/([^/]+)', self._hyperparam_result),
+            ('GET', r'platform/v1/model/hyperparam_allresults/([^/]+)', self._hyperparam_results),
+            ('GET', r'platform/v1/model/([^/]+)', self._model_get),
+        ]
+        self._routes = [(m, re.compile(p + '$'), f) for m, p, f in self._routes]
+        self._server = None
+        self._base_api_url = None
+
+    def add_site(self, site_id=None, **config):
+        """Add a site, returns its id
+        """
+        site_id = site_id or str(uuid.uuid4())
+        i = len(self.sites)
+        self.sites[site_id] = dict({
+            'site_id': site_id,
+            'type': 'solar',
+            'latitude': 50 + i % 10,
+            'longitude': 5 + i // 10 % 10,
+            'capacity': [{'value': 1000.0}],
+        }, **config)
+        return site_id
+
+    def add_model(self, site_id, model_id=None, code=None, trained=None):
+        """Add a model with optional pickled code and trained artifacts, returns its id
+        """
+        model_id = model_id or str(uuid.uuid4())
+        self.models[model_id] = {'model_id': model_id, 'site_id': site_id, 'results': []}
+        if code is not None:
+            self.artifacts[('code', model_id)] = code
+        if trained is not None:
+            self.artifacts[('trained', model_id)] = trained
+        return model_id
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}/'.format(self._server.server_address[1])
+
+    def start(self):
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.api = self
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        self.start()
+        self._base_api_url = rb.base_api_url
+        rb.base_api_url = self.url
+        return self
+
+    def __exit__(self, *exc):
+        import rebase.util.api_request as api_request
+        api_request.close_session()
+        rb.base_api_url = self._base_api_url
+        self.stop()
+
+    def handle(self, method, path, query, body, headers):
+        with self._lock:
+            self._n_requests += 1
+            throttled = self.throttle_every and self._n_requests % self.throttle_every == 0
+            self.bytes_received += len(body)
+        if throttled:
+            return 429, b'', {'Retry-After': '0.05'}
+
+        for route_method, pattern, func in self._routes:
+            match = pattern.match(path)
+            if match and route_method == method:
+                route = re.sub(r'^(platform|weather)/v1/', '', pattern.pattern[:-1].split('/(')[0])
+                with self._lock:
+                    self.calls[(method, route)] += 1
+                try:
+                    result = func(query, body, headers, *match.groups())
+                except Exception as e:
+                    return 500, {'error': repr(e)}, {'Content-Type': 'application/json'}
+                if len(result) == 2:
+                    return result + ({'Content-Type': 'application/json'},)
+                return result
+        return 404, {'error': 'not found: {} {}'.format(method, path)}, {}
+
+    def _nwp_frame(self, ref_times):
+        ref_ns = np.repeat(to_ns(ref_times), self.horizon)
+        step_ns = np.tile(np.arange(self.horizon, dtype='int64') * 3600 * 10**9, len(ref_times))
+        valid_ns = ref_ns + step_ns
+        columns = {
+            'ref_datetime': pd.DatetimeIndex(ref_ns, tz='UTC').strftime(TIME_FORMAT),
+            'valid_datetime': pd.DatetimeIndex(valid_ns, tz='UTC').strftime(TIME_FORMAT),
+        }
+        hours = valid_ns / 3.6e12
+        for i in range(self.n_variables):
+            columns['var_{}'.format(i)] = np.round(np.sin(hours / (i + 2)) * 10 + ref_ns / 3.6e15 % 7, 3)
+        return pd.DataFrame(columns).to_json(orient='records')
+
+    def _weather_historical(self, query, body, headers):
+        params = json.loads(query['query_params'])
+        start = to_timestamp(params['start_date'])
+        end = to_timestamp(params['end_date'])
+        return 200, self._nwp_frame(pd.date_range(start.ceil(self.run_freq), end, freq=self.run_freq))
+
+    def _weather_operational(self, query, body, headers):
+        latest = pd.Timestamp.now(tz='UTC').floor(self.run_freq)
+        return 200, self._nwp_frame(pd.DatetimeIndex([latest]))
+
+    def _valid_times(self, start, periods):
+        return pd.date_range(start, periods=periods, freq=self.observation_freq)
+
+    def _site_list(self, query, body, headers):
+        return 200, list(self.sites.values())
+
+    def _site_create(self, query, body, headers):
+        return 200, _dumps(self.add_site(**json.loads(body or b'{}')))
+
+    def _site_get(self, query, body, headers, site_id):
+        if site_id not in self.sites:
+            return 404, {'error': 'site not found'}
+        return 200, self.sites[site_id]
+
+    def _site_delete(self, query, body, headers, site_id):
+        if self.sites.pop(site_id, None) is None:
+            return 404, {'error': 'site not found'}
+        return 200, {}
+
+    def _site_observation(self, query, body, headers, site_id):
+        start = to_timestamp(query['start_date']).ceil(self.observation_freq)
+        end = to_timestamp(query['end_date']) if query.get('end_date') else pd.Timestamp.now(tz='UTC')
+        valid_time = pd.date_range(start, end, freq=self.observation_freq)
+        hours = to_ns(valid_time) / 3.6e12
+        return 200, {
+            'valid_time': list(valid_time.strftime(TIME_FORMAT)),
+            'power_kw': np.round(np.clip(np.sin(hours * np.pi / 12), 0, None) * 800, 1).tolist(),
+        }
+
+    def _site_forecast(self, query, body, headers, site_id):
+        ref_time = pd.Timestamp.now(tz='UTC').floor('1h')
+        n = int(self.horizon * pd.Timedelta('1h') / pd.Timedelta(self.observation_freq))
+        valid_time = self._valid_times(ref_time, n)
+        hours = to_ns(valid_time) / 3.6e12
+        return 200, {
+            'type': query.get('type', 'prioritized'),
+            'ref_time': ref_time.strftime(TIME_FORMAT),
+            'valid_time': list(valid_time.strftime(TIME_FORMAT)),
+            'forecast': np.round(np.clip(np.sin(hours * np.pi / 12), 0, None) * 800, 1).tolist(),
+        }
+
+    def _site_models(self, query, body, headers, site_id):
+        return 200, [m for m in self.models.values() if m['site_id'] == site_id]
+
+    def _train_state(self, query, body, headers, site_id):
+        return 200, [{'state': 'complete', 'timestamp_utc': '2020-10-12 13:05:23'}]
+
+    def _upload(self, query, body, headers, id):
+        if self.keep_uploads:
+            with self._lock:
+                self.uploads.append((id, body))
+        return 200, {}
+
+    def _ok(self, query, body, headers, id):
+        return 200, 'ok'
+
+    def _layer_list(self, query, body, headers):
+        return 200, list(self.layers.values())
+
+    def _layer_create(self, query, body, headers):
+        layer_id = str(uuid.uuid4())
+        self.layers[layer_id] = {'id': layer_id, 'packages': json.loads(body)['packages'], 'status': 'ready'}
+        return 200, self.layers[layer_id]
+
+    def _layer_get(self, query, body, headers, layer_id):
+        if layer_id not in self.layers:
+            return 404, {'error': 'layer not found'}
+        return 200, self.layers[layer_id]
+
+    def _layer_delete(self, query, body, headers, layer_id):
+        if self.layers.pop(layer_id, None) is None:
+            return 404, {'error': 'layer not found'}
+        return 200, 'deleted'
+
+    def _model_get(self, query, body, headers, model_id):
+        if model_id not in self.models:
+            return 404, {'error': 'model not found'}
+        return 200, self.models[model_id]
+
+    def _model_create(self, query, body, headers, site_id):
+        return 200, _dumps(self.add_model(site_id, code=body))
+
+    def _model_update(self, query, body, headers, model_id):
+        if model_id not in self.models:
+            return 404, {'error': 'model not found'}
+        self.artifacts[('code', model_id)] = body
+        return 200, {}
+
+    def _artifact(self, query, body, headers, file_type, model_id):
+        content = self.artifacts.get((file_type, model_id))
+        if content is None:
+            return 404, b'', {}
+        etag = '"{}"'.format(hashlib.sha256(content).hexdigest())
+        if headers.get('If-None-Match') == etag:
+            return 304, b'', {'ETag': etag}
+        return 200, content, {'ETag': etag, 'Content-Type': 'application/octet-stream'}
+
+    def _upload_trained(self, query, body, headers, model_id):
+        self.artifacts[('trained', model_id)] = body
+        return 200, {}
+
+    def _hyperparam_search(self, query, body, headers, model_id):
+        return 200, {'task_key': str(uuid.uuid4())}
+
+    def _hyperparam_result(self, query, body, headers, model_id):
+        self.models.setdefault(model_id, {'model_id': model_id, 'site_id': None, 'results': []})
+        self.models[model_id]['results'].append(json.loads(body))
+        return 200, {}
+
+    def _hyperparam_results(self, query, body, headers, model_id):
+        return 200, self.models.get(model_id, {}).get('results', [])
@@ -0,0 +1,138 @@
+import json
+import os
+import threading
+import numpy as np
+import pandas as pd
+import rebase as rb
+from rebase.util.timestamps import to_ns, from_ns
+
+DTYPE = np.dtype([('valid_time', 'int64'), ('observation', 'float64')])
+
+_lock = threading.Lock()
+
+
+class ObservationStore():
+    """Local store of the observations of a site
+
+    Observations are kept sorted by valid time in a numpy file of
+    (valid_time, observation) records, so range queries are a binary search
+    on the memory mapped file::
+
+        <cache_dir>/observations/<site_id>/observations.npy
+        <cache_dir>/observations/<site_id>/meta.json
+
+    Files are replaced atomically, a reader never sees a half written store,
+    and the store is locked across processes while it is updated. A corrupt
+    store is removed, so the observations are synced again.
+
+    Example::
+
+        >>> store = ObservationStore(site_id)
+        >>> store.replace(valid_ns, values, start_ns, end_ns)
+        >>> df = store.load('2021-01-01', '2021-02-01')
+    """
+
+    def __init__(self, site_id, cache_dir=None):
+        self.site_id = site_id
+        self.path = os.path.join(cache_dir or rb.cache_dir, 'observations', str(site_id))
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _read(self, mmap_mode=None):
+        try:
+            records = np.load(self._file('observations.npy'), mmap_mode=mmap_mode)
+            if records.dtype != DTYPE:
+                raise ValueError('dtype {} instead of {}'.format(records.dtype, DTYPE))
+        except FileNotFoundError:
+            records = np.empty(0, dtype=DTYPE)
+        except (OSError, ValueError) as e:
+            # The meta is removed too, so the next sync starts from scratch
+            rb.cache.remove_corrupt(self.path, e, 'observations')
+            records = np.empty(0, dtype=DTYPE)
+        return records['valid_time'], records['observation']
+
+    def _write(self, name, write):
+        with rb.cache.atomic_write(self._file(name)) as f:
+            write(f)
+
+    def meta(self):
+        """Get the metadata of the store: ``high_water`` and ``synced_at``
+        """
+        try:
+            with open(self._file('meta.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'high_water': None, 'synced_at': None}
+
+    def high_water(self):
+        """Get the latest stored valid time
+
+        Returns:
+            pd.Timestamp: the high-water mark, None if the store is empty
+        """
+        high_water = self.meta()['high_water']
+        return None if high_water is None else pd.Timestamp(high_water)
+
+    def replace(self, valid_ns, values, start_ns, end_ns):
+        """Replace the stored observations of a valid time range
+
+        Stored observations in ``[start_ns, end_ns]`` are dropped, so values
+        revised or removed upstream are updated, and the new ones are merged in.
+
+        Args:
+            valid_ns (np.ndarray): valid times as int64 ns since epoch, UTC
+            values (np.ndarray): the observations
+            start_ns (int): start of the fetched range
+            end_ns (int): end of the fetched range
+        """
+        valid_ns = np.asarray(valid_ns, dtype='int64')
+        values = np.asarray(values, dtype='float64')
+        with _lock, rb.cache.lock(self.path):
+            old_ns, old_values = self._read()
+            left = np.searchsorted(old_ns, start_ns, side='left')
+            right = np.searchsorted(old_ns, end_ns, side='right')
+            valid_ns = np.concatenate([old_ns[:left], valid_ns, old_ns[right:]])
+            values = np.concatenate([old_values[:left], values, old_values[right:]])
+            # Sort and drop duplicated valid times, keeping the last
+            order = np.argsort(valid_ns, kind='stable')
+            valid_ns, values = valid_ns[order], values[order]
+            keep = np.r_[valid_ns[1:] != valid_ns[:-1], True] if len(valid_ns) else np.empty(0, dtype=bool)
+            valid_ns, values = valid_ns[keep], values[keep]
+
+            records = np.empty(len(valid_ns), dtype=DTYPE)
+            records['valid_time'] = valid_ns
+            records['observation'] = values
+            meta = {
+                'high_water': str(pd.Timestamp(int(valid_ns[-1]), tz='UTC')) if len(valid_ns) else None,
+                'synced_at': str(pd.Timestamp.now(tz='UTC')),
+            }
+            os.makedirs(self.path, exist_ok=True)
+            self._write('observations.npy', lambda f: np.save(f, records))
+            self._write('meta.json', lambda f: f.write(json.dumps(meta).encode('utf-8')))
+        rb.cache.maybe_prune()
+
+    def load(self, start_date=None, end_date=None):
+        """Load the stored observations of a valid time range
+
+        Args:
+            start_date (datetime): start of the range, default all
+            end_date (datetime): end of the range, included, default all
+
+        Returns:
+            pd.DataFrame: ``observation`` column indexed by ``valid_time``, UTC
+        """
+        valid_ns, values = self._read(mmap_mode='r')
+        rb.cache.touch(self.path)
+        left = 0 if start_date is None else np.searchsorted(valid_ns, _to_ns(start_date), side='left')
+        right = len(valid_ns) if end_date is None else np.searchsorted(valid_ns, _to_ns(end_date), side='right')
+        df = pd.DataFrame(
+            {'observation': np.array(values[left:right])},
+            index=from_ns(np.array(valid_ns[left:right]), 'UTC'),
+        )
+        df.index.name = 'valid_time'
+        return df
+
+
+def _to_ns(value):
+    return int(to_ns(pd.DatetimeIndex([pd.Timestamp(value)]))[0])
@@ -0,0 +1,128 @@
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+import rebase.util.metrics as metrics
+
+
+def imap_bounded(func, items, n_jobs=4, max_pending=None):
+    """Apply func to items in a thread pool with bounded parallelism
+
+    At most ``max_pending`` items are submitted at a time, so items from a
+    generator are only produced as workers free up. Results are yielded as
+    they complete, and exceptions are returned instead of raised so that
+    one failing item doesn't stop the others.
+
+    Args:
+        func (function): function called with each item
+        items (iterable): the items
+        n_jobs (int): number of worker threads
+        max_pending (int): max number of submitted items, default 2*n_jobs
+
+    Yields:
+        tuple: (item, result, exception), one of result and exception is None
+    """
+    max_pending = max_pending or 2 * n_jobs
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        pending = {}
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < max_pending:
+                try:
+                    item = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending[executor.submit(func, item)] = item
+            if not pending:
+                return
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = pending.pop(future)
+                error = future.exception()
+                yield item, None if error else future.result(), error
+
+
+class SingleFlight():
+    """Share one call between concurrent callers with the same key
+
+    The first caller of a key runs the call, callers of the same key that
+    arrive while it runs wait for it and get its result or exception
+    instead of making the call again. Calls saved this way are counted in
+    ``rebase_coalesced_calls_total{call=<name>}``.
+
+    When the result was shared, every caller gets ``copy(result)`` so
+    callers can modify what they get, e.g. a DataFrame.
+
+    Args:
+        name (str): name of the call in the metrics
+
+    Example::
+
+        >>> flight = SingleFlight('site_get')
+        >>> config = flight.do(site_id, fetch, site_id, copy=copy.deepcopy)
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def _join(self, key, new_future):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = [new_future(), 0]
+                return call, True
+            call[1] += 1
+        metrics.inc('rebase_coalesced_calls_total', call=self.name)
+        return call, False
+
+    def _leave(self, key):
+        # Shared if other callers joined, later callers start a new call
+        with self._lock:
+            return self._calls.pop(key)[1] > 0
+
+    def do(self, key, func, *args, copy=None, **kwargs):
+        """Call ``func(*args, **kwargs)``, or wait for the running call of ``key``
+        """
+        call, leader = self._join(key, Future)
+        future = call[0]
+        if not leader:
+            result = future.result()
+            return copy(result) if copy else result
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            self._leave(key)
+            future.set_exception(e)
+            raise
+        shared = self._leave(key)
+        future.set_result(result)
+        return copy(result) if copy and shared else result
+
+    async def do_async(self, key, func, *args, copy=None, **kwargs):
+        """Await ``func(*args, **kwargs)``, or the running call of ``key`` in this event loop
+        """
+        loop = asyncio.get_running_loop()
+        key = (id(loop), key)
+        call, leader = self._join(key, loop.create_future)
+        future = call[0]
+        if not leader:
+            result = await asyncio.shield(future)
+            return copy(result) if copy else result
+        try:
+            result = await func(*args, **kwargs)
+        except asyncio.CancelledError:
+            self._leave(key)
+            future.cancel()
+            raise
+        except BaseException as e:
+            self._leave(key)
+            future.set_exception(e)
+            # Retrieved, so asyncio doesn't log it when nobody else waits
+            future.exception()
+            raise
+        shared = self._leave(key)
+        future.set_result(result)
+        return copy(result) if copy and shared else result
@@ -0,0 +1,182 @@
+import collections
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+# Set to False to send requests without client side rate limiting
+enabled = True
+
+# Budgets per endpoint class: requests/s at start, None to send requests
+# unthrottled until the API answers 429, max burst, the range the rate
+# adapts within, None for no max, and the requests/s it is raised by every
+# second while requests succeed. The rate is halved when the API answers 429.
+budgets = {
+    'weather': {'rate': None, 'burst': 20, 'min_rate': 0.5, 'max_rate': None, 'increase': 10.0},
+    'upload': {'rate': None, 'burst': 10, 'min_rate': 0.5, 'max_rate': None, 'increase': 5.0},
+    'default': {'rate': None, 'burst': 40, 'min_rate': 0.5, 'max_rate': None, 'increase': 20.0},
+}
+
+# Max seconds to pause when the API throttles without a Retry-After header
+max_backoff = 60
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def endpoint_class(path):
+    """Get the budget class of an API path
+    """
+    if 'weather/' in path:
+        return 'weather'
+    if '/upload' in path:
+        return 'upload'
+    return 'default'
+
+
+class TokenBucket():
+    """Token bucket shared by all threads making requests to an endpoint class
+
+    Without a ``rate`` requests are not throttled until the API answers
+    429. Then and after every 429 the whole bucket pauses for the
+    ``Retry-After`` time, or a growing backoff, and the rate is set to half
+    the rate requests were sent at. This happens once per throttle episode:
+    429s of requests that were sent before the rate was lowered don't lower
+    it again. Every request then reserves a token and sleeps until it is
+    due, so threads are spread out at the current rate instead of bursting
+    into 429s. While requests succeed the rate grows by ``increase``
+    requests/s every second, so the rate settles close to what the API
+    allows.
+    """
+
+    def __init__(self, rate, burst, min_rate, max_rate, increase):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.n_throttled = 0
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._decreased = None
+        # Send times of the last requests, to measure the rate they're sent at
+        self._sent = collections.deque(maxlen=max(int(burst), 2))
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Reserve a token for one request
+
+        Returns:
+            float: seconds to wait before sending the request
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self.rate is None:
+                self._sent.append(now)
+                return 0
+            if now > self._updated:
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+            self._tokens -= 1
+            delay = max(self._updated - now, 0) + max(-self._tokens, 0) / self.rate
+            self._sent.append(now + delay)
+            return delay
+
+    def _sent_rate(self):
+        if len(self._sent) < 2 or self._sent[-1] <= self._sent[0]:
+            return None
+        return (len(self._sent) - 1) / (self._sent[-1] - self._sent[0])
+
+    def paused(self):
+        """Check if the bucket is paused after a 429
+        """
+        with self._lock:
+            return self._updated > time.monotonic()
+
+    def throttled(self, retry_after=None, sent=None):
+        """Register a 429 response
+
+        Args:
+            retry_after (float): seconds from the Retry-After header, if any
+            sent (float): ``time.monotonic()`` when the request was sent
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now < self._updated:
+                # Already paused by a concurrent request
+                return
+            if sent is not None and self._decreased is not None and sent < self._decreased:
+                # In flight when the rate was lowered, same throttle episode
+                return
+            self.n_throttled += 1
+            if retry_after is None:
+                retry_after = min(2**(self.n_throttled - 1) * (1+random.random()), max_backoff)
+            rates = [r for r in (self.rate, self._sent_rate()) if r is not None]
+            self.rate = max(self.min_rate, min(rates) / 2) if rates else self.min_rate
+            self._tokens = 0
+            self._updated = now + retry_after
+            self._decreased = now
+
+    def succeeded(self):
+        """Register a successful response
+        """
+        with self._lock:
+            self.n_throttled = 0
+            if self.rate is None:
+                return
+            # About rate successes per second, each adds increase / rate
+            self.rate += self.increase / self.rate
+            if self.max_rate is not None:
+                self.rate = min(self.max_rate, self.rate)
+
+
+def limiter(path):
+    """Get the shared token bucket for an API path
+    """
+    name = endpoint_class(path)
+    bucket = _limiters.get(name)
+    if bucket is None:
+        with _limiters_lock:
+            bucket = _limiters.get(name)
+            if bucket is None:
+                bucket = TokenBucket(**budgets[name])
+                _limiters[name] = bucket
+    return bucket
+
+
+def configure(name, **budget):
+    """Change the budget of an endpoint class
+
+    Args:
+        name (str): ``'weather'``, ``'upload'`` or ``'default'``
+        **budget: any of ``rate``, ``burst``, ``min_rate``, ``max_rate``
+            and ``increase``
+
+    Example::
+
+        >>> from rebase.util import rate_limit
+        >>> rate_limit.configure('weather', rate=5, max_rate=20)
+    """
+    with _limiters_lock:
+        budgets[name] = dict(budgets[name], **budget)
+        _limiters.pop(name, None)
+
+
+def retry_after(response):
+    """Get the seconds to wait from the Retry-After header of a response
+    """
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return max((date - datetime.now(timezone.utc)).total_seconds(), 0)
@@ -0,0 +1,117 @@
+import copy
+import json
+import os
+import threading
+import time
+import rebase as rb
+import rebase.util.metrics as metrics
+
+# Seconds a site config is used before it is fetched again, None disables
+# the cache
+ttl = 300
+
+# Also keep site configs in rb.cache_dir, so they are shared by processes
+# and survive restarts
+persist = False
+
+_lock = threading.Lock()
+_configs = {}
+
+
+def _site_file(site_id):
+    return os.path.join(rb.cache_dir, 'sites', '{}.json'.format(site_id))
+
+
+def _read_file(site_id):
+    try:
+        with open(_site_file(site_id)) as f:
+            entry = json.load(f)
+        rb.cache.touch(_site_file(site_id))
+        return entry['fetched'], entry['config']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _write_file(site_id, fetched, config):
+    rb.ensure_cache_dir('sites')
+    with rb.cache.atomic_write(_site_file(site_id), 'w') as f:
+        json.dump({'fetched': fetched, 'config': config}, f)
+
+
+def get(site_id, max_age=None):
+    """Get a cached site config
+
+    Args:
+        site_id (str): id of the site
+        max_age (float): max age in seconds of the cached config, default
+            :data:`ttl`
+
+    Returns:
+        dict: a copy of the config, None if it is not cached or too old
+    """
+    max_age = ttl if max_age is None else max_age
+    if max_age is None:
+        return None
+    with _lock:
+        entry = _configs.get(site_id)
+    if entry is None and persist:
+        entry = _read_file(site_id)
+        if entry is not None:
+            with _lock:
+                _configs[site_id] = entry
+    if entry is None or time.time() - entry[0] > max_age:
+        metrics.inc('rebase_site_cache_total', result='miss')
+        return None
+    metrics.inc('rebase_site_cache_total', result='hit')
+    return copy.deepcopy(entry[1])
+
+
+def put(site_id, config):
+    """Cache a site config
+
+    Args:
+        site_id (str): id of the site
+        config (dict): the config of the site
+    """
+    if ttl is None:
+        return
+    fetched = time.time()
+    config = copy.deepcopy(config)
+    with _lock:
+        _configs[site_id] = (fetched, config)
+    if persist:
+        try:
+            _write_file(site_id, fetched, config)
+        except OSError as e:
+            print('Failed caching site config {}: {}'.format(site_id, e))
+
+
+def warm(configs):
+    """Cache many site configs, e.g. the result of ``rb.Site.list()``
+
+    Args:
+        configs (list): site configs with a ``site_id``
+    """
+    for config in configs:
+        if isinstance(config, dict) and 'site_id' in config:
+            put(config['site_id'], config)
+
+
+def invalidate(site_id=None):
+    """Remove a site config from the cache
+
+    Args:
+        site_id (str): id of the site, default all sites
+    """
+    with _lock:
+        site_ids = list(_configs) if site_id is None else [site_id]
+        for s in site_ids:
+            _configs.pop(s, None)
+    if site_id is None:
+        site_dir = os.path.join(rb.cache_dir, 'sites')
+        site_ids = [f[:-len('.json')] for f in os.listdir(site_dir) if f.endswith('.json')] if os.path.isdir(site_dir) else []
+    for s in site_ids:
+        try:
+            os.remove(_site_file(s))
+        except OSError:
+            pass
@@ -0,0 +1,19 @@
+import numpy as np
+import pandas as pd
+
+
+def to_ns(index):
+    """Get the timestamps of a DatetimeIndex as int64 ns since epoch, UTC
+    """
+    if index.tz is not None:
+        index = index.tz_convert('UTC').tz_localize(None)
+    return np.asarray(index, dtype='datetime64[ns]').view('int64')
+
+
+def from_ns(values, tz=None):
+    """Build a DatetimeIndex from int64 ns since epoch, UTC
+    """
+    index = pd.to_datetime(values)
+    if tz is not None:
+        index = index.tz_localize('UTC').tz_convert(tz)
+    return index
@@ -0,0 +1,481 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import numpy as np
+import pandas as pd
+import rebase as rb
+import rebase.util.weather_store as weather_store
+from rebase.util.timestamps import to_ns, from_ns
+
+# Keys of the weather query params holding the requested ref time range
+START_KEY = 'start_date'
+END_KEY = 'end_date'
+
+INDEX_NAMES = ['ref_datetime', 'valid_datetime']
+
+# Runs with a ref time this close to now may not be published yet, a range
+# is only marked as cached up to its last received run until then
+publish_lag = pd.Timedelta('12h')
+
+# Max number of memory mapped snapshots kept per query, each is a copy of
+# its range, the least recently used are removed first
+max_snapshots = 4
+
+_lock = threading.Lock()
+
+
+def to_timestamp(value):
+    ts = pd.Timestamp(value)
+    if ts.tzinfo is None:
+        return ts.tz_localize('UTC')
+    return ts.tz_convert('UTC')
+
+
+def format_timestamp(ts):
+    return ts.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class WeatherCache():
+    """Range-aware columnar cache for NWP data
+
+    Data is stored per query, i.e. per model and all params except the ref
+    time range, and partitioned by month of ref time. Each partition holds
+    the index and values as numpy arrays::
+
+        <cache_dir>/nwp/<model>/<params hash>/manifest.json
+        <cache_dir>/nwp/<model>/<params hash>/2021-03/index.npy
+        <cache_dir>/nwp/<model>/<params hash>/2021-03/values.npy
+        <cache_dir>/nwp/<model>/<params hash>/2021-03/columns.json
+
+    The manifest keeps the ref time intervals that have been fetched, so a
+    query only needs to fetch the parts of its range that are not covered.
+
+    Ranges loaded with ``mmap=True`` are also written as a
+    :mod:`rebase.util.weather_store` snapshot, which processes memory map
+    instead of reading the partitions into private memory::
+
+        <cache_dir>/nwp/<model>/<params hash>/snapshots/<generation>-<start>-<end>-<dtype>/
+
+    Storing data increases the generation of the cache and removes the
+    snapshots, so they are never older than the partitions. At most
+    :data:`max_snapshots` snapshots are kept, e.g. for the windows of a
+    sliding backtest.
+
+    Files are written atomically and the cache is locked across processes
+    while data is stored, see :mod:`rebase.cache`. A corrupt partition is
+    removed and its month is fetched again.
+
+    Values are stored as float64 and the dtype of each column is kept in the
+    manifest, so integer and bool columns are loaded with their own dtype.
+    Frames with non numeric columns can't be stored, see :meth:`supports`.
+
+    Example::
+
+        >>> cache = WeatherCache.for_params(params)
+        >>> for start, end in cache.missing():
+        ...     cache.store(fetch(cache.range_params(start, end)), start, end)
+        >>> df = cache.load()
+    """
+
+    def __init__(self, params, cache_dir=None):
+        self.params = params
+        self.start = to_timestamp(params[START_KEY])
+        self.end = to_timestamp(params[END_KEY])
+        key_params = {k: v for k, v in params.items() if k not in (START_KEY, END_KEY)}
+        key = hashlib.md5(json.dumps(key_params, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+        model = re.sub(r'[^\w.-]', '_', str(params.get('model', 'default')))
+        self.path = os.path.join(cache_dir or rb.cache_dir, 'nwp', model, key)
+
+    @classmethod
+    def for_params(cls, params):
+        """Get the cache for a weather query
+
+        Args:
+            params (dict): the weather query params
+
+        Returns:
+            WeatherCache: the cache, or None if the query has no ref time range
+        """
+        if params.get(START_KEY) is None or params.get(END_KEY) is None:
+            return None
+        return cls(params)
+
+    def _manifest_file(self):
+        return os.path.join(self.path, 'manifest.json')
+
+    def _read_manifest(self):
+        try:
+            with open(self._manifest_file()) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'intervals': [], 'tz': 'UTC', 'generation': 0}
+
+    def _write_manifest(self, manifest):
+        os.makedirs(self.path, exist_ok=True)
+        with rb.cache.atomic_write(self._manifest_file(), 'w') as f:
+            json.dump(manifest, f)
+
+    def missing(self, start=None, end=None):
+        """Get the ref time intervals of a range that are not cached
+
+        Args:
+            start (pd.Timestamp): start of range, default the query start
+            end (pd.Timestamp): end of range, default the query end
+
+        Returns:
+            list: (start, end) tuples of the intervals to fetch
+        """
+        start = self.start if start is None else start
+        end = self.end if end is None else end
+        self._check_partitions(start, end)
+        intervals = [(to_timestamp(s), to_timestamp(e))
+                     for s, e in self._read_manifest()['intervals']]
+        if start == end:
+            return [] if any(s <= start <= e for s, e in intervals) else [(start, end)]
+
+        gaps = []
+        cursor = start
+        for s, e in intervals:
+            if e < cursor:
+                continue
+            if s > end:
+                break
+            if s > cursor:
+                gaps.append((cursor, s))
+            cursor = max(cursor, e)
+        if cursor < end:
+            gaps.append((cursor, end))
+        return gaps
+
+    def range_params(self, start, end):
+        """Get the query params for a sub range of the query
+        """
+        if start == self.start and end == self.end:
+            return self.params
+        params = dict(self.params)
+        params[START_KEY] = format_timestamp(start)
+        params[END_KEY] = format_timestamp(end)
+        return params
+
+    def _partition_path(self, month):
+        return os.path.join(self.path, month)
+
+    @staticmethod
+    def _months(start, end):
+        return pd.period_range(start.tz_localize(None), end.tz_localize(None), freq='M').strftime('%Y-%m')
+
+    def _read_partition(self, month, mmap_mode=None):
+        # None if the partition doesn't exist, raises if it is corrupt
+        path = self._partition_path(month)
+        try:
+            index = np.load(os.path.join(path, 'index.npy'), mmap_mode=mmap_mode)
+            values = np.load(os.path.join(path, 'values.npy'), mmap_mode=mmap_mode)
+            with open(os.path.join(path, 'columns.json')) as f:
+                columns = json.load(f)
+        except FileNotFoundError:
+            if os.path.isdir(path):
+                raise
+            return None
+        if index.ndim != 2 or index.shape[0] != 2 or values.shape != (len(columns), index.shape[1]):
+            raise ValueError('partition shapes {} and {} do not match'.format(index.shape, values.shape))
+        return index, values, columns
+
+    def _write_partition(self, month, index, values, columns):
+        path = self._partition_path(month)
+        os.makedirs(path, exist_ok=True)
+        with rb.cache.atomic_write(os.path.join(path, 'index.npy')) as f:
+            np.save(f, index)
+        with rb.cache.atomic_write(os.path.join(path, 'values.npy')) as f:
+            np.save(f, values)
+        with rb.cache.atomic_write(os.path.join(path, 'columns.json'), 'w') as f:
+            json.dump(columns, f)
+
+    @staticmethod
+    def _month_range(month):
+        start = pd.Timestamp(month + '-01', tz='UTC')
+        return start, start + pd.offsets.MonthBegin(1)
+
+    def _corrupt_partitions(self, months):
+        corrupt = []
+        for month in months:
+            try:
+                self._read_partition(month, mmap_mode='r')
+            except (OSError, ValueError) as e:
+                corrupt.append((month, e))
+        return corrupt
+
+    def _check_partitions(self, start, end):
+        corrupt = self._corrupt_partitions(self._months(start, end))
+        if not corrupt:
+            return
+        with _lock, rb.cache.lock(self.path):
+            # Checked again while locked, the partition may have been
+            # written by another process meanwhile
+            corrupt = self._corrupt_partitions([month for month, _ in corrupt])
+            if not corrupt:
+                return
+            manifest = self._read_manifest()
+            for month, error in corrupt:
+                rb.cache.remove_corrupt(self._partition_path(month), error, 'nwp')
+                manifest['intervals'] = self._drop_interval(manifest['intervals'], *self._month_range(month))
+            manifest['generation'] = manifest.get('generation', 0) + 1
+            self._write_manifest(manifest)
+            shutil.rmtree(self._snapshot_path(), ignore_errors=True)
+
+    @staticmethod
+    def supports(df):
+        """Whether a frame can be stored, i.e. all its columns are numeric or bool
+        """
+        return all(dtype.kind in 'iufb' for dtype in df.dtypes)
+
+    def columnar(self):
+        """Whether the query is cached here, False once it returned data
+        with non numeric columns, which are cached as a pickle instead
+        """
+        return self._read_manifest().get('columnar', True)
+
+    def store(self, df, start, end):
+        """Store fetched data and mark its ref time range as cached
+
+        The range is marked up to its end if that is more than
+        :data:`publish_lag` ago, else only up to the last ref time in
+        ``df``, so runs published later are fetched. Nothing is marked for
+        an empty frame.
+
+        Args:
+            df (pd.DataFrame): (ref_datetime, valid_datetime) indexed data
+            start (pd.Timestamp): start of the fetched range
+            end (pd.Timestamp): end of the fetched range
+
+        Returns:
+            bool: False if the frame has non numeric columns and wasn't
+            stored, the query is then marked as not :meth:`columnar`
+        """
+        supported = self.supports(df)
+        with _lock, rb.cache.lock(self.path):
+            manifest = self._read_manifest()
+            if not supported:
+                manifest['columnar'] = False
+            elif len(df) > 0:
+                ref = df.index.get_level_values(0)
+                manifest['tz'] = None if ref.tz is None else str(ref.tz)
+                dtypes = manifest.setdefault('dtypes', {})
+                for name, dtype in df.dtypes.items():
+                    old = dtypes.get(str(name))
+                    dtypes[str(name)] = str(dtype if old is None else np.result_type(old, dtype))
+                index = np.vstack([to_ns(ref), to_ns(df.index.get_level_values(1))])
+                values = df.to_numpy(dtype='float64').T
+                columns = [str(c) for c in df.columns]
+                months = pd.to_datetime(index[0]).strftime('%Y-%m').values
+                for month in np.unique(months):
+                    mask = months == month
+                    if not self._merge_partition(month, index[:, mask], values[:, mask], columns):
+                        # The rest of the month was lost, fetch it again
+                        manifest['intervals'] = self._drop_interval(manifest['intervals'], *self._month_range(month))
+
+            if supported and len(df) > 0:
+                last = df.index.get_level_values(0).max()
+                last = to_timestamp(last) if not pd.isna(last) else start
+                covered = min(end, max(last, pd.Timestamp.now(tz='UTC') - publish_lag))
+                if covered > start:
+                    intervals = manifest['intervals'] + [[format_timestamp(start), format_timestamp(covered)]]
+                    manifest['intervals'] = self._merge_intervals(intervals)
+            manifest['generation'] = manifest.get('generation', 0) + 1
+            self._write_manifest(manifest)
+            # Processes that mapped a snapshot keep their data, the files are
+            # only freed once they are unmapped
+            shutil.rmtree(self._snapshot_path(), ignore_errors=True)
+        rb.cache.touch(self.path)
+        rb.cache.maybe_prune()
+        return supported
+
+    def _merge_partition(self, month, index, values, columns):
+        # False if the existing partition was corrupt and is replaced
+        try:
+            existing = self._read_partition(month)
+            intact = True
+        except (OSError, ValueError) as e:
+            rb.cache.remove_corrupt(self._partition_path(month), e, 'nwp')
+            existing, intact = None, False
+        if existing is not None:
+            old_index, old_values, old_columns = existing
+            all_columns = old_columns + [c for c in columns if c not in old_columns]
+            index = np.hstack([old_index, index])
+            values = np.hstack([_align(old_values, old_columns, all_columns),
+                                _align(values, columns, all_columns)])
+            columns = all_columns
+
+        # Sort by (ref, valid) and keep the most recently stored duplicate
+        _, first = np.unique(index[:, ::-1].T, axis=0, return_index=True)
+        keep = index.shape[1] - 1 - first
+        self._write_partition(month, index[:, keep], values[:, keep], columns)
+        return intact
+
+    @staticmethod
+    def _merge_intervals(intervals):
+        merged = []
+        for s, e in sorted(intervals, key=lambda i: to_timestamp(i[0])):
+            if merged and to_timestamp(s) <= to_timestamp(merged[-1][1]):
+                if to_timestamp(e) > to_timestamp(merged[-1][1]):
+                    merged[-1][1] = e
+            else:
+                merged.append([s, e])
+        return merged
+
+    @staticmethod
+    def _drop_interval(intervals, start, end):
+        # Remove [start, end) from the intervals, the boundaries are kept so
+        # the dropped range is fetched including them
+        kept = []
+        for s, e in intervals:
+            if to_timestamp(e) < start or to_timestamp(s) >= end:
+                kept.append([s, e])
+                continue
+            if to_timestamp(s) < start:
+                kept.append([s, format_timestamp(start)])
+            if to_timestamp(e) > end:
+                kept.append([format_timestamp(end), e])
+        return kept
+
+    def _snapshot_path(self, *parts):
+        return os.path.join(self.path, 'snapshots', *parts)
+
+    def load(self, start=None, end=None, dtype=None, mmap=False):
+        """Load cached data for a ref time range
+
+        Raises an exception if a partition of the range is corrupt. The
+        partition is removed and its month marked as missing, so it is
+        fetched again.
+
+        Args:
+            start (pd.Timestamp): start of range, default the query start
+            end (pd.Timestamp): end of range, default the query end
+            dtype (str): dtype of the columns, default float64
+            mmap (bool): memory map a read-only snapshot of the range, shared
+                by all processes loading it, see :func:`rebase.util.weather_store.read`
+
+        Returns:
+            pd.DataFrame: (ref_datetime, valid_datetime) indexed data
+        """
+        start = self.start if start is None else start
+        end = self.end if end is None else end
+        if mmap:
+            return self._load_snapshot(start, end, dtype)
+        manifest = self._read_manifest()
+        tz = manifest.get('tz')
+        start_ns, end_ns = start.value, end.value
+
+        # Shared lock, so the cache isn't evicted while it is read
+        parts = []
+        corrupt = False
+        with rb.cache.lock(self.path, shared=True):
+            for month in self._months(start, end):
+                try:
+                    partition = self._read_partition(month)
+                except (OSError, ValueError):
+                    corrupt = True
+                    continue
+                if partition is not None:
+                    index, values, columns = partition
+                    mask = (index[0] >= start_ns) & (index[0] <= end_ns)
+                    parts.append((index[:, mask], values[:, mask], columns))
+        if corrupt:
+            self._check_partitions(start, end)
+            raise Exception('Corrupt weather cache partitions in {}, they were removed and are fetched '
+                            'again on the next call'.format(self.path))
+        rb.cache.touch(self.path)
+
+        columns = []
+        for _, _, part_columns in parts:
+            columns += [c for c in part_columns if c not in columns]
+        if parts:
+            index = np.hstack([p[0] for p in parts])
+            # Each partition is converted on its own, so a compact dtype
+            # never needs the float64 values of the whole range at once
+            values = np.hstack([_align(p[1], p[2], columns).astype(dtype or 'float64', copy=False) for p in parts])
+        else:
+            index = np.empty((2, 0), dtype='int64')
+            values = np.empty((0, 0), dtype=dtype or 'float64')
+
+        df = pd.DataFrame(
+            values.T,
+            index=pd.MultiIndex.from_arrays([from_ns(index[0], tz), from_ns(index[1], tz)], names=INDEX_NAMES),
+            columns=columns,
+        )
+        return _restore_dtypes(df, manifest.get('dtypes', {}))
+
+    def _load_snapshot(self, start, end, dtype):
+        generation = self._read_manifest().get('generation', 0)
+        path = self._snapshot_path('{}-{}-{}-{}'.format(generation, start.value, end.value, dtype or 'float64'))
+        df = weather_store.read(path)
+        if df is None:
+            df = self.load(start, end, dtype)
+            try:
+                weather_store.write(path, df)
+            except OSError as e:
+                # e.g. data was stored meanwhile and removed the snapshots
+                print('Failed writing weather snapshot {}: {}'.format(path, e))
+                return df
+            self._prune_snapshots(path)
+            mapped = weather_store.read(path)
+            return df if mapped is None else mapped
+        return df
+
+    def _prune_snapshots(self, keep):
+        # Processes that mapped a removed snapshot keep their data
+        snapshots = []
+        for name in os.listdir(self._snapshot_path()):
+            path = self._snapshot_path(name)
+            if path == keep or name.endswith('.tmp'):
+                continue
+            try:
+                snapshots.append((os.stat(path).st_mtime, path))
+            except OSError:
+                pass
+        for _, path in sorted(snapshots)[:max(len(snapshots) + 1 - max_snapshots, 0)]:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def split_intervals(intervals, window):
+    """Split ref time intervals into windows of at most ``window``
+
+    Adjacent windows share their boundary, duplicate rows are dropped when
+    the windows are stored.
+
+    Args:
+        intervals (list): (start, end) tuples
+        window (str or pd.Timedelta): max length of a window, e.g. ``'30D'``
+
+    Returns:
+        list: (start, end) tuples of the windows
+    """
+    step = pd.Timedelta(window)
+    windows = []
+    for start, end in intervals:
+        while start + step < end:
+            windows.append((start, start + step))
+            start = start + step
+        windows.append((start, end))
+    return windows
+
+
+def _restore_dtypes(df, dtypes):
+    # Integer and bool columns without missing values get their dtype back
+    restore = {}
+    for name, values in df.items():
+        dtype = np.dtype(dtypes.get(name, 'float64'))
+        if dtype.kind in 'iub' and not values.isna().any():
+            restore[name] = dtype
+    return df.astype(restore) if restore else df
+
+
+def _align(values, columns, all_columns):
+    if columns == all_columns:
+        return values
+    aligned = np.full((len(all_columns), values.shape[1]), np.nan)
+    for i, c in enumerate(columns):
+        aligned[all_columns.index(c)] = values[i]
+    return aligned
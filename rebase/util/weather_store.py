@@ -0,0 +1,112 @@
+import json
+import os
+import shutil
+import threading
+import numpy as np
+import pandas as pd
+import rebase as rb
+from rebase.util.timestamps import to_ns, from_ns
+
+
+def _level_arrays(level):
+    # Datetime levels are stored as int64 ns, other levels as their values
+    if isinstance(level, pd.DatetimeIndex):
+        return to_ns(level), None if level.tz is None else str(level.tz)
+    values = np.asarray(level)
+    if values.dtype.kind not in 'iufb':
+        raise Exception('Can not store index level {} of dtype {}'.format(level.name, values.dtype))
+    return values, False
+
+
+def write(path, df):
+    """Write a frame as a memory mappable weather store
+
+    The store is a directory of ``.npy`` files: the values of all columns as
+    one (columns, rows) array, so every column is contiguous, and the levels
+    and codes of the index. The directory is written next to ``path`` and
+    renamed into place, so readers never see a partial store. If another
+    process wrote the store first, its store is kept.
+
+    Args:
+        path (str): directory of the store
+        df (pd.DataFrame): frame with numeric columns and a datetime or
+            numeric (Multi)Index
+    """
+    index = df.index if isinstance(df.index, pd.MultiIndex) else pd.MultiIndex.from_arrays([df.index])
+    dtypes = [values.dtype for _, values in df.items()]
+    if any(dtype.kind not in 'iufb' for dtype in dtypes):
+        raise Exception('Can not store non numeric columns')
+    meta = {
+        'columns': [str(c) for c in df.columns],
+        'names': list(df.index.names),
+        'multi': isinstance(df.index, pd.MultiIndex),
+        'tz': [],
+    }
+
+    tmp_path = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+    os.makedirs(tmp_path)
+    try:
+        for i, (level, codes) in enumerate(zip(index.levels, index.codes)):
+            values, tz = _level_arrays(level)
+            meta['tz'].append(tz)
+            np.save(os.path.join(tmp_path, 'level{}.npy'.format(i)), values)
+            np.save(os.path.join(tmp_path, 'codes{}.npy'.format(i)), np.asarray(codes))
+        values = df.to_numpy(dtype=np.result_type(*dtypes) if dtypes else 'float64').T
+        np.save(os.path.join(tmp_path, 'values.npy'), np.ascontiguousarray(values))
+        with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            if not os.path.isdir(path):
+                raise
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def _load(path, name, mmap):
+    return np.load(os.path.join(path, name), mmap_mode='r' if mmap else None)
+
+
+def read(path, mmap=True):
+    """Read a weather store
+
+    With ``mmap`` the arrays are memory mapped read-only, so the values and
+    index codes of the frame are views of the files in the page cache.
+    Processes reading the same store share one physical copy of the data
+    instead of each keeping a private copy. The frame can't be modified in
+    place, pandas copies the data that is written to.
+
+    Args:
+        path (str): directory of the store
+        mmap (bool): memory map the arrays instead of reading them
+
+    Returns:
+        pd.DataFrame: the frame, None if there is no store at ``path``. A
+        corrupt store is removed and None returned, so it is written again
+
+    Example::
+
+        >>> write(path, df)
+        >>> df = read(path)
+    """
+    try:
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        levels, codes = [], []
+        for i, tz in enumerate(meta['tz']):
+            values = _load(path, 'level{}.npy'.format(i), mmap)
+            levels.append(pd.Index(values) if tz is False else from_ns(values, tz))
+            codes.append(_load(path, 'codes{}.npy'.format(i), mmap))
+        values = _load(path, 'values.npy', mmap)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError) as e:
+        rb.cache.remove_corrupt(path, e, 'weather')
+        return None
+    rb.cache.touch(path)
+
+    index = pd.MultiIndex(levels=levels, codes=codes, names=meta['names'], verify_integrity=False)
+    if not meta['multi']:
+        index = index.get_level_values(0)
+    return pd.DataFrame(values.T, index=index, columns=meta['columns'], copy=False)
@@ -5,6 +5,7 @@ setup(
     url='https://github.com/rebaseenergy/rebase-sdk',
     packages=find_packages(exclude=["*tests*", "*debug*","*docs*"]),
     install_requires=['requests>=2.20.0', 'pandas>=1.0.0', 'dill'],
+    extras_require={'aio': ['aiohttp>=3.7.0']},
     include_package_data=True,
     version='0.0.4-beta',
     license='Apache 2.0',
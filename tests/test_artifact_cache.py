@@ -0,0 +1,84 @@
+import os
+import dill
+import numpy as np
+import pytest
+import rebase as rb
+import rebase.util.api_request as api_request
+import rebase.util.artifact_cache as artifact_cache
+import rebase.util.rate_limit as rate_limit
+from rebase.util.mock_api import MockAPI
+
+PATH = 'platform/v1/model/custom/download/trained/model'
+KEY = 'model/trained'
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    monkeypatch.setattr(rb, 'cache_dir', str(tmp_path))
+    monkeypatch.setattr(rate_limit, 'enabled', False)
+    artifact_cache.clear_memory()
+    with MockAPI(artifacts={('trained', 'model'): dill.dumps({'coef': np.arange(4.0)})}) as api:
+        yield api
+    artifact_cache.clear_memory()
+
+
+def downloads(api):
+    return api.calls[('GET', 'model/custom/download')]
+
+
+def statuses(monkeypatch):
+    # Status codes of the artifact responses
+    result = []
+    get = api_request.get
+
+    def recording_get(path, **kwargs):
+        r = get(path, **kwargs)
+        result.append(r.status_code)
+        return r
+
+    monkeypatch.setattr(api_request, 'get', recording_get)
+    return result
+
+
+def test_unchanged_artifact_is_revalidated(api, monkeypatch):
+    status = statuses(monkeypatch)
+    first = artifact_cache.load(KEY, PATH)
+    np.testing.assert_array_equal(first['coef'], np.arange(4.0))
+    second = artifact_cache.load(KEY, PATH)
+    assert status == [200, 304]
+    # Same content hash, the deserialized object is reused
+    assert second is first
+
+    artifact_cache.clear_memory()
+    third = artifact_cache.load(KEY, PATH)
+    assert status == [200, 304, 304]
+    np.testing.assert_array_equal(third['coef'], np.arange(4.0))
+
+
+def test_changed_artifact_is_downloaded(api, monkeypatch):
+    status = statuses(monkeypatch)
+    artifact_cache.load(KEY, PATH)
+    api.artifacts[('trained', 'model')] = dill.dumps({'coef': np.zeros(2)})
+    np.testing.assert_array_equal(artifact_cache.load(KEY, PATH)['coef'], np.zeros(2))
+    assert status == [200, 200]
+
+
+def test_fresh_artifact_is_not_revalidated(api):
+    artifact_cache.load(KEY, PATH, max_age=60)
+    artifact_cache.load(KEY, PATH, max_age=60)
+    assert downloads(api) == 1
+    artifact_cache.load(KEY, PATH, max_age=0)
+    assert downloads(api) == 2
+
+
+def test_truncated_artifact_is_downloaded_again(api, monkeypatch):
+    status = statuses(monkeypatch)
+    artifact_cache.load(KEY, PATH)
+    artifact_dir = os.path.join(rb.cache_dir, 'artifacts')
+    file_path, = [os.path.join(artifact_dir, f) for f in os.listdir(artifact_dir) if f.endswith('.pkl')]
+    with open(file_path, 'r+b') as f:
+        f.truncate(10)
+    artifact_cache.clear_memory()
+    np.testing.assert_array_equal(artifact_cache.load(KEY, PATH)['coef'], np.arange(4.0))
+    # Without a valid file nothing is revalidated, the artifact is downloaded
+    assert status == [200, 200]
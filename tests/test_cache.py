@@ -0,0 +1,107 @@
+import os
+import pickle
+import threading
+import time
+import pytest
+import rebase as rb
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(rb, 'cache_dir', str(tmp_path))
+    return tmp_path
+
+
+def lock_files(cache_dir):
+    return os.listdir(os.path.join(cache_dir, 'locks'))
+
+
+def add_entry(cache_dir, name, used, kind='nwp'):
+    path = os.path.join(cache_dir, kind, 'model', name) if kind == 'nwp' else os.path.join(cache_dir, kind, name)
+    os.makedirs(path)
+    with open(os.path.join(path, 'data.npy'), 'wb') as f:
+        f.write(b'0' * 1000)
+    os.utime(path, (used, used))
+    return path
+
+
+def test_prune_removes_lock_files_of_evicted_entries(cache_dir):
+    now = time.time()
+    paths = [add_entry(cache_dir, 'query{}'.format(i), now - 100 + i) for i in range(4)]
+    for path in paths:
+        with rb.cache.lock(path):
+            pass
+    assert rb.cache.stats()['kinds']['locks']['entries'] == 4
+
+    result = rb.cache.prune(max_bytes=2500)
+    assert result['removed'] == 2
+    assert sorted(os.listdir(os.path.join(cache_dir, 'nwp', 'model'))) == ['query2', 'query3']
+    # The lock files of the remaining entries and of prune itself
+    assert rb.cache.stats()['kinds']['locks']['entries'] == 3
+
+
+def test_prune_keeps_observation_stores(cache_dir):
+    now = time.time()
+    add_entry(cache_dir, 'site', now - 100, kind='observations')
+    add_entry(cache_dir, 'query', now)
+    result = rb.cache.prune(max_bytes=0)
+    assert result['removed'] == 1
+    assert os.listdir(os.path.join(cache_dir, 'observations')) == ['site']
+
+
+def test_prune_removes_unused_lock_files(cache_dir):
+    path = add_entry(cache_dir, 'query', time.time())
+    with rb.cache.lock(os.path.join(cache_dir, 'nwp', 'model', 'removed')):
+        pass
+    with rb.cache.lock(path):
+        pass
+    rb.cache.prune(max_bytes=None)
+    assert len(lock_files(cache_dir)) == 2
+
+
+def test_lock_waiting_on_removed_lock_file_stays_exclusive(cache_dir):
+    path = add_entry(cache_dir, 'query', time.time())
+    held = threading.Event()
+    release = threading.Event()
+
+    def wait_and_hold():
+        with rb.cache.lock(path):
+            held.set()
+            release.wait()
+
+    with rb.cache.lock(path):
+        thread = threading.Thread(target=wait_and_hold)
+        thread.start()
+        time.sleep(0.1)
+        # Like prune() evicting the entry while the thread waits
+        rb.cache._remove_lock_file(path)
+    held.wait()
+    try:
+        with rb.cache.lock(path, blocking=False) as acquired:
+            assert not acquired
+    finally:
+        release.set()
+        thread.join()
+
+
+def test_read_checked_removes_corrupt_files(cache_dir):
+    path = os.path.join(cache_dir, 'entry.pickle')
+    rb.cache.write_checked(path, lambda f: pickle.dump({'a': 1}, f))
+    assert rb.cache.read_checked(path, pickle.load) == {'a': 1}
+    with open(path, 'r+b') as f:
+        f.seek(-1, os.SEEK_END)
+        f.write(b'x')
+    assert rb.cache.read_checked(path, pickle.load) is None
+    assert not os.path.exists(path)
+
+
+def test_read_checked_keeps_files_on_other_errors(cache_dir):
+    path = os.path.join(cache_dir, 'entry.pickle')
+    rb.cache.write_checked(path, lambda f: pickle.dump({'a': 1}, f))
+
+    def load(f):
+        raise ImportError('No module named model')
+
+    with pytest.raises(ImportError):
+        rb.cache.read_checked(path, load)
+    assert os.path.exists(path)
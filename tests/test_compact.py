@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+import rebase as rb
+import rebase.util.rate_limit as rate_limit
+from rebase.util.compact import compact, memory_report
+from rebase.util.mock_api import MockAPI
+
+
+def forecast_frame():
+    site_ids = np.repeat(['a', 'b'], 96)
+    valid_time = np.tile(pd.date_range('2021-01-01', periods=96, freq='15min', tz='UTC'), 2)
+    index = pd.MultiIndex.from_arrays([site_ids, valid_time], names=['site_id', 'valid_time'])
+    return pd.DataFrame({
+        'forecast': np.linspace(0, 1000, len(index)),
+        'count': np.arange(len(index), dtype='int64'),
+        'ref_time': np.repeat(np.array(['2021-01-01T00:00:00Z', '2021-01-01T06:00:00Z'], dtype=object), 96),
+    }, index=index)
+
+
+@pytest.mark.parametrize('dtype', ['float32', 'float64'])
+def test_compact_round_trip(dtype):
+    df = forecast_frame()
+    result = compact(df, dtype)
+    assert result['forecast'].dtype == dtype
+    assert result['count'].dtype == 'int16'
+    assert result['ref_time'].dtype.kind == 'M'
+
+    np.testing.assert_allclose(result['forecast'].to_numpy(dtype='float64'), df['forecast'].to_numpy(), rtol=1e-6)
+    np.testing.assert_array_equal(result['count'].to_numpy(dtype='int64'), df['count'].to_numpy())
+    assert list(result['ref_time'].unique()) == [pd.Timestamp('2021-01-01T00:00:00Z'), pd.Timestamp('2021-01-01T06:00:00Z')]
+    assert result.index.equals(df.index)
+    assert list(result.index.levels[0]) == ['a', 'b']
+
+
+def test_compact_uses_less_memory():
+    df = forecast_frame()
+    assert memory_report(compact(df))['total'] < memory_report(df)['total'] / 2
+
+
+def test_compact_keeps_other_columns():
+    df = pd.DataFrame({'name': ['x', 'y'], 'value': np.array([1.5, 2.5], dtype='float32')})
+    result = compact(df)
+    pd.testing.assert_frame_equal(result, df)
+
+
+def test_observation_many_dtype(tmp_path, monkeypatch):
+    monkeypatch.setattr(rb, 'cache_dir', str(tmp_path))
+    monkeypatch.setattr(rate_limit, 'enabled', False)
+    with MockAPI(n_sites=2) as api:
+        site_ids = list(api.sites)
+        full = rb.Site.observation_many(site_ids, '2021-01-01', '2021-01-02')
+        small = rb.Site.observation_many(site_ids, '2021-01-01', '2021-01-02', dtype='float32')
+    assert small['observation'].dtype == 'float32'
+    assert small.index.equals(full.index)
+    np.testing.assert_allclose(small['observation'].to_numpy(dtype='float64'), full['observation'].to_numpy(), rtol=1e-6)
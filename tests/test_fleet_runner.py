@@ -0,0 +1,68 @@
+import dill
+import numpy as np
+import pytest
+import rebase as rb
+import rebase.util.rate_limit as rate_limit
+from rebase.util.mock_api import MockAPI
+
+
+class LinearModel(rb.Model):
+
+    def load_latest_data(self, site_config):
+        return rb.Weather.operational({'model': 'test', 'latitude': site_config['latitude']}), None
+
+    def preprocess(self, weather_df, observation_data=None):
+        return weather_df
+
+    def predict(self, model, dataset):
+        return dataset.to_numpy() @ model['coef']
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    monkeypatch.setattr(rb, 'cache_dir', str(tmp_path))
+    monkeypatch.setattr(rate_limit, 'enabled', False)
+    with MockAPI() as api:
+        yield api
+
+
+def add_models(api, site_ids):
+    code = dill.dumps(LinearModel, recurse=True)
+    trained = dill.dumps({'coef': np.ones(api.n_variables)})
+    return [api.add_model(site_id, code=code, trained=trained) for site_id in site_ids]
+
+
+def test_load_errors_by_model_id(api, monkeypatch):
+    get = rb.Site.get
+
+    def get_site(site_id, max_age=None):
+        if site_id == 'missing':
+            raise Exception('Site not found')
+        return get(site_id, max_age=max_age)
+
+    monkeypatch.setattr(rb.Site, 'get', get_site)
+    ok = add_models(api, list(api.sites)[:2])
+    no_site = add_models(api, ['missing', 'missing'])
+    fleet = rb.FleetRunner(ok + no_site + ['no-model'])
+
+    assert sorted(fleet.load_errors) == sorted(no_site + ['no-model'])
+    result = fleet.run()
+    assert sorted(result['forecasts']) == sorted(ok)
+    assert result['errors'] == {}
+    assert sorted(result['load_errors']) == sorted(no_site + ['no-model'])
+
+
+def test_errors_reset_every_run(api):
+    model_ids = add_models(api, list(api.sites)[:2])
+    fleet = rb.FleetRunner(model_ids)
+    runner = fleet.runners[model_ids[0]]
+    predict = runner.predict
+
+    def fail_once():
+        runner.predict = predict
+        raise Exception('Failed once')
+
+    runner.predict = fail_once
+    assert list(fleet.run()['errors']) == [model_ids[0]]
+    assert fleet.run()['errors'] == {}
+    assert fleet.errors == {}
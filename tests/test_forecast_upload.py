@@ -0,0 +1,80 @@
+import json
+import numpy as np
+import pandas as pd
+import pytest
+import rebase as rb
+import rebase.util.api_request as api_request
+import rebase.util.forecast_upload as forecast_upload
+import rebase.util.rate_limit as rate_limit
+from rebase.util.mock_api import MockAPI
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    monkeypatch.setattr(rb, 'cache_dir', str(tmp_path))
+    monkeypatch.setattr(rate_limit, 'enabled', False)
+    with MockAPI(keep_uploads=True) as api:
+        yield api
+
+
+def forecasts(n_ref_times, horizon=4):
+    ref = pd.date_range('2021-01-01', periods=n_ref_times, freq='6h', tz='UTC')
+    rows = [(r, v) for r in ref for v in pd.date_range(r, periods=horizon, freq='1h')]
+    index = pd.MultiIndex.from_tuples(rows, names=['ref_datetime', 'valid_datetime'])
+    # Unsorted rows, batches are sorted by ref time
+    return pd.DataFrame({'forecast': np.arange(len(index), dtype='float64')}, index=index).iloc[::-1]
+
+
+def test_batches_are_bounded_by_ref_times():
+    batches = list(forecast_upload.iter_batches(forecasts(10), max_ref_times=3))
+    assert [len(b) for b in batches] == [3, 3, 3, 1]
+    ref_times = [ref_time for b in batches for ref_time, _ in b]
+    assert ref_times == sorted(ref_times)
+    assert ref_times[0] == '20210101T00:00:00Z'
+
+
+def test_batches_are_bounded_by_bytes():
+    # Same size for every ref time
+    df = forecasts(10).assign(forecast=1.0)
+    size = len(next(forecast_upload.iter_batches(df))[0][1])
+    batches = list(forecast_upload.iter_batches(df, max_batch_bytes=2 * size + 1))
+    assert [len(b) for b in batches] == [2] * 5
+    # A ref time larger than the limit still gets its own batch
+    assert [len(b) for b in forecast_upload.iter_batches(forecasts(3), max_batch_bytes=1)] == [1, 1, 1]
+
+
+def test_encoded_forecast():
+    df = forecasts(1, horizon=2)
+    df.iloc[0, 0] = np.nan
+    (ref_time, encoded), = next(forecast_upload.iter_batches(df))
+    assert json.loads(encoded.replace('NaN', 'null')) == {
+        'ref_time': '20210101T00:00:00Z',
+        'valid_time': ['20210101T00:00:00Z', '20210101T01:00:00Z'],
+        'forecast': [0.0, None],
+    }
+
+
+def test_upload_posts_every_ref_time_once(api):
+    results = forecast_upload.upload([('model-a', forecasts(7)), ('model-b', forecasts(5))], max_ref_times=2)
+    assert all(r['ok'] for r in results)
+    assert sum(r['n_ref_times'] for r in results) == 12
+    assert api.calls[('POST', 'model/custom/forecast/upload')] == 12
+    uploaded = sorted((id, json.loads(body)['ref_time']) for id, body in api.uploads)
+    assert len(set(uploaded)) == 12
+    assert [id for id, _ in uploaded].count('model-a') == 7
+
+
+def test_failed_batches_are_reported(api, monkeypatch):
+    post = api_request.post
+
+    def failing_post(path, data=None, **kwargs):
+        if 'model-b' in path:
+            return type('Response', (), {'status_code': 500})()
+        return post(path, data=data, **kwargs)
+
+    monkeypatch.setattr(api_request, 'post', failing_post)
+    results = forecast_upload.upload([('model-a', forecasts(4)), ('model-b', forecasts(4))], max_ref_times=2)
+    assert {(r['model_id'], r['ok']) for r in results} == {('model-a', True), ('model-b', False)}
+    failed = [r for r in results if not r['ok']]
+    assert len(failed) == 2
+    assert all('status: 500' in str(r['error']) for r in failed)
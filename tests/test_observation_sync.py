@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+import pytest
+import rebase as rb
+import rebase.util.api_request as api_request
+import rebase.util.rate_limit as rate_limit
+from rebase.util.mock_api import MockAPI
+from rebase.util.observation_store import ObservationStore
+from rebase.util.timestamps import to_ns
+from rebase.util.weather_cache import to_timestamp
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    monkeypatch.setattr(rb, 'cache_dir', str(tmp_path))
+    monkeypatch.setattr(rate_limit, 'enabled', False)
+    with MockAPI() as api:
+        yield api
+
+
+def test_local_observation_of_unsynced_site_raises(api):
+    site_id = list(api.sites)[0]
+    with pytest.raises(Exception, match='sync_observations'):
+        rb.Site.observation(site_id, '2021-01-01', local=True)
+
+    start = pd.Timestamp.now(tz='UTC').floor('D') - pd.Timedelta('2D')
+    rb.Site.sync_observations(site_id, start_date=start)
+    df = rb.Site.observation(site_id, start, local=True)
+    assert len(df) > 0
+    assert df.index[0] == start
+
+
+def test_sync_starts_at_high_water_mark(api, monkeypatch):
+    site_id = list(api.sites)[0]
+    with pytest.raises(Exception, match='start_date is required'):
+        rb.Site.sync_observations(site_id)
+
+    now = pd.Timestamp.now(tz='UTC')
+    start = now.floor('D') - pd.Timedelta('3D')
+    n = rb.Site.sync_observations(site_id, start_date=start)
+    store = ObservationStore(site_id)
+    high_water = store.high_water()
+    assert now.floor('15min') <= high_water <= pd.Timestamp.now(tz='UTC')
+    assert len(store.load()) == n
+
+    starts = []
+    get = api_request.get
+
+    def recording_get(path, params=None, **kwargs):
+        starts.append(params['start_date'])
+        return get(path, params=params, **kwargs)
+
+    monkeypatch.setattr(api_request, 'get', recording_get)
+    rb.Site.sync_observations(site_id, lookback='2h')
+    assert to_timestamp(starts[-1]) == high_water - pd.Timedelta('2h')
+    # An explicit start after the lookback is used as is
+    rb.Site.sync_observations(site_id, start_date=high_water - pd.Timedelta('1h'), lookback='2h')
+    assert to_timestamp(starts[-1]) == high_water - pd.Timedelta('1h')
+
+    df = store.load()
+    assert df.index[0] == start
+    assert not df.index.duplicated().any()
+    assert df.index.is_monotonic_increasing
+    assert store.high_water() >= high_water
+
+
+def test_sync_replaces_revised_observations(api):
+    site_id = list(api.sites)[0]
+    start = pd.Timestamp.now(tz='UTC').floor('D') - pd.Timedelta('1D')
+    rb.Site.sync_observations(site_id, start_date=start)
+    store = ObservationStore(site_id)
+    high_water = store.high_water()
+    # Revise the stored values inside the lookback window
+    df = store.load()
+    store.replace(to_ns(df.index), np.full(len(df), -1.0), to_ns(df.index)[0], to_ns(df.index)[-1])
+
+    rb.Site.sync_observations(site_id, lookback='1h')
+    df = store.load()
+    assert (df.loc[high_water - pd.Timedelta('1h'):, 'observation'] >= 0).all()
+    assert (df.loc[:high_water - pd.Timedelta('75min'), 'observation'] == -1.0).all()
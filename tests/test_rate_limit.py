@@ -0,0 +1,55 @@
+import time
+from rebase.util.rate_limit import TokenBucket
+
+
+def bucket():
+    return TokenBucket(rate=20.0, burst=40, min_rate=0.5, max_rate=200.0, increase=20.0)
+
+
+def test_throttled_once_per_episode():
+    b = bucket()
+    sent = time.monotonic()
+    b.throttled(retry_after=0)
+    assert b.rate == 10.0
+    # Requests in flight when the rate was lowered
+    b.throttled(retry_after=0, sent=sent)
+    b.throttled(retry_after=0, sent=sent)
+    assert b.rate == 10.0
+
+    b.throttled(retry_after=0, sent=time.monotonic())
+    assert b.rate == 5.0
+
+
+def test_throttled_while_paused():
+    b = bucket()
+    b.throttled(retry_after=10)
+    b.throttled(retry_after=10, sent=time.monotonic())
+    assert b.rate == 10.0
+    assert b.paused()
+
+
+def test_succeeded_recovers_additively():
+    b = bucket()
+    b.rate = 0.5
+    for _ in range(10):
+        b.succeeded()
+    assert b.rate > 20.0
+    for _ in range(10000):
+        b.succeeded()
+    assert b.rate == 200.0
+
+
+def test_unthrottled_until_throttled():
+    b = TokenBucket(rate=None, burst=10, min_rate=0.5, max_rate=None, increase=20.0)
+    assert all(b.reserve() == 0 for _ in range(1000))
+    b.succeeded()
+    assert b.rate is None
+
+    b.throttled(retry_after=0)
+    # Half the rate the requests were sent at
+    assert 0.5 <= b.rate < float('inf')
+    assert b.reserve() >= 0
+    rate = b.rate
+    for _ in range(100):
+        b.succeeded()
+    assert b.rate > rate
@@ -0,0 +1,28 @@
+import numpy as np
+import pandas as pd
+from rebase.api.weather import records_to_df
+
+
+def test_records_with_same_keys():
+    data = [
+        {'ref_datetime': '2021-01-01T00:00:00Z', 'valid_datetime': '2021-01-01T01:00:00Z', 'temperature': 1.0},
+        {'ref_datetime': '2021-01-01T00:00:00Z', 'valid_datetime': '2021-01-01T02:00:00Z', 'temperature': 2.0},
+    ]
+    df = records_to_df(data)
+    assert list(df.columns) == ['temperature']
+    np.testing.assert_array_equal(df['temperature'].to_numpy(), [1.0, 2.0])
+
+
+def test_records_with_different_keys():
+    # Same number of keys but different names
+    data = [
+        {'ref_datetime': '2021-01-01T00:00:00Z', 'valid_datetime': '2021-01-01T01:00:00Z', 'temperature': 1.0},
+        {'ref_datetime': '2021-01-01T00:00:00Z', 'valid_datetime': '2021-01-01T02:00:00Z', 'wind_speed': 5.0},
+        {'ref_datetime': '2021-01-01T00:00:00Z', 'valid_datetime': '2021-01-01T03:00:00Z', 'temperature': 3.0},
+    ]
+    df = records_to_df(data)
+    assert list(df.columns) == ['temperature', 'wind_speed']
+    assert len(df) == 3
+    np.testing.assert_array_equal(df['temperature'].to_numpy(), [1.0, np.nan, 3.0])
+    np.testing.assert_array_equal(df['wind_speed'].to_numpy(), [np.nan, 5.0, np.nan])
+    assert df.index.get_level_values('valid_datetime')[-1] == pd.Timestamp('2021-01-01T03:00:00Z')
@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+import pytest
+from rebase.api.weather import resample
+
+
+def frame(tz):
+    ref = pd.DatetimeIndex(['2021-01-01', '2021-01-02'], tz=tz).as_unit('ns')
+    rows = [(r, v) for r in ref for v in pd.date_range(r, periods=48, freq='1h').as_unit('ns')]
+    index = pd.MultiIndex.from_tuples(rows, names=['ref_datetime', 'valid_datetime'])
+    return pd.DataFrame({'temperature': np.arange(len(index), dtype='float64')}, index=index)
+
+
+AGGS = ['mean', 'median', 'min', 'max', 'first', 'last', 'sum', 'count']
+
+
+def pandas_resample(df, resolution, agg='mean'):
+    return df.set_axis(df.index.get_level_values(1), axis=0) \
+             .groupby(df.index.get_level_values(0)) \
+             .resample(resolution).agg(agg) \
+             .groupby(level=0).transform(lambda g: g.interpolate(method='linear'))
+
+
+@pytest.mark.parametrize('agg', AGGS)
+@pytest.mark.parametrize('tz', [None, 'UTC', 'Europe/Stockholm'])
+@pytest.mark.parametrize('resolution', ['15min', '1h', '3h', '7h', 'D'])
+def test_resample_matches_pandas(tz, resolution, agg):
+    df = frame(tz)
+    expected = pandas_resample(df, resolution, agg)
+    expected.index.names = ['ref_datetime', 'valid_datetime']
+    pd.testing.assert_frame_equal(resample(df, resolution, agg), expected, check_index_type=False, check_freq=False)
+
+
+@pytest.mark.parametrize('agg', AGGS)
+def test_fast_and_pandas_paths_agree(agg):
+    # Bins without data, UTC takes the fast path and Stockholm the pandas one
+    df = frame('UTC').iloc[::3]
+    local = df.set_axis(pd.MultiIndex.from_arrays(
+        [df.index.get_level_values(i).tz_convert('Europe/Stockholm') for i in range(2)], names=df.index.names))
+    fast = resample(df, '1h', agg)
+    slow = resample(local, '1h', agg)
+    np.testing.assert_array_equal(fast.to_numpy(), slow.to_numpy())
+    assert fast.dtypes.equals(slow.dtypes)
+
+
+def test_resample_bins_start_at_midnight():
+    result = resample(frame('UTC'), '7h')
+    valid = result.loc[pd.Timestamp('2021-01-01', tz='UTC')].index
+    assert list(valid.hour[:4]) == [0, 7, 14, 21]
@@ -0,0 +1,119 @@
+import asyncio
+import threading
+import time
+import pytest
+from rebase.util.parallel import SingleFlight
+
+
+def wait_joined(flight, key, n):
+    # Until n callers wait for the running call
+    deadline = time.monotonic() + 5
+    while flight._calls.get(key, [None, 0])[1] < n:
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def run_concurrently(flight, key, func, n, copy=None):
+    results = [None] * n
+
+    def call(i):
+        try:
+            results[i] = flight.do(key, func, copy=copy)
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(n)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def test_concurrent_calls_are_coalesced():
+    flight = SingleFlight('test')
+    release = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        release.wait(5)
+        return {'value': 1}
+
+    threads, results = run_concurrently(flight, 'a', fetch, 5, copy=dict)
+    try:
+        wait_joined(flight, 'a', 4)
+    finally:
+        release.set()
+        for thread in threads:
+            thread.join()
+    assert len(calls) == 1
+    assert all(r == {'value': 1} for r in results)
+    # Every caller got its own copy
+    assert len(set(map(id, results))) == 5
+
+    # A call after the shared one finished runs again
+    assert flight.do('a', fetch) == {'value': 1}
+    assert len(calls) == 2
+
+
+def test_different_keys_are_not_coalesced():
+    flight = SingleFlight('test')
+    calls = []
+    for key in ['a', 'b', 'a']:
+        flight.do(key, calls.append, key)
+    assert calls == ['a', 'b', 'a']
+
+
+def test_exceptions_are_shared():
+    flight = SingleFlight('test')
+    release = threading.Event()
+
+    def fetch():
+        release.wait(5)
+        raise ValueError('failed')
+
+    threads, results = run_concurrently(flight, 'a', fetch, 3)
+    try:
+        wait_joined(flight, 'a', 2)
+    finally:
+        release.set()
+        for thread in threads:
+            thread.join()
+    assert all(isinstance(r, ValueError) for r in results)
+    assert flight._calls == {}
+
+
+def test_async_calls_are_coalesced():
+    flight = SingleFlight('test')
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return [1, 2]
+
+    async def main():
+        return await asyncio.gather(*[flight.do_async('a', fetch, copy=list) for _ in range(4)])
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert results == [[1, 2]] * 4
+    assert len(set(map(id, results))) == 4
+
+
+def test_async_cancelled_leader_cancels_waiters():
+    flight = SingleFlight('test')
+
+    async def fetch():
+        await asyncio.sleep(10)
+
+    async def main():
+        leader = asyncio.ensure_future(flight.do_async('a', fetch))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.do_async('a', fetch))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await follower
+
+    asyncio.run(main())
+    assert flight._calls == {}
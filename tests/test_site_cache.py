@@ -0,0 +1,80 @@
+import time
+import pytest
+import rebase as rb
+import rebase.util.rate_limit as rate_limit
+import rebase.util.site_cache as site_cache
+from rebase.util.mock_api import MockAPI
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    monkeypatch.setattr(rb, 'cache_dir', str(tmp_path))
+    monkeypatch.setattr(rate_limit, 'enabled', False)
+    site_cache.invalidate()
+    with MockAPI(n_sites=3) as api:
+        yield api
+    site_cache.invalidate()
+
+
+def fetches(api):
+    return api.calls[('GET', 'site')]
+
+
+def test_configs_are_fetched_again_after_ttl(api, monkeypatch):
+    monkeypatch.setattr(site_cache, 'ttl', 0.2)
+    site_id = list(api.sites)[0]
+    assert rb.Site.get(site_id) == api.sites[site_id]
+    rb.Site.get(site_id)
+    assert fetches(api) == 1
+    time.sleep(0.3)
+    rb.Site.get(site_id)
+    assert fetches(api) == 2
+
+
+def test_max_age(api):
+    site_id = list(api.sites)[0]
+    rb.Site.get(site_id)
+    rb.Site.get(site_id, max_age=60)
+    assert fetches(api) == 1
+    rb.Site.get(site_id, max_age=0)
+    assert fetches(api) == 2
+
+
+def test_no_ttl_disables_the_cache(api, monkeypatch):
+    monkeypatch.setattr(site_cache, 'ttl', None)
+    site_id = list(api.sites)[0]
+    rb.Site.get(site_id)
+    rb.Site.get(site_id)
+    assert fetches(api) == 2
+
+
+def test_cached_configs_are_copies(api):
+    site_id = list(api.sites)[0]
+    rb.Site.get(site_id)['latitude'] = 0
+    assert rb.Site.get(site_id)['latitude'] == api.sites[site_id]['latitude']
+
+
+def test_list_warms_and_delete_invalidates(api):
+    site_ids = list(api.sites)
+    rb.Site.list()
+    for site_id in site_ids:
+        rb.Site.get(site_id)
+    assert fetches(api) == 0
+
+    rb.Site.delete(site_ids[0])
+    assert site_cache.get(site_ids[0]) is None
+    assert site_cache.get(site_ids[1]) is not None
+
+
+def test_persisted_configs_are_shared(api, monkeypatch):
+    monkeypatch.setattr(site_cache, 'persist', True)
+    site_id = list(api.sites)[0]
+    rb.Site.get(site_id)
+    # Another process only has the file
+    monkeypatch.setattr(site_cache, '_configs', {})
+    assert rb.Site.get(site_id) == api.sites[site_id]
+    assert fetches(api) == 1
+
+    site_cache.invalidate(site_id)
+    rb.Site.get(site_id)
+    assert fetches(api) == 2
@@ -0,0 +1,28 @@
+import pytest
+import rebase as rb
+import rebase.util.rate_limit as rate_limit
+from rebase.util.mock_api import MockAPI
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    monkeypatch.setattr(rb, 'cache_dir', str(tmp_path))
+    monkeypatch.setattr(rate_limit, 'enabled', False)
+    with MockAPI(n_sites=3) as api:
+        yield api
+
+
+def test_forecast_many_fetches_duplicates_once(api):
+    a, b, c = list(api.sites)
+    df = rb.Site.forecast_many([b, a, b, c, a])
+    assert api.calls[('GET', 'site/forecast/latest')] == 3
+    assert list(df.index.get_level_values('site_id').unique()) == [b, a, c]
+    assert not df.index.duplicated().any()
+
+
+def test_observation_many_fetches_duplicates_once(api):
+    a, b, _ = list(api.sites)
+    df = rb.Site.observation_many([a, a, b], '2021-01-01', '2021-01-02')
+    assert api.calls[('GET', 'site/observation')] == 2
+    assert list(df.index.get_level_values('site_id').unique()) == [a, b]
+    assert len(df) == 2 * len(df.loc[a])
@@ -0,0 +1,101 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import rebase as rb
+import rebase.util.api_request as api_request
+import rebase.util.rate_limit as rate_limit
+from rebase.util.mock_api import MockAPI
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    monkeypatch.setattr(rb, 'cache_dir', str(tmp_path))
+    monkeypatch.setattr(rate_limit, 'enabled', False)
+    with MockAPI(keep_uploads=True) as api:
+        yield api
+
+
+def measurements(tz, periods=96):
+    valid_time = pd.date_range('2021-03-27', periods=periods, freq='1h', tz=tz)
+    return pd.DataFrame({'valid_time': valid_time, 'observation': np.arange(periods, dtype='float64')})
+
+
+def uploaded(api):
+    bodies = [json.loads(body) for _, body in api.uploads]
+    return sorted(t for body in bodies for t in body['valid_time']), bodies
+
+
+@pytest.mark.parametrize('tz', [None, 'UTC', 'Europe/Stockholm'])
+def test_upload_and_upload_stream_send_same_times(api, tz):
+    site_id = list(api.sites)[0]
+    df = measurements(tz)
+    rb.Site.upload(site_id, df)
+    upload, _ = uploaded(api)
+    api.uploads.clear()
+    rb.Site.upload_stream(site_id, df, chunk_freq='1D')
+    stream, _ = uploaded(api)
+    assert upload == stream
+    assert upload[0] == ('2021-03-27T00:00:00Z' if tz != 'Europe/Stockholm' else '2021-03-26T23:00:00Z')
+
+
+def fail_chunks(monkeypatch, days):
+    # Chunks with valid times on these days answer 500, bodies are not
+    # compressed by default
+    post = api_request.post
+
+    def failing_post(path, data=None, **kwargs):
+        if any(day in data for day in days):
+            return type('Response', (), {'status_code': 500})()
+        return post(path, data=data, **kwargs)
+
+    monkeypatch.setattr(api_request, 'post', failing_post)
+    return post
+
+
+def test_upload_stream_resumes_unacknowledged_chunks(api, monkeypatch):
+    site_id = list(api.sites)[0]
+    df = measurements('UTC')
+    post = fail_chunks(monkeypatch, [b'2021-03-28', b'2021-03-30'])
+    with pytest.raises(Exception, match='2 of 4 chunks'):
+        rb.Site.upload_stream(site_id, df, chunk_freq='1D', n_jobs=1)
+    assert len(os.listdir(os.path.join(rb.cache_dir, 'uploads'))) == 1
+    _, bodies = uploaded(api)
+    assert [body['valid_time'][0] for body in bodies] == ['2021-03-27T00:00:00Z', '2021-03-29T00:00:00Z']
+
+    api.uploads.clear()
+    monkeypatch.setattr(api_request, 'post', post)
+    rb.Site.upload_stream(site_id, df, chunk_freq='1D', n_jobs=1)
+    _, bodies = uploaded(api)
+    assert sorted(body['valid_time'][0] for body in bodies) == ['2021-03-28T00:00:00Z', '2021-03-30T00:00:00Z']
+    assert os.listdir(os.path.join(rb.cache_dir, 'uploads')) == []
+
+
+def test_upload_stream_sends_changed_values_again(api, monkeypatch):
+    site_id = list(api.sites)[0]
+    df = measurements('UTC')
+    post = fail_chunks(monkeypatch, [b'2021-03-28'])
+    with pytest.raises(Exception):
+        rb.Site.upload_stream(site_id, df, chunk_freq='1D', n_jobs=1)
+
+    api.uploads.clear()
+    monkeypatch.setattr(api_request, 'post', post)
+    corrected = df.assign(observation=df['observation'] + 1)
+    rb.Site.upload_stream(site_id, corrected, chunk_freq='1D')
+    _, bodies = uploaded(api)
+    assert len(bodies) == 4
+    assert min(body['measurement'][0] for body in bodies) == 1.0
+
+
+def test_upload_stream_without_resume_sends_everything(api, monkeypatch):
+    site_id = list(api.sites)[0]
+    df = measurements('UTC')
+    post = fail_chunks(monkeypatch, [b'2021-03-28'])
+    with pytest.raises(Exception):
+        rb.Site.upload_stream(site_id, df, chunk_freq='1D')
+
+    api.uploads.clear()
+    monkeypatch.setattr(api_request, 'post', post)
+    rb.Site.upload_stream(site_id, df, chunk_freq='1D', resume=False)
+    assert len(api.uploads) == 4
@@ -0,0 +1,161 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import rebase as rb
+import rebase.util.weather_cache as weather_cache
+from rebase.util.weather_cache import WeatherCache, to_timestamp, format_timestamp
+
+PARAMS = {'model': 'test', 'latitude': 1.0, 'start_date': '2020-01-01T00:00:00Z', 'end_date': '2020-03-31T00:00:00Z'}
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(rb, 'cache_dir', str(tmp_path))
+    return tmp_path
+
+
+def ts(value):
+    return to_timestamp(value)
+
+
+def frame(start, end, value=1.0, columns=('temperature',)):
+    ref = pd.date_range(start, end, freq='1D', tz='UTC').as_unit('ns')
+    index = pd.MultiIndex.from_arrays([ref.repeat(2), (ref.repeat(2) + pd.to_timedelta(np.tile([0, 1], len(ref)), unit='h'))],
+                                      names=['ref_datetime', 'valid_datetime'])
+    return pd.DataFrame({c: np.full(len(index), value) for c in columns}, index=index)
+
+
+def test_missing_sub_range_and_overlap():
+    cache = WeatherCache(PARAMS)
+    assert cache.missing() == [(ts('2020-01-01'), ts('2020-03-31'))]
+
+    cache.store(frame('2020-01-10', '2020-01-20'), ts('2020-01-10'), ts('2020-01-20'))
+    cache.store(frame('2020-02-01', '2020-02-10'), ts('2020-02-01'), ts('2020-02-10'))
+    assert cache.missing() == [(ts('2020-01-01'), ts('2020-01-10')),
+                               (ts('2020-01-20'), ts('2020-02-01')),
+                               (ts('2020-02-10'), ts('2020-03-31'))]
+    # Sub range that is fully cached
+    assert cache.missing(ts('2020-01-12'), ts('2020-01-18')) == []
+
+    # Overlapping store merges the intervals
+    cache.store(frame('2020-01-15', '2020-02-05'), ts('2020-01-15'), ts('2020-02-05'))
+    assert cache.missing(ts('2020-01-10'), ts('2020-02-10')) == []
+
+
+def test_overlap_keeps_latest_values():
+    cache = WeatherCache(PARAMS)
+    cache.store(frame('2020-01-01', '2020-01-10', value=1.0), ts('2020-01-01'), ts('2020-01-10'))
+    cache.store(frame('2020-01-05', '2020-01-15', value=2.0), ts('2020-01-05'), ts('2020-01-15'))
+    df = cache.load(ts('2020-01-01'), ts('2020-01-15'))
+    assert not df.index.duplicated().any()
+    assert df.index.is_monotonic_increasing
+    assert len(df) == 15 * 2
+    ref = df.index.get_level_values(0)
+    assert (df.loc[ref < ts('2020-01-05'), 'temperature'] == 1.0).all()
+    assert (df.loc[ref >= ts('2020-01-05'), 'temperature'] == 2.0).all()
+
+
+def test_runs_published_later_are_fetched(monkeypatch):
+    monkeypatch.setattr(weather_cache, 'publish_lag', pd.Timedelta('3D'))
+    now = pd.Timestamp.now(tz='UTC').floor('D')
+    params = dict(PARAMS, start_date=format_timestamp(now - pd.Timedelta('2D')), end_date=format_timestamp(now))
+    cache = WeatherCache(params)
+    start, end = cache.missing()[0]
+    # The run of today isn't published yet
+    cache.store(frame(start, now - pd.Timedelta('1D')), start, end)
+    assert cache.missing() == [(now - pd.Timedelta('1D'), now)]
+
+    cache.store(frame(now - pd.Timedelta('1D'), now), now - pd.Timedelta('1D'), now)
+    assert cache.missing() == []
+
+
+def test_empty_response_is_not_cached():
+    cache = WeatherCache(PARAMS)
+    cache.store(frame('2020-01-01', '2020-01-10').iloc[:0], ts('2020-01-01'), ts('2020-01-10'))
+    assert cache.missing() == [(ts('2020-01-01'), ts('2020-03-31'))]
+
+
+def test_load_sub_range():
+    cache = WeatherCache(PARAMS)
+    cache.store(frame('2020-01-01', '2020-03-31'), ts('2020-01-01'), ts('2020-03-31'))
+    df = cache.load(ts('2020-01-31'), ts('2020-02-02'))
+    assert list(df.index.get_level_values(0).unique()) == [ts('2020-01-31'), ts('2020-02-01'), ts('2020-02-02')]
+
+
+def test_dtypes_are_restored():
+    cache = WeatherCache(PARAMS)
+    df = frame('2020-01-01', '2020-01-05')
+    df['count'] = np.arange(len(df), dtype='int64')
+    df['flag'] = df['count'] % 2 == 0
+    cache.store(df, ts('2020-01-01'), ts('2020-01-05'))
+    loaded = cache.load(ts('2020-01-01'), ts('2020-01-05'))
+    assert loaded.dtypes.to_dict() == df.dtypes.to_dict()
+
+
+def test_non_numeric_frames_are_not_stored():
+    cache = WeatherCache(PARAMS)
+    df = frame('2020-01-01', '2020-01-05')
+    df['source'] = 'icon'
+    assert not cache.store(df, ts('2020-01-01'), ts('2020-01-05'))
+    assert not cache.columnar()
+    assert cache.missing() == [(ts('2020-01-01'), ts('2020-03-31'))]
+
+
+def test_snapshots_are_bounded(monkeypatch):
+    monkeypatch.setattr(weather_cache, 'max_snapshots', 2)
+    cache = WeatherCache(PARAMS)
+    cache.store(frame('2020-01-01', '2020-03-31'), ts('2020-01-01'), ts('2020-03-31'))
+    for day in range(1, 6):
+        df = cache.load(ts('2020-01-{:02d}'.format(day)), ts('2020-02-{:02d}'.format(day)), mmap=True)
+        assert df.index.get_level_values(0)[0] == ts('2020-01-{:02d}'.format(day))
+    assert len(os.listdir(os.path.join(cache.path, 'snapshots'))) == 2
+
+
+def corrupt(cache, month):
+    with open(os.path.join(cache.path, month, 'values.npy'), 'r+b') as f:
+        f.truncate(100)
+
+
+def test_corrupt_partition_is_fetched_again():
+    cache = WeatherCache(PARAMS)
+    cache.store(frame('2020-01-01', '2020-03-31'), ts('2020-01-01'), ts('2020-03-31'))
+    corrupt(cache, '2020-02')
+    assert cache.missing() == [(ts('2020-02-01'), ts('2020-03-01'))]
+    assert not os.path.exists(os.path.join(cache.path, '2020-02'))
+
+
+def test_corrupt_partition_on_load():
+    cache = WeatherCache(PARAMS)
+    cache.store(frame('2020-01-01', '2020-03-31'), ts('2020-01-01'), ts('2020-03-31'))
+    corrupt(cache, '2020-01')
+    with pytest.raises(Exception):
+        cache.load()
+    assert cache.missing() == [(ts('2020-01-01'), ts('2020-02-01'))]
+
+
+def test_corrupt_partition_on_merge_drops_its_month():
+    cache = WeatherCache(PARAMS)
+    cache.store(frame('2020-01-01', '2020-01-31'), ts('2020-01-01'), ts('2020-01-31'))
+    corrupt(cache, '2020-01')
+    # Stored without checking the partitions first, e.g. by another process
+    cache.store(frame('2020-01-20', '2020-01-25'), ts('2020-01-20'), ts('2020-01-25'))
+    missing = cache.missing(ts('2020-01-01'), ts('2020-01-31'))
+    assert missing == [(ts('2020-01-01'), ts('2020-01-20')), (ts('2020-01-25'), ts('2020-01-31'))]
+
+
+def test_historical_falls_back_to_pickle_for_non_numeric(monkeypatch):
+    from rebase.api.weather import Weather
+    df = frame('2020-01-01', '2020-03-31')
+    df['source'] = 'icon'
+    calls = []
+
+    def fetch(cls, params):
+        calls.append(params)
+        return df
+
+    monkeypatch.setattr(Weather, '_fetch_historical', classmethod(fetch))
+    pd.testing.assert_frame_equal(Weather.historical(PARAMS), df)
+    pd.testing.assert_frame_equal(Weather.historical(PARAMS), df)
+    # One fetch that couldn't be stored by range, one for the pickle, then cached
+    assert len(calls) == 2